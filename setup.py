@@ -178,6 +178,14 @@ setup(
         'PySide >= 1.2.2, < 2',
         'Riffle >= 0.1.0, < 2'
     ],
+    entry_points={
+        'console_scripts': [
+            'harmony = harmony.command:main'
+        ]
+    },
+    extras_require={
+        'watch': ['pyinotify >= 0.9, < 1']
+    },
     tests_require=[
         'pytest >= 2.3.5, < 3'
     ],
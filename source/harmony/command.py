@@ -0,0 +1,401 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import sys
+import json
+import argparse
+import collections
+import timeit
+
+from harmony.error import ManifestError
+from harmony.session import Session, FLUSH
+from harmony.schema import bundle, manifest, decoder
+from harmony.schema.collector import FilesystemCollector, BundleCollector
+from harmony.schema.processor import MixinProcessor, ValidateProcessor
+from harmony.schema.compiler import CompiledValidator
+
+
+#: Number of records that could not be validated to hold whilst earlier
+#: records are being validated before waiting for those to finish.
+PENDING_LIMIT = 1000
+
+
+def main(arguments=None):
+    '''Harmony command line interface.'''
+    if arguments is None:
+        arguments = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(prog='harmony', description=main.__doc__)
+    subparsers = parser.add_subparsers(title='commands')
+
+    bundle_parser = subparsers.add_parser(
+        'bundle',
+        help='Compile schemas into a bundle file.',
+        description=(
+            'Compile processed schemas from the schema search path into a '
+            'single bundle file for use with a BundleCollector.'
+        )
+    )
+    bundle_parser.add_argument('output', help='Path to bundle file.')
+    _add_path_argument(bundle_parser)
+    bundle_parser.add_argument(
+        '--check', action='store_true',
+        help=(
+            'Check whether existing bundle is stale rather than building. '
+            'Exit with status 1 if stale or missing.'
+        )
+    )
+    bundle_parser.set_defaults(handler=_bundle)
+
+    manifest_parser = subparsers.add_parser(
+        'manifest',
+        help='Write manifest files for schema directories.',
+        description=(
+            'Write a manifest listing the schema files, ids and content '
+            'hashes in each directory of the schema search path so that '
+            'collection can avoid walking the directory tree.'
+        )
+    )
+    _add_path_argument(manifest_parser)
+    manifest_parser.add_argument(
+        '--check', action='store_true',
+        help=(
+            'Check whether existing manifests are stale rather than writing. '
+            'Exit with status 1 if any are stale.'
+        )
+    )
+    manifest_parser.set_defaults(handler=_manifest)
+
+    validate_parser = subparsers.add_parser(
+        'validate',
+        help='Validate JSON Lines records against schemas.',
+        description=(
+            'Validate each record read from JSON Lines files (or standard '
+            'input) against the base schema, the schema identified by its '
+            'harmony_type and any additional schemas. Write a JSON Lines '
+            'result for each record in input order. Exit with status 1 if any '
+            'record is invalid.'
+        )
+    )
+    validate_parser.add_argument(
+        'files', nargs='*', metavar='FILE',
+        help='JSON Lines file to read. Use - or omit for standard input.'
+    )
+    _add_path_argument(validate_parser)
+    validate_parser.add_argument(
+        '--schema', action='append', dest='schemas', metavar='ID',
+        help=(
+            'Id of additional schema to validate against. Can be specified '
+            'multiple times.'
+        )
+    )
+    validate_parser.add_argument(
+        '--output',
+        help='Path to write results to. Defaults to standard output.'
+    )
+    validate_parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of worker processes to validate with.'
+    )
+    validate_parser.add_argument(
+        '--max-errors', type=_positive_integer,
+        help=(
+            'Stop validating a record once this many errors are found. Use 1 '
+            'to only check whether records are valid.'
+        )
+    )
+    validate_parser.add_argument(
+        '--compiled', action='store_true',
+        help='Validate with compiled schemas for speed.'
+    )
+    validate_parser.add_argument(
+        '--interval', type=float, default=10.0,
+        help=(
+            'Seconds between reports of throughput to standard error. Use 0 '
+            'to only report once finished.'
+        )
+    )
+    validate_parser.set_defaults(handler=_validate)
+
+    namespace = parser.parse_args(arguments)
+    return namespace.handler(namespace)
+
+
+def _add_path_argument(parser):
+    '''Add argument to *parser* for specifying schema search paths.'''
+    parser.add_argument(
+        '--path', action='append', dest='paths', metavar='PATH',
+        help=(
+            'Directory to search for schemas. Can be specified multiple '
+            'times. Defaults to HARMONY_SCHEMA_PATH.'
+        )
+    )
+
+
+def _positive_integer(value):
+    '''Return *value* as integer, raising ArgumentTypeError if not positive.'''
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            '{0!r} is not a positive integer'.format(value)
+        )
+
+    return number
+
+
+def _collector(namespace):
+    '''Return FilesystemCollector for paths specified in *namespace*.'''
+    paths = namespace.paths
+    if not paths:
+        paths = os.environ.get(
+            'HARMONY_SCHEMA_PATH', Session.DEFAULT_SCHEMA_PATH
+        ).split(os.pathsep)
+
+    return FilesystemCollector(paths)
+
+
+def _bundle(namespace):
+    '''Build or check bundle according to *namespace*.'''
+    collector = _collector(namespace)
+
+    if namespace.check:
+        if not os.path.isfile(namespace.output):
+            print('{0} is missing.'.format(namespace.output))
+            return 1
+
+        if BundleCollector(namespace.output).is_stale(collector):
+            print('{0} is stale.'.format(namespace.output))
+            return 1
+
+        print('{0} is up to date.'.format(namespace.output))
+        return 0
+
+    bundle.build(
+        namespace.output, collector, [ValidateProcessor(), MixinProcessor()]
+    )
+    return 0
+
+
+def _manifest(namespace):
+    '''Write or check manifests according to *namespace*.'''
+    collector = _collector(namespace)
+
+    status = 0
+    for path in collector.paths:
+        try:
+            if namespace.check:
+                if manifest.is_stale(path):
+                    print('{0} is stale.'.format(manifest.path(path)))
+                    status = 1
+                else:
+                    print('{0} is up to date.'.format(manifest.path(path)))
+
+            else:
+                print('Wrote {0}.'.format(manifest.write(path)))
+
+        except ManifestError as error:
+            print(error)
+            status = 1
+
+    return status
+
+
+def _validate(namespace):
+    '''Validate records according to *namespace*.'''
+    validator_class = None
+    if namespace.compiled:
+        validator_class = CompiledValidator
+
+    session = Session(
+        collector=_collector(namespace), validator_class=validator_class
+    )
+
+    for schema_id in namespace.schemas or []:
+        try:
+            session.schemas.get(schema_id)
+        except KeyError:
+            sys.stderr.write('Unknown schema {0}.\n'.format(schema_id))
+            return 2
+
+    output = sys.stdout
+    if namespace.output:
+        output = open(namespace.output, 'w')
+
+    counts = {'records': 0, 'invalid': 0}
+
+    def write(source, number, errors):
+        '''Write result for record and update counts.'''
+        output.write(json.dumps({
+            'source': source,
+            'line': number,
+            'valid': not errors,
+            'errors': errors
+        }))
+        output.write('\n')
+
+        counts['records'] += 1
+        if errors:
+            counts['invalid'] += 1
+
+    # Records read but not yet written, with any problem that prevented
+    # validation, in input order. Results for records that could not be
+    # validated are only held whilst records before them are being
+    # validated, and at most PENDING_LIMIT of them.
+    pending = collections.deque()
+    held = {'problems': 0}
+
+    def instances():
+        '''Yield records to validate, noting each record in pending.
+
+        Records that cannot be validated are not yielded. Their result is
+        written directly if no earlier record is awaiting validation.
+        Otherwise, once PENDING_LIMIT such records are held, FLUSH is yielded
+        so that earlier records finish validating and held results can be
+        written.
+
+        '''
+        for source, number, line in _read_lines(namespace.files):
+            if not line.strip():
+                continue
+
+            instance, problem = _decode_record(line, session)
+            if problem is None:
+                pending.append((source, number, None))
+                yield instance
+
+            elif pending:
+                pending.append((source, number, problem))
+                held['problems'] += 1
+                if held['problems'] >= PENDING_LIMIT:
+                    yield FLUSH
+
+            else:
+                write(source, number, [_problem(problem)])
+
+    def write_problems():
+        '''Write results for records at front of pending with a problem.'''
+        while pending and pending[0][2] is not None:
+            source, number, problem = pending.popleft()
+            held['problems'] -= 1
+            write(source, number, [_problem(problem)])
+
+    start = timeit.default_timer()
+    reported = start
+
+    try:
+        results = session.validate_many(
+            instances(), namespace.schemas, workers=namespace.workers,
+            max_errors=namespace.max_errors
+        )
+        for _, errors in results:
+            source, number, _ = pending.popleft()
+            write(source, number, [_error(error) for error in errors])
+            write_problems()
+
+            now = timeit.default_timer()
+            if namespace.interval and now - reported >= namespace.interval:
+                _report_throughput(counts, now - start)
+                reported = now
+
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    _report_throughput(counts, timeit.default_timer() - start)
+
+    if counts['invalid']:
+        return 1
+
+    return 0
+
+
+def _read_lines(paths):
+    '''Yield (source, line number, line) from files at *paths*.
+
+    Read from standard input if *paths* is empty or for a path of -.
+
+    '''
+    for path in paths or ['-']:
+        if path == '-':
+            for number, line in enumerate(sys.stdin, 1):
+                yield '<stdin>', number, line
+
+            continue
+
+        with open(path, 'r') as file_handler:
+            for number, line in enumerate(file_handler, 1):
+                yield path, number, line
+
+
+def _decode_record(line, session):
+    '''Return (instance, problem) for record *line*.
+
+    problem is a message describing why the record cannot be validated
+    against *session*, or None if it can be.
+
+    '''
+    try:
+        instance = decoder.loads(line)
+    except ValueError as error:
+        return None, 'Invalid JSON: {0}'.format(error)
+
+    if not isinstance(instance, dict):
+        return None, 'Record is not a JSON object'
+
+    harmony_type = instance.get('harmony_type')
+    if harmony_type is None:
+        return None, 'Record has no harmony_type'
+
+    if not isinstance(harmony_type, basestring):
+        return None, 'harmony_type {0!r} is not a string'.format(harmony_type)
+
+    try:
+        session.schemas.get(harmony_type)
+    except KeyError:
+        return None, 'Unknown harmony_type {0!r}'.format(harmony_type)
+
+    return instance, None
+
+
+def _error(error):
+    '''Return validation *error* as JSON serialisable dictionary.'''
+    return {
+        'message': error.message,
+        'path': list(error.path),
+        'schema_path': list(error.schema_path),
+        'validator': error.validator
+    }
+
+
+def _problem(message):
+    '''Return error dictionary for record that could not be validated.'''
+    return {
+        'message': message,
+        'path': [],
+        'schema_path': [],
+        'validator': None
+    }
+
+
+def _report_throughput(counts, duration):
+    '''Write record *counts* and throughput over *duration* to stderr.'''
+    rate = 0
+    if duration > 0:
+        rate = counts['records'] / duration
+
+    sys.stderr.write(
+        'Validated {0} records ({1} invalid) in {2:.1f}s '
+        '({3:.0f} records/s).\n'.format(
+            counts['records'], counts['invalid'], duration, rate
+        )
+    )
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
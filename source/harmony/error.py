@@ -13,3 +13,30 @@ class SchemaConflictError(HarmonyError):
 
 class PublisherError(HarmonyError):
     '''Raise when a general publisher error occurs.'''
+
+
+class BundleError(HarmonyError):
+    '''Raise when a schema bundle is invalid or incompatible.'''
+
+
+class MixinCycleError(HarmonyError):
+    '''Raise when schemas mix each other in cyclically.'''
+
+    def __init__(self, chain):
+        '''Initialise with *chain* of schema ids forming the cycle.
+
+        The first and last ids in *chain* will be the same.
+
+        '''
+        self.chain = chain
+        super(MixinCycleError, self).__init__(
+            'Mixin cycle detected: {0}'.format(' -> '.join(chain))
+        )
+
+
+class ManifestError(HarmonyError):
+    '''Raise when a manifest cannot be generated.'''
+
+
+class ResolutionError(HarmonyError):
+    '''Raise when a reference to an external document cannot be resolved.'''
@@ -0,0 +1,159 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import heapq
+import contextlib
+import timeit
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+
+class Instrumentation(object):
+    '''Record where time is spent refreshing a session.
+
+    Stages of a refresh, such as collecting and running each processor, are
+    timed in wall clock and CPU time along with the number of schemas they
+    handled. Collectors and processors may also record the time taken for
+    individual files or schemas, of which the slowest are reported.
+
+    The report is a dictionary of plain values so that it can be logged as
+    JSON.
+
+    '''
+
+    #: Category under which collectors record time taken to parse files.
+    PARSE = 'parse'
+
+    def __init__(self, top=10, callback=None):
+        '''Initialise instrumentation.
+
+        *top* is the number of slowest files or schemas to report for each
+        category.
+
+        *callback* may be a callable to notify as events occur. It will be
+        called with (event, data) where event is 'stage' with the record of a
+        completed stage or 'refresh' with the report for a completed refresh.
+
+        '''
+        self.top = top
+        self.callback = callback
+        self.reset()
+        super(Instrumentation, self).__init__()
+
+    def reset(self):
+        '''Discard all recorded timings.'''
+        self._stages = []
+        self._timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, **details):
+        '''Time stage with *name* for the duration of the context.
+
+        *details* are included in the stage record. The record is returned
+        as the context value and a 'schemas' count may be set on it whilst in
+        the context.
+
+        '''
+        record = dict(details)
+        record.update({'name': name, 'schemas': None})
+
+        wall = timeit.default_timer()
+        cpu = _cpu_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = timeit.default_timer() - wall
+            record['cpu'] = _cpu_time() - cpu
+            self._stages.append(record)
+            self.notify('stage', record)
+
+    def record(self, category, key, duration):
+        '''Record *duration* in seconds for *key* under *category*.
+
+        For example, the time taken by a processor named *category* to
+        process the schema with id *key*.
+
+        '''
+        self._timings.setdefault(category, {})[key] = duration
+
+    def timings(self, category):
+        '''Return mapping of key to duration recorded under *category*.'''
+        return dict(self._timings.get(category, {}))
+
+    def slowest(self, category):
+        '''Return list of (key, duration) for slowest keys in *category*.'''
+        return heapq.nlargest(
+            self.top, self._timings.get(category, {}).items(),
+            key=lambda item: item[1]
+        )
+
+    def report(self):
+        '''Return dictionary describing recorded timings.
+
+        The dictionary contains:
+
+            * stages - List of stage records in order of completion. Each has
+              the 'name', 'wall' and 'cpu' time in seconds and the number of
+              'schemas' handled (or None if not applicable) along with any
+              other details given for the stage.
+            * parse - The 'count' and 'total' time of files parsed, the
+              time for each of the 'files' and the 'slowest' files.
+            * processors - Mapping of processor name to the combined 'wall'
+              and 'cpu' time and 'schemas' count of its stages and the
+              'slowest' schemas it recorded.
+
+        '''
+        parse_timings = self._timings.get(self.PARSE, {})
+        report = {
+            'stages': [dict(record) for record in self._stages],
+            'parse': {
+                'count': len(parse_timings),
+                'total': sum(parse_timings.values()),
+                'files': dict(parse_timings),
+                'slowest': [
+                    {'source': source, 'duration': duration}
+                    for source, duration in self.slowest(self.PARSE)
+                ]
+            },
+            'processors': {}
+        }
+
+        for record in self._stages:
+            processor = record.get('processor')
+            if processor is None:
+                continue
+
+            summary = report['processors'].setdefault(
+                processor, {'wall': 0.0, 'cpu': 0.0, 'schemas': 0}
+            )
+            summary['wall'] += record['wall']
+            summary['cpu'] += record['cpu']
+            summary['schemas'] += record['schemas'] or 0
+
+        for processor, summary in report['processors'].items():
+            summary['slowest'] = [
+                {'id': schema_id, 'duration': duration}
+                for schema_id, duration in self.slowest(processor)
+            ]
+
+        return report
+
+    def notify(self, event, data):
+        '''Call callback, if set, with *event* and *data*.'''
+        if self.callback is not None:
+            self.callback(event, data)
+
+
+def _cpu_time():
+    '''Return CPU time used by the current process in seconds.'''
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    times = os.times()
+    return times[0] + times[1]
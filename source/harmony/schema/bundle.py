@@ -0,0 +1,274 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+'''Store processed schemas in a single precompiled bundle file.
+
+A bundle file is laid out as:
+
+    * Magic bytes identifying the file as a bundle.
+    * Format version and header length as little-endian unsigned integers.
+    * Header, a marshalled dictionary holding the marshal version used, the
+      source files with their content hashes and an index of schema id to
+      (offset, length) of that schema in the payload.
+    * Payload of individually marshalled schemas.
+
+Marshalling is used as it is the fastest serialisation available in the
+standard library. As the marshal format can change between Python versions a
+bundle can only be read by the same major version of Python that wrote it.
+
+'''
+
+import os
+import sys
+import mmap
+import struct
+import marshal
+import tempfile
+
+from ..error import BundleError
+from .collection import Collection, IndexedCollection
+from .frozen import thaw
+
+
+#: Bytes identifying a bundle file.
+MAGIC = b'HARMONYB'
+
+#: Version of bundle format. Increment on incompatible change.
+VERSION = 1
+
+#: Structure following magic bytes holding format version and header length.
+_PREAMBLE = struct.Struct('<IQ')
+
+
+def build(path, collector, processors):
+    '''Write bundle to *path* of schemas from *collector*.
+
+    Collected schemas are processed with *processors* before writing.
+
+    '''
+    schemas = Collection()
+    for source, schema in collector.items():
+        schemas.add(schema, source)
+
+    for processor in processors:
+        processor.process(schemas)
+
+    sources = collector.sources()
+    if sources is not None:
+        sources = [
+            (source, collector.checksum(source)) for source in sources
+        ]
+
+    write(path, schemas, sources)
+
+
+def write(path, schemas, sources=None):
+    '''Write bundle to *path* of *schemas*.
+
+    *sources* may be a list of (file path, content hash) pairs that the
+    schemas were built from, used to determine whether the bundle is stale.
+
+    The bundle is written to a temporary file and then moved into place so
+    that readers never see a partially written bundle.
+
+    Frozen schemas (see :py:mod:`harmony.schema.frozen`) are stored as plain
+    schemas as marshal only supports built in types.
+
+    '''
+    index = []
+    blobs = []
+    offset = 0
+    for schema in sorted(schemas, key=lambda schema: schema['id']):
+        blob = marshal.dumps(thaw(schema))
+        index.append((schema['id'], offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = marshal.dumps({
+        'python': sys.version_info[0],
+        'marshal': marshal.version,
+        'sources': [
+            (os.path.abspath(source), checksum)
+            for source, checksum in (sources or [])
+        ],
+        'index': index
+    })
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as bundle_file:
+            bundle_file.write(MAGIC)
+            bundle_file.write(_PREAMBLE.pack(VERSION, len(header)))
+            bundle_file.write(header)
+            for blob in blobs:
+                bundle_file.write(blob)
+
+        # Temporary files are only readable by their owner whereas bundles
+        # are intended to be shared, so apply standard permissions.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary_path, 0o666 & ~umask)
+
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+
+        os.rename(temporary_path, path)
+
+    except Exception:
+        os.remove(temporary_path)
+        raise
+
+
+def read_header(data):
+    '''Return (header, payload offset) read from bundle *data*.
+
+    *data* may be any object supporting slicing that returns bytes, such as a
+    string or memory map.
+
+    Raise BundleError if *data* is not a compatible bundle.
+
+    '''
+    if data[:len(MAGIC)] != MAGIC:
+        raise BundleError('Data is not a schema bundle.')
+
+    start = len(MAGIC)
+    end = start + _PREAMBLE.size
+    try:
+        version, header_length = _PREAMBLE.unpack(data[start:end])
+    except struct.error:
+        raise BundleError('Schema bundle is truncated.')
+
+    if version != VERSION:
+        raise BundleError(
+            'Schema bundle version {0} is not supported (expected {1}).'
+            .format(version, VERSION)
+        )
+
+    try:
+        header = marshal.loads(data[end:end + header_length])
+    except (EOFError, ValueError, TypeError):
+        raise BundleError('Schema bundle header is invalid.')
+
+    if (
+        header.get('python') != sys.version_info[0]
+        or header.get('marshal') != marshal.version
+    ):
+        raise BundleError(
+            'Schema bundle was written by an incompatible version of Python.'
+        )
+
+    return header, end + header_length
+
+
+def is_stale(header, collector):
+    '''Return whether bundle with *header* is stale relative to *collector*.
+
+    A bundle is stale if the sources reported by *collector* differ from
+    those the bundle was built from, or the content of any source changed.
+
+    '''
+    sources = collector.sources()
+    if sources is None:
+        return True
+
+    recorded = header['sources']
+    if [os.path.abspath(source) for source in sources] != [
+        source for source, _ in recorded
+    ]:
+        return True
+
+    for source, checksum in recorded:
+        try:
+            if collector.checksum(source) != checksum:
+                return True
+        except (IOError, OSError):
+            return True
+
+    return False
+
+
+class MappedCollection(IndexedCollection):
+    '''Store schemas backed by a memory mapped bundle file.
+
+    Only the bundle index is decoded up front. Each schema is decoded from the
+    mapped file the first time it is retrieved. As the file is mapped read
+    only, processes forked after creating the collection share the same pages
+    of the operating system cache rather than each holding a private copy of
+    every schema.
+
+    The mapping is held until :py:meth:`close` is called, the collection is
+    used as a context manager and exits or the collection is deleted. A
+    session replacing the collection on refresh does not close it, so readers
+    still holding it are unaffected, and the mapping is released once the
+    last reference to it goes.
+
+    '''
+
+    def __init__(self, path):
+        '''Initialise collection from bundle file at *path*.
+
+        Raise BundleError if the file is not a compatible bundle.
+
+        '''
+        self._map = None
+
+        with open(path, 'rb') as file_handler:
+            mapped = mmap.mmap(
+                file_handler.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+        try:
+            header, payload_offset = read_header(mapped)
+        except Exception:
+            mapped.close()
+            raise
+
+        super(MappedCollection, self).__init__(
+            (schema_id, (offset, length))
+            for schema_id, offset, length in header['index']
+        )
+        self.path = path
+        self._map = mapped
+        self._payload_offset = payload_offset
+
+    def __enter__(self):
+        '''Return collection when used as a context manager.'''
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        '''Close collection on leaving context.'''
+        self.close()
+
+    def __del__(self):
+        '''Close collection when deleted.'''
+        self.close()
+
+    def close(self):
+        '''Release the memory mapped bundle file.
+
+        Schemas already decoded remain available but retrieving any other
+        schema will raise BundleError. Closing more than once has no effect.
+
+        '''
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _load(self, schema_id):
+        '''Decode schema with *schema_id* from the mapped file.
+
+        Raise BundleError if the collection has been closed.
+
+        '''
+        if self._map is None:
+            raise BundleError(
+                'Schema bundle {0} is closed.'.format(self.path)
+            )
+
+        offset, length = self._index[schema_id]
+        start = self._payload_offset + offset
+        self._schemas[schema_id] = marshal.loads(
+            self._map[start:start + length]
+        )
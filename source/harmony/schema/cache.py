@@ -0,0 +1,258 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import errno
+import hashlib
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .._version import __version__
+
+
+class Cache(object):
+    '''Persist processed schemas on disk between sessions.
+
+    Each entry stores the fully processed schemas for a particular collector
+    and processor configuration alongside the path, modification time, size
+    and content hash of every source file. An entry is only reused whilst all
+    of its source files remain unchanged.
+
+    '''
+
+    #: Version of the stored entry format. Increment on incompatible change.
+    VERSION = 1
+
+    def __init__(self, path):
+        '''Initialise cache storing entries in directory at *path*.
+
+        The directory will be created on first save if it does not exist.
+
+        '''
+        self.path = path
+        super(Cache, self).__init__()
+
+        # Content hashes of sources as {path: (modification time, size,
+        # hash)} to avoid hashing unchanged sources again on each save.
+        self._checksums = {}
+
+    def load(self, collector, processors, context=''):
+        '''Return processed schemas for *collector* and *processors*.
+
+        *context* should describe anything else that affects the processed
+        schemas and forms part of the key.
+
+        Return None if there is no valid entry, such as when no entry exists or
+        a source file has been added, removed or changed since it was stored.
+
+        '''
+        entry = self.entry(collector, processors, context)
+        if entry is None:
+            return None
+
+        return entry['schemas']
+
+    def entry(self, collector, processors, context=''):
+        '''Return entry for *collector* and *processors*.
+
+        As :py:meth:`load` but return dictionary with:
+
+            * schemas - The list of processed schemas.
+            * sources - Mapping of source path to current (modification
+              time, size).
+            * state - The state passed to :py:meth:`save`, or None.
+
+        '''
+        sources = collector.sources()
+        if sources is None:
+            return None
+
+        configuration = self._configuration(processors, context)
+        entry_path = self._entry_path(sources, configuration)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                entry = pickle.load(entry_file)
+        except Exception:
+            # Missing or unreadable entries are treated as a miss.
+            return None
+
+        if (
+            entry.get('version') != self.VERSION
+            or entry.get('configuration') != configuration
+        ):
+            return None
+
+        recorded = entry['sources']
+        if [path for path, _, _, _ in recorded] != sources:
+            return None
+
+        updated = []
+        for path, modified, size, checksum in recorded:
+            try:
+                current_modified, current_size = _stat(path)
+                if (current_modified, current_size) != (modified, size):
+                    # Metadata changed so confirm whether content did as well.
+                    if (
+                        current_size != size
+                        or collector.checksum(path) != checksum
+                    ):
+                        return None
+
+            except (IOError, OSError):
+                return None
+
+            updated.append((path, current_modified, current_size, checksum))
+
+        for path, modified, size, checksum in updated:
+            self._checksums[path] = (modified, size, checksum)
+
+        if updated != recorded:
+            # Content unchanged but metadata differs (such as after a touch).
+            # Store updated metadata to avoid rehashing on next load.
+            entry['sources'] = updated
+            self._write(sources, configuration, entry)
+
+        return {
+            'schemas': entry['schemas'],
+            'sources': dict(
+                (path, (modified, size))
+                for path, modified, size, _ in updated
+            ),
+            'state': entry.get('state')
+        }
+
+    def save(self, collector, processors, schemas, context='', state=None,
+             sources=None):
+        '''Store processed *schemas* for *collector* and *processors*.
+
+        *context* should match that passed to :py:meth:`load`.
+
+        *state* may be any additional picklable value to store with the
+        schemas and return from :py:meth:`entry`, such as that needed to
+        refresh incrementally from the loaded schemas.
+
+        *sources* may be the list of sources just reported by *collector* to
+        avoid listing them again.
+
+        Do nothing if *collector* does not report its sources. Failure to write
+        the entry is not considered an error as the cache is only an
+        optimisation.
+
+        Sources are only hashed if not already hashed by this cache at their
+        current modification time and size, so saving after a small change is
+        cheap.
+
+        '''
+        if sources is None:
+            sources = collector.sources()
+            if sources is None:
+                return
+
+        recorded = []
+        for path in sources:
+            try:
+                modified, size = _stat(path)
+                checksum = self._checksum(collector, path, modified, size)
+            except (IOError, OSError):
+                return
+
+            recorded.append((path, modified, size, checksum))
+
+        configuration = self._configuration(processors, context)
+        entry = {
+            'version': self.VERSION,
+            'configuration': configuration,
+            'sources': recorded,
+            'schemas': list(schemas),
+            'state': state
+        }
+        self._write(sources, configuration, entry)
+
+    def clear(self):
+        '''Remove all stored entries.'''
+        try:
+            filenames = os.listdir(self.path)
+        except OSError:
+            return
+
+        for filename in filenames:
+            if filename.endswith('.cache'):
+                os.remove(os.path.join(self.path, filename))
+
+    def _checksum(self, collector, path, modified, size):
+        '''Return content hash of source at *path* using *collector*.
+
+        A hash already recorded for *path* is reused whilst its *modified*
+        time and *size* are unchanged.
+
+        '''
+        recorded = self._checksums.get(path)
+        if recorded is not None and recorded[:2] == (modified, size):
+            return recorded[2]
+
+        checksum = collector.checksum(path)
+        self._checksums[path] = (modified, size, checksum)
+        return checksum
+
+    def _configuration(self, processors, context):
+        '''Return configuration string for *processors* and *context*.'''
+        return '|'.join(
+            [__version__, context]
+            + [processor.configuration() for processor in processors]
+        )
+
+    def _entry_path(self, sources, configuration):
+        '''Return path to entry for *sources* and *configuration*.'''
+        key = hashlib.sha1()
+        key.update(configuration.encode('utf-8'))
+        for path in sources:
+            key.update(b'\0')
+            key.update(os.path.abspath(path).encode('utf-8'))
+
+        return os.path.join(self.path, '{0}.cache'.format(key.hexdigest()))
+
+    def _write(self, sources, configuration, entry):
+        '''Write *entry* for *sources* and *configuration*.
+
+        The entry is written to a temporary file first and then moved into
+        place so that concurrent sessions never read a partial entry.
+
+        '''
+        target = self._entry_path(sources, configuration)
+
+        try:
+            try:
+                os.makedirs(self.path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+            handle, temporary_path = tempfile.mkstemp(
+                dir=self.path, suffix='.tmp'
+            )
+            try:
+                with os.fdopen(handle, 'wb') as entry_file:
+                    pickle.dump(entry, entry_file, pickle.HIGHEST_PROTOCOL)
+
+                if os.name == 'nt' and os.path.exists(target):
+                    os.remove(target)
+
+                os.rename(temporary_path, target)
+
+            except Exception:
+                os.remove(temporary_path)
+                raise
+
+        except (IOError, OSError):
+            pass
+
+
+def _stat(path):
+    '''Return (modification time, size) of file at *path*.'''
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
@@ -2,35 +2,50 @@
 # :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
 # :license: See LICENSE.txt.
 
+import threading
+from abc import ABCMeta, abstractmethod
+
 from ..error import SchemaConflictError
 
 
 class Collection(object):
     '''Store registered schemas.'''
 
-    def __init__(self, schemas=None):
-        '''Initialise collection with *schemas*.'''
+    def __init__(self, schemas=None, fallback=None):
+        '''Initialise collection with *schemas*.
+
+        If *fallback* is specified it should be another collection that will
+        be consulted when looking up a schema id not registered in this
+        collection. Schemas in *fallback* are not otherwise considered part of
+        this collection, such as when iterating.
+
+        '''
         self._schemas = {}
+        self._sources = {}
+        self.fallback = fallback
         if schemas is not None:
             for schema in schemas:
                 self.add(schema)
 
-    def add(self, schema):
+    def add(self, schema, source=None):
         '''Add *schema*.
 
+        *source* may identify where *schema* was collected from, such as the
+        path of the file it was loaded from, for use in error reporting.
+
         Raise SchemaConflictError if a schema with the same id already exists.
 
         '''
         schema_id = schema['id']
 
-        try:
-            self.get(schema_id)
-        except KeyError:
-            self._schemas[schema_id] = schema
-        else:
+        if schema_id in self._schemas:
             raise SchemaConflictError('A schema is already registered with '
                                       'id {0}'.format(schema_id))
 
+        self._schemas[schema_id] = schema
+        if source is not None:
+            self._sources[schema_id] = source
+
     def remove(self, schema_id):
         '''Remove a schema with *schema_id*.'''
         try:
@@ -38,9 +53,12 @@ class Collection(object):
         except KeyError:
             raise KeyError('No schema found with id {0}'.format(schema_id))
 
+        self._sources.pop(schema_id, None)
+
     def clear(self):
         '''Remove all registered schemas.'''
         self._schemas.clear()
+        self._sources.clear()
 
     def get(self, schema_id):
         '''Return schema registered with *schema_id*.
@@ -51,10 +69,27 @@ class Collection(object):
         try:
             schema = self._schemas[schema_id]
         except KeyError:
+            if self.fallback is not None:
+                return self.fallback.get(schema_id)
+
             raise KeyError('No schema found with id {0}'.format(schema_id))
         else:
             return schema
 
+    def source(self, schema_id):
+        '''Return source of schema registered with *schema_id*.
+
+        Return None if the source is not known.
+
+        '''
+        if schema_id in self._sources:
+            return self._sources[schema_id]
+
+        if schema_id not in self._schemas and self.fallback is not None:
+            return self.fallback.source(schema_id)
+
+        return None
+
     def items(self):
         '''Yield (id, schema) pairs.'''
         for schema in self:
@@ -64,3 +99,250 @@ class Collection(object):
         '''Iterate over registered schemas.'''
         for schema_id in self._schemas:
             yield self.get(schema_id)
+
+
+class IndexedCollection(Collection):
+    '''Store schemas listed in an index and retrieved on first access.
+
+    Subclasses implement :py:meth:`_load` to retrieve indexed schemas.
+
+    '''
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, index, fallback=None):
+        '''Initialise collection.
+
+        *index* should be a mapping of schema id to whatever the subclass
+        needs to retrieve that schema.
+
+        *fallback* is as for :py:class:`Collection`.
+
+        '''
+        super(IndexedCollection, self).__init__(fallback=fallback)
+        self._index = dict(index)
+
+    def add(self, schema, source=None):
+        '''Add *schema* collected from *source*.
+
+        Raise SchemaConflictError if a schema with the same id already exists.
+
+        '''
+        if schema['id'] in self._index:
+            raise SchemaConflictError('A schema is already registered with '
+                                      'id {0}'.format(schema['id']))
+
+        super(IndexedCollection, self).add(schema, source)
+
+    def remove(self, schema_id):
+        '''Remove a schema with *schema_id*.'''
+        if self._index.pop(schema_id, None) is not None:
+            self._schemas.pop(schema_id, None)
+            self._sources.pop(schema_id, None)
+        else:
+            super(IndexedCollection, self).remove(schema_id)
+
+    def clear(self):
+        '''Remove all registered schemas.'''
+        self._index.clear()
+        super(IndexedCollection, self).clear()
+
+    def get(self, schema_id):
+        '''Return schema registered with *schema_id*.
+
+        Retrieve the schema if not already retrieved.
+
+        Raise KeyError if no schema with *schema_id* registered.
+
+        '''
+        if schema_id in self._index and schema_id not in self._schemas:
+            self._load(schema_id)
+
+        return super(IndexedCollection, self).get(schema_id)
+
+    def __iter__(self):
+        '''Iterate over registered schemas, retrieving them as required.'''
+        schema_ids = set(self._index)
+        schema_ids.update(self._schemas)
+        for schema_id in schema_ids:
+            yield self.get(schema_id)
+
+    @abstractmethod
+    def _load(self, schema_id):
+        '''Retrieve indexed schema with *schema_id* into self._schemas.'''
+
+
+class LazyCollection(IndexedCollection):
+    '''Store schemas that are loaded and processed on first access.
+
+    Only an index of schema id to source is held up front. The first time a
+    schema is retrieved it is loaded, along with any schemas that the
+    processors report it depends on that are not yet loaded, and processed.
+    Memory use and the cost of processing therefore scale with the schemas
+    actually used.
+
+    .. note::
+
+        Processors are passed a collection containing only the schemas being
+        loaded (with other schemas available through lookup) so processors
+        that need to see every schema at once are not suitable.
+
+    A collection can be shared between threads. Schemas are loaded one
+    retrieval at a time, so threads retrieving a schema already being loaded
+    wait for it rather than loading and processing it again.
+
+    '''
+
+    def __init__(self, index, loader, processors=None, fallback=None):
+        '''Initialise collection.
+
+        *index* should be a mapping of schema id to source and *loader* a
+        callable that returns the unprocessed schema for a source.
+
+        *processors* should be a list of
+        :py:class:`~harmony.schema.processor.Processor` instances to process
+        loaded schemas with.
+
+        *fallback* is as for :py:class:`Collection`.
+
+        '''
+        super(LazyCollection, self).__init__(index, fallback=fallback)
+        self._loader = loader
+        self._processors = processors
+        if self._processors is None:
+            self._processors = []
+
+        # Reentrant as processors may retrieve other schemas from this
+        # collection whilst processing.
+        self._lock = threading.RLock()
+
+    def source(self, schema_id):
+        '''Return source of schema registered with *schema_id*.
+
+        Return None if the source is not known.
+
+        '''
+        if schema_id in self._index:
+            return self._index[schema_id]
+
+        return super(LazyCollection, self).source(schema_id)
+
+    def _load(self, schema_id):
+        '''Load and process schema with *schema_id* and its dependencies.'''
+        with self._lock:
+            # Another thread may have loaded the schema whilst waiting.
+            if schema_id in self._schemas:
+                return
+
+            loaded = {}
+            pending = [schema_id]
+            while pending:
+                pending_id = pending.pop()
+                if (
+                    pending_id in loaded
+                    or pending_id in self._schemas
+                    or pending_id not in self._index
+                ):
+                    continue
+
+                schema = self._loader(self._index[pending_id])
+                loaded[pending_id] = schema
+                for processor in self._processors:
+                    pending.extend(processor.dependencies(schema))
+
+            scope = Collection(fallback=self)
+            for pending_id, schema in loaded.items():
+                scope.add(schema, self._index[pending_id])
+            for processor in self._processors:
+                processor.process(scope)
+
+            for schema in scope:
+                self._schemas[schema['id']] = schema
+
+
+class LayeredCollection(Collection):
+    '''Store schemas from a stack of collections.
+
+    Later collections in the stack take precedence, so a schema in a later
+    collection shadows any schema with the same id in an earlier collection.
+
+    '''
+
+    def __init__(self, layers):
+        '''Initialise collection from *layers*.
+
+        *layers* should be a list of collections in order of increasing
+        precedence.
+
+        '''
+        super(LayeredCollection, self).__init__()
+        self.layers = layers
+
+    def add(self, schema, source=None):
+        '''Add *schema* collected from *source* to the topmost layer.
+
+        Raise SchemaConflictError if a schema with the same id already exists
+        in the topmost layer.
+
+        '''
+        self.layers[-1].add(schema, source)
+
+    def remove(self, schema_id):
+        '''Remove schema with *schema_id* from the topmost layer holding it.
+
+        Any schema with the same id in an earlier layer will then be visible.
+
+        '''
+        for layer in reversed(self.layers):
+            try:
+                layer.remove(schema_id)
+            except KeyError:
+                continue
+
+            return
+
+        raise KeyError('No schema found with id {0}'.format(schema_id))
+
+    def clear(self):
+        '''Remove all registered schemas from all layers.'''
+        for layer in self.layers:
+            layer.clear()
+
+    def get(self, schema_id):
+        '''Return schema registered with *schema_id*.
+
+        Raise KeyError if no schema with *schema_id* registered.
+
+        '''
+        for layer in reversed(self.layers):
+            try:
+                return layer.get(schema_id)
+            except KeyError:
+                continue
+
+        raise KeyError('No schema found with id {0}'.format(schema_id))
+
+    def source(self, schema_id):
+        '''Return source of visible schema registered with *schema_id*.
+
+        Return None if the source is not known.
+
+        '''
+        for layer in reversed(self.layers):
+            try:
+                layer.get(schema_id)
+            except KeyError:
+                continue
+
+            return layer.source(schema_id)
+
+        return None
+
+    def __iter__(self):
+        '''Iterate over visible registered schemas.'''
+        seen = set()
+        for layer in reversed(self.layers):
+            for schema in layer:
+                if schema['id'] not in seen:
+                    seen.add(schema['id'])
+                    yield schema
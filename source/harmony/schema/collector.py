@@ -3,15 +3,21 @@
 # :license: See LICENSE.txt.
 
 import os
+import re
+import hashlib
+import marshal
+import timeit
+import multiprocessing
+import multiprocessing.pool
 from abc import ABCMeta, abstractmethod
 
-try:
-    import json
-except ImportError:
-    try:
-        import simplejson as json
-    except ImportError:
-        raise ImportError('Could not import json or simplejson')
+from ..error import SchemaConflictError
+from ..instrumentation import Instrumentation
+from . import decoder, bundle, manifest
+
+
+#: Pattern matching id entries in a schema file.
+_SCHEMA_ID_PATTERN = re.compile(br'"id"\s*:\s*"((?:[^"\\]|\\.)*)"')
 
 
 class Collector(object):
@@ -19,6 +25,10 @@ class Collector(object):
 
     __metaclass__ = ABCMeta
 
+    #: :py:class:`~harmony.instrumentation.Instrumentation` to record timings
+    #: with, if any.
+    instrumentation = None
+
     @abstractmethod
     def collect(self):
         '''Yield collected schemas.
@@ -27,37 +37,480 @@ class Collector(object):
 
         '''
 
+    def sources(self):
+        '''Return list of file paths that schemas are collected from.
+
+        Return None if the collector does not collect from files, in which case
+        features that depend on tracking source files, such as caching, are
+        unavailable.
+
+        '''
+        return None
+
+    def items(self):
+        '''Yield (source, schema) pairs.
+
+        *source* is the file path the schema was collected from or None if not
+        known. Default implementation wraps :py:meth:`collect`.
+
+        '''
+        for schema in self.collect():
+            yield (None, schema)
+
+    def load(self, source):
+        '''Return schema collected from *source*.
+
+        Used to reload individual sources reported by :py:meth:`sources`.
+        Default implementation decodes the JSON file at path *source*.
+        Override if sources are stored differently.
+
+        '''
+        return _load_schema(source)
+
+    def checksum(self, source):
+        '''Return hash of the content of *source*.
+
+        Used to detect changes to sources reported by :py:meth:`sources`.
+        Default implementation returns the SHA-1 hash of the file at path
+        *source*.
+
+        '''
+        return _checksum(source)
+
+    def collection(self):
+        '''Return prepared collection of already processed schemas.
+
+        Allows a collector to provide a specialised collection, such as one
+        that decodes schemas on demand. Processors are not applied to the
+        returned collection. Return None if not supported (the default).
+
+        '''
+        return None
+
+    def index(self):
+        '''Return mapping of schema id to source.
+
+        Should be cheaper than collecting every schema and is used to support
+        loading schemas on demand with :py:meth:`load`. Return None if not
+        supported (the default).
+
+        '''
+        return None
+
 
 class FilesystemCollector(Collector):
 
-    def __init__(self, paths=None, recursive=True):
+    def __init__(self, paths=None, recursive=True, workers=None,
+                 processes=False):
         '''Initialise with *paths* to search.
 
         If *recursive* is True then all subdirectories of *paths* will also be
         searched.
 
+        *workers* opts in to parallel collection. When set to a number greater
+        than 1, directory listing and the reading and parsing of files will be
+        overlapped across a pool of that many workers. By default the pool
+        uses threads, which suits I/O bound collection from network
+        filesystems. Set *processes* to True to use a pool of processes
+        instead, which can help when parsing dominates.
+
+        Schemas are always yielded in the same deterministic order (sorted by
+        path) regardless of whether collection is serial or parallel.
+
+        If a path contains a manifest (see :py:mod:`harmony.schema.manifest`)
+        then the schema files listed in it are used rather than walking the
+        directory tree, and the ids and content hashes it records are used
+        where possible rather than reading files. A recorded hash is only
+        used for a file with the recorded size that has not been modified
+        since the manifest was written.
+
+        .. note::
+
+            A manifest is ignored, and the directory tree walked, once a file
+            or directory has been added, removed or renamed under its path.
+            Write the manifest again to benefit from it.
+
         '''
         self.paths = paths
         self.recursive = recursive
+        self.workers = workers
+        self.processes = processes
         if self.paths is None:
             self.paths = []
+
+        # Content hashes from the manifest last read for each path as
+        # {path: {file path: (hash, size, manifest modification time)}}.
+        self._manifest_checksums = {}
+
         super(FilesystemCollector, self).__init__()
 
     def collect(self):
-        '''Yield collected schemas.'''
+        '''Yield collected schemas.
+
+        Raise any error encountered reading or parsing a file at the point
+        that file would be yielded.
+
+        '''
+        for _, schema in self.items():
+            yield schema
+
+    def items(self):
+        '''Yield (file path, schema) pairs.'''
+        if self.workers is not None and self.workers > 1:
+            for item in self._collect_parallel():
+                yield item
+
+        else:
+            for filepath in self.sources():
+                yield (filepath, self.load(filepath))
+
+    def load(self, source):
+        '''Return schema loaded from file path *source*.'''
+        if self.instrumentation is None:
+            return _load_schema(source)
+
+        start = timeit.default_timer()
+        schema = _load_schema(source)
+        self._record(source, timeit.default_timer() - start)
+        return schema
+
+    def checksum(self, source):
+        '''Return SHA-1 hash of the content of file path *source*.
+
+        The hash recorded in a manifest is used without reading the file when
+        the file has the recorded size and has not been modified since the
+        manifest was written.
+
+        '''
+        for checksums in self._manifest_checksums.values():
+            recorded = checksums.get(source)
+            if recorded is None:
+                continue
+
+            checksum, size, manifest_modified = recorded
+            stat = os.stat(source)
+            if stat.st_size == size and stat.st_mtime <= manifest_modified:
+                return checksum
+
+            break
+
+        return _checksum(source)
+
+    def index(self):
+        '''Return mapping of schema id to file path.
+
+        Files are scanned for their id rather than fully parsed where possible.
+
+        Raise SchemaConflictError if more than one file has the same id.
+
+        '''
+        entries = []
         for path in self.paths:
-            for base, directories, filenames in os.walk(path):
-                for filename in filenames:
+            manifest_entries = self._read_manifest(path)
+            if manifest_entries is not None:
+                entries.extend(manifest_entries)
+            else:
+                entries.extend(
+                    (_scan_schema_id(filepath), filepath)
+                    for filepath in self._walk(path)
+                )
+
+        index = {}
+        for schema_id, filepath in entries:
+            if schema_id in index:
+                raise SchemaConflictError(
+                    'A schema is already registered with id {0}'
+                    .format(schema_id)
+                )
+
+            index[schema_id] = filepath
+
+        return index
+
+    def sources(self):
+        '''Return list of schema file paths in collection order.'''
+        filepaths = []
+        for path in self.paths:
+            manifest_entries = self._read_manifest(path)
+            if manifest_entries is not None:
+                filepaths.extend(
+                    filepath for _, filepath in manifest_entries
+                )
+            else:
+                filepaths.extend(self._walk(path))
+
+        return filepaths
+
+    def _walk(self, path):
+        '''Return list of schema file paths found by walking *path*.'''
+        filepaths = []
+        for base, directories, filenames in os.walk(path):
+            directories.sort()
+            for filename in sorted(filenames):
+                if _is_schema_file(filename):
+                    filepaths.append(os.path.join(base, filename))
+
+            if not self.recursive:
+                del directories[:]
+
+        return filepaths
+
+    def _read_manifest(self, path):
+        '''Return list of (schema id, file path) from manifest in *path*.
+
+        Return None if *path* has no usable manifest.
+
+        Content hashes recorded by any manifest previously read for *path* are
+        replaced by those in the manifest, or discarded if it is not usable.
+
+        '''
+        self._manifest_checksums.pop(path, None)
+
+        entries = manifest.read(path)
+        if entries is None:
+            return None
+
+        try:
+            manifest_modified = os.stat(manifest.path(path)).st_mtime
+        except OSError:
+            return None
+
+        checksums = {}
+        result = []
+        for entry in entries:
+            parts = entry['path'].split('/')
+            if not self.recursive and len(parts) > 1:
+                continue
 
-                    _, extension = os.path.splitext(filename)
-                    if extension != '.json':
-                        continue
+            filepath = os.path.join(path, *parts)
+            checksums[filepath] = (
+                entry['hash'], entry['size'], manifest_modified
+            )
+            result.append((entry['id'], filepath))
 
-                    filepath = os.path.join(base, filename)
-                    with open(filepath, 'r') as file_handler:
-                        schema = json.load(file_handler)
-                        yield schema
+        self._manifest_checksums[path] = checksums
+        return result
 
-                if not self.recursive:
-                    del directories[:]
+    def _collect_parallel(self):
+        '''Yield (file path, schema) pairs using a pool of workers.
+
+        Each directory listed schedules loading of its schema files straight
+        away so that reads overlap with listing of remaining directories.
+
+        '''
+        if self.processes:
+            pool = multiprocessing.Pool(self.workers)
+        else:
+            pool = multiprocessing.pool.ThreadPool(self.workers)
+
+        try:
+            results = {}
+            filepaths = []
+
+            for path in self.paths:
+                manifest_entries = self._read_manifest(path)
+                if manifest_entries is not None:
+                    for _, filepath in manifest_entries:
+                        results[filepath] = pool.apply_async(
+                            _load_schema_safely, (filepath,)
+                        )
+                        filepaths.append(filepath)
+
+                    continue
+
+                listed = []
+                level = [path]
+
+                while level:
+                    listings = pool.map(_list_directory, level)
+
+                    next_level = []
+                    for base, (directories, filenames) in zip(
+                        level, listings
+                    ):
+                        listed.append((base, filenames))
+
+                        for filename in filenames:
+                            if not _is_schema_file(filename):
+                                continue
+
+                            filepath = os.path.join(base, filename)
+                            results[filepath] = pool.apply_async(
+                                _load_schema_safely, (filepath,)
+                            )
+
+                        if self.recursive:
+                            for directory in directories:
+                                directory_path = os.path.join(base, directory)
+                                # Match os.walk in not following links.
+                                if not os.path.islink(directory_path):
+                                    next_level.append(directory_path)
+
+                    level = next_level
+
+                # Order as a sorted top down walk would.
+                listed.sort(key=lambda entry: _path_components(entry[0], path))
+                for base, filenames in listed:
+                    for filename in sorted(filenames):
+                        if _is_schema_file(filename):
+                            filepaths.append(os.path.join(base, filename))
+
+            for filepath in filepaths:
+                schema, error, duration = results.pop(filepath).get()
+                if error is not None:
+                    raise error
+
+                self._record(filepath, duration)
+
+                yield (filepath, schema)
+
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _record(self, source, duration):
+        '''Record *duration* taken to load *source* if instrumented.'''
+        if self.instrumentation is not None:
+            self.instrumentation.record(
+                Instrumentation.PARSE, source, duration
+            )
+
+
+def _is_schema_file(filename):
+    '''Return whether *filename* refers to a schema file.'''
+    _, extension = os.path.splitext(filename)
+    return extension == '.json'
+
+
+def _path_components(path, root):
+    '''Return list of components of *path* relative to *root*.'''
+    relative_path = os.path.relpath(path, root)
+    if relative_path == os.curdir:
+        return []
+
+    return relative_path.split(os.sep)
+
+
+def _list_directory(path):
+    '''Return (directories, filenames) contained directly in *path*.
+
+    Return empty lists if *path* cannot be listed, matching os.walk.
+
+    '''
+    for _, directories, filenames in os.walk(path):
+        return directories, filenames
+
+    return [], []
+
+
+def _load_schema(filepath):
+    '''Return schema loaded from *filepath*.'''
+    with open(filepath, 'rb') as file_handler:
+        return decoder.load(file_handler)
+
+
+def _checksum(filepath):
+    '''Return SHA-1 hash of the content of file at *filepath*.'''
+    content_hash = hashlib.sha1()
+    with open(filepath, 'rb') as file_handler:
+        for chunk in iter(lambda: file_handler.read(65536), b''):
+            content_hash.update(chunk)
+
+    return content_hash.hexdigest()
+
+
+def _scan_schema_id(filepath):
+    '''Return id of schema at *filepath* without parsing whole file.
+
+    Only falls back to parsing the file when the id cannot be determined
+    unambiguously from a scan of its content.
+
+    '''
+    with open(filepath, 'rb') as file_handler:
+        content = file_handler.read()
+
+    matches = _SCHEMA_ID_PATTERN.findall(content)
+    if len(matches) == 1:
+        return decoder.loads(b'"' + matches[0] + b'"')
+
+    return decoder.loads(content)['id']
+
+
+def _load_schema_safely(filepath):
+    '''Return (schema, error, duration) from loading schema at *filepath*.
+
+    Errors are returned rather than raised so that they can be raised in
+    collection order by the caller. *duration* is the time taken in seconds.
+
+    '''
+    start = timeit.default_timer()
+    try:
+        schema = _load_schema(filepath)
+    except Exception as error:
+        return None, error, timeit.default_timer() - start
+
+    return schema, None, timeit.default_timer() - start
+
+
+class BundleCollector(Collector):
+    '''Collect processed schemas from a bundle file.
+
+    See :py:mod:`harmony.schema.bundle` for building bundles.
+
+    '''
+
+    def __init__(self, path, mapped=False):
+        '''Initialise with *path* to bundle file.
+
+        If *mapped* is True then :py:meth:`collection` will return a
+        :py:class:`~harmony.schema.bundle.MappedCollection` so that schemas
+        are decoded on demand from a memory mapped bundle file.
+
+        .. note::
+
+            Schemas in a bundle are already processed so a session using this
+            collector should typically be configured without processors.
+
+        '''
+        self.path = path
+        self.mapped = mapped
+        super(BundleCollector, self).__init__()
+
+    def collection(self):
+        '''Return memory mapped collection if configured else None.'''
+        if not self.mapped:
+            return None
+
+        return bundle.MappedCollection(self.path)
+
+    def collect(self):
+        '''Yield collected schemas.
+
+        The bundle is read with a single sequential read.
+
+        Raise BundleError if the file is not a compatible bundle.
+
+        '''
+        with open(self.path, 'rb') as file_handler:
+            data = file_handler.read()
+
+        header, payload_offset = bundle.read_header(data)
+        for _, offset, length in header['index']:
+            start = payload_offset + offset
+            yield marshal.loads(data[start:start + length])
+
+    def is_stale(self, collector):
+        '''Return whether bundle is stale relative to source *collector*.
+
+        .. note::
+
+            The content of every source is hashed so this is as expensive as
+            collecting from *collector* and is best used as an occasional
+            check.
+
+        '''
+        with open(self.path, 'rb') as file_handler:
+            data = file_handler.read()
 
+        header, _ = bundle.read_header(data)
+        return bundle.is_stale(header, collector)
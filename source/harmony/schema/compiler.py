@@ -0,0 +1,636 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+'''Validate instances with code generated from schemas.
+
+:py:class:`CompiledValidator` translates each schema into specialised Python
+functions the first time it is used, so that validating an instance does not
+need to interpret the schema dictionary. Errors are identical to those of
+:py:class:`~harmony.schema.validator.Validator`, including their order.
+
+Commonly used keywords are compiled. A schema fragment using any other
+keyword, such as $ref or anyOf, is validated by
+:py:class:`~harmony.schema.validator.Validator` instead, as is any schema
+when custom types are used.
+
+.. note::
+
+    Compiled functions are cached by schema identity so schemas must not be
+    modified once used. Consider freezing them (see
+    :py:mod:`harmony.schema.frozen`).
+
+'''
+
+import re
+import numbers
+import itertools
+import threading
+import collections
+
+from jsonschema import _utils, _validators
+from jsonschema.exceptions import ValidationError, FormatError
+
+from . import validator as _validator_module
+from .validator import Validator
+
+
+#: Python expressions checking the type of *instance* for each JSON type.
+_TYPE_CHECKS = {
+    'array': 'isinstance(instance, list)',
+    'boolean': 'isinstance(instance, bool)',
+    'integer': (
+        'isinstance(instance, (int, long)) '
+        'and not isinstance(instance, bool)'
+    ),
+    'null': 'instance is None',
+    'number': (
+        'isinstance(instance, _Number) and not isinstance(instance, bool)'
+    ),
+    'object': 'isinstance(instance, dict)',
+    'string': 'isinstance(instance, basestring)'
+}
+
+
+class _Limit(Exception):
+    '''Raise when the maximum number of errors has been reported.'''
+
+
+class CompiledValidator(Validator):
+    '''Schema validator using code generated from schemas.'''
+
+    #: Maximum number of compiled schemas to keep, with the least recently
+    #: used discarded first.
+    CACHE_SIZE = 256
+
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, *args, **kw):
+        '''Initialise validator.'''
+        super(CompiledValidator, self).__init__(*args, **kw)
+        self._function = None
+
+    @classmethod
+    def check_schema(cls, schema):
+        '''Raise SchemaError if *schema* is invalid against meta schema.
+
+        The meta schema is checked using the interpreting validator.
+
+        '''
+        Validator.check_schema(schema)
+
+    def iter_errors(self, instance, _schema=None):
+        '''Return iterator over errors for *instance* against schema.'''
+        return iter(self.errors(instance, _schema))
+
+    def is_valid(self, instance, _schema=None):
+        '''Return whether *instance* is valid against schema.
+
+        Stops at the first error.
+
+        '''
+        return not self.errors(instance, _schema, limit=1)
+
+    def errors(self, instance, _schema=None, limit=None):
+        '''Return list of errors for *instance* against schema.
+
+        If *limit* is set then stop once that many errors are found.
+
+        '''
+        if _schema is None:
+            _schema = self.schema
+
+        if self._types != self.DEFAULT_TYPES:
+            errors = super(CompiledValidator, self).iter_errors(
+                instance, _schema
+            )
+            if limit is not None:
+                errors = itertools.islice(errors, limit)
+
+            return list(errors)
+
+        if _schema is self.schema:
+            if self._function is None:
+                self._function = self._compiled(_schema)
+
+            function = self._function
+
+        else:
+            function = self._compiled(_schema)
+
+        errors = []
+
+        def report(error):
+            '''Add *error* and stop if limit reached.'''
+            errors.append(error)
+            if limit is not None and len(errors) >= limit:
+                raise _Limit()
+
+        try:
+            function(self, instance, (), (), report)
+        except _Limit:
+            pass
+
+        return errors
+
+    def _compiled(self, schema):
+        '''Return function compiled for *schema*.'''
+        cache = self._cache
+        with self._cache_lock:
+            entry = cache.pop(id(schema), None)
+            if entry is not None and entry[0] is schema:
+                cache[id(schema)] = entry
+                return entry[1]
+
+        compiled = _Compiler(self.VALIDATORS).compile(schema)
+
+        with self._cache_lock:
+            # Holding schema ensures its identity is not reused whilst cached.
+            cache[id(schema)] = (schema, compiled)
+            while len(cache) > self.CACHE_SIZE:
+                cache.popitem(last=False)
+
+        return compiled
+
+    def _fallback(self, instance, schema, path, schema_path, report):
+        '''Report errors for *instance* against *schema* by interpreting.
+
+        *path* and *schema_path* are the paths to *instance* and *schema* from
+        the root instance and schema.
+
+        '''
+        errors = super(CompiledValidator, self).iter_errors(instance, schema)
+        for error in errors:
+            error.path.extendleft(reversed(path))
+            error.schema_path.extendleft(reversed(schema_path))
+            report(error)
+
+
+def _error(message, validator, validator_value, instance, schema, path,
+           schema_path, cause=None):
+    '''Return ValidationError with details set.'''
+    return ValidationError(
+        message, validator=validator, path=path, cause=cause,
+        validator_value=validator_value, instance=instance, schema=schema,
+        schema_path=schema_path
+    )
+
+
+class _Compiler(object):
+    '''Generate validation functions from a schema.'''
+
+    def __init__(self, validators):
+        '''Initialise compiler for *validators* mapping.
+
+        Only keywords whose validator in *validators* is the standard one are
+        compiled.
+
+        '''
+        self._validators = validators
+        self._lines = []
+        self._namespace = {
+            '_Number': numbers.Number,
+            '_error': _error,
+            '_utils': _utils,
+            '_FormatError': FormatError
+        }
+        self._constants = {}
+        self._nodes = 0
+        self._fallbacks = 0
+        super(_Compiler, self).__init__()
+
+    def compile(self, schema):
+        '''Return function validating against *schema*.
+
+        The function accepts (validator, instance, path, schema_path, report)
+        and calls report with each error found.
+
+        '''
+        root = self._node(schema)
+        source = '\n'.join(self._lines)
+        code = compile(source, '<compiled schema {0}>'.format(
+            schema.get('id', '')
+        ), 'exec')
+        exec code in self._namespace
+        return self._namespace[root]
+
+    def _constant(self, value):
+        '''Return name bound to *value* in generated code.'''
+        key = id(value)
+        entry = self._constants.get(key)
+        if entry is None:
+            name = '_c{0}'.format(len(self._constants))
+            self._namespace[name] = value
+            # Hold value so that its identity is not reused.
+            entry = self._constants[key] = (value, name)
+
+        return entry[1]
+
+    def _node(self, schema):
+        '''Generate function for *schema* node and return its name.'''
+        name = '_node{0}'.format(self._nodes)
+        self._nodes += 1
+
+        fallbacks = self._fallbacks
+        body = []
+        if self._compilable(schema):
+            for keyword, value in schema.items():
+                body.extend(self._keyword(keyword, value, schema))
+
+            if 'id' in schema and self._fallbacks > fallbacks:
+                # Only references resolved by fallback depend on scope.
+                body = [
+                    'with v.resolver.in_scope({0}):'.format(
+                        self._constant(schema['id'])
+                    )
+                ] + ['    ' + line for line in body]
+
+        else:
+            self._fallbacks += 1
+            body.append(
+                'v._fallback(instance, {0}, path, spath, report)'
+                .format(self._constant(schema))
+            )
+
+        lines = ['def {0}(v, instance, path, spath, report):'.format(name)]
+        lines.extend('    ' + line for line in body)
+        lines.append('    return')
+        lines.append('')
+        self._lines.extend(lines)
+        return name
+
+    def _compilable(self, schema):
+        '''Return whether *schema* node can be compiled.'''
+        if not isinstance(schema, dict) or '$ref' in schema:
+            return False
+
+        if not isinstance(schema.get('id', u''), basestring):
+            return False
+
+        for keyword, value in schema.items():
+            validator = self._validators.get(keyword)
+            if validator is None:
+                continue
+
+            if _STANDARD.get(keyword) is not validator:
+                return False
+
+            if keyword == 'type':
+                types = _utils.ensure_list(value)
+                if not isinstance(types, list) or not all(
+                    isinstance(entry, basestring) and entry in _TYPE_CHECKS
+                    for entry in types
+                ):
+                    return False
+
+            elif keyword == 'properties':
+                if not isinstance(value, dict):
+                    return False
+
+            elif keyword == 'items':
+                if not isinstance(value, (dict, list)):
+                    return False
+
+            elif keyword in ('additionalItems', 'additionalProperties'):
+                if not isinstance(value, (dict, bool)):
+                    return False
+
+            elif keyword in ('minimum', 'maximum'):
+                if (
+                    not isinstance(value, numbers.Number)
+                    or isinstance(value, bool)
+                ):
+                    return False
+
+            elif keyword in ('minItems', 'maxItems', 'minLength',
+                             'maxLength'):
+                if (
+                    not isinstance(value, (int, long))
+                    or isinstance(value, bool)
+                ):
+                    return False
+
+            elif keyword == 'pattern':
+                if not isinstance(value, basestring):
+                    return False
+
+            elif keyword in ('required', 'enum'):
+                if not isinstance(value, list):
+                    return False
+
+        return True
+
+    def _keyword(self, keyword, value, schema):
+        '''Return lines of code validating *keyword* with *value*.'''
+        method = getattr(self, '_keyword_{0}'.format(keyword), None)
+        if method is None or self._validators.get(keyword) is None:
+            return []
+
+        names = {
+            'keyword': self._constant(keyword),
+            'value': self._constant(value),
+            'schema': self._constant(schema),
+            'spath': self._constant((keyword,))
+        }
+        return method(value, schema, names)
+
+    def _report(self, message, names, cause=None):
+        '''Return line reporting error with *message* expression.'''
+        line = (
+            'report(_error({0}, {keyword}, {value}, instance, {schema}, '
+            'path, spath + {spath}'.format(message, **names)
+        )
+        if cause is not None:
+            line += ', cause={0}'.format(cause)
+
+        return line + '))'
+
+    def _keyword_type(self, value, schema, names):
+        '''Return lines validating 'type'.'''
+        types = _utils.ensure_list(value)
+        check = ' or '.join(
+            '({0})'.format(_TYPE_CHECKS[entry]) for entry in types
+        )
+        if not check:
+            check = 'False'
+
+        return [
+            'if not ({0}):'.format(check),
+            '    ' + self._report(
+                '_utils.types_msg(instance, {0})'.format(
+                    self._constant(types)
+                ),
+                names
+            )
+        ]
+
+    def _keyword_properties(self, value, schema, names):
+        '''Return lines validating 'properties'.'''
+        lines = ['if isinstance(instance, dict):']
+        for name, subschema in value.items():
+            node = self._node(subschema)
+            lines.extend([
+                '    if {0} in instance:'.format(self._constant(name)),
+                '        {0}(v, instance[{1}], path + {2}, spath + {3}, '
+                'report)'.format(
+                    node, self._constant(name), self._constant((name,)),
+                    self._constant(('properties', name))
+                )
+            ])
+
+        if len(lines) == 1:
+            return []
+
+        return lines
+
+    def _keyword_required(self, value, schema, names):
+        '''Return lines validating 'required' with harmony semantics.'''
+        lines = ['if isinstance(instance, dict):']
+        for index, requirement in enumerate(value):
+            lines.extend([
+                '    if {0} not in instance:'.format(
+                    self._constant(requirement)
+                ),
+                '        report(_error({0}, {keyword}, {value}, instance, '
+                '{schema}, path, spath + {1}))'.format(
+                    self._constant(
+                        '{0!r} is a required property'.format(requirement)
+                    ),
+                    self._constant(('required', index)),
+                    **names
+                )
+            ])
+
+        if len(lines) == 1:
+            return []
+
+        return lines
+
+    def _keyword_enum(self, value, schema, names):
+        '''Return lines validating 'enum'.'''
+        try:
+            lookup = frozenset(value)
+        except TypeError:
+            condition = 'instance not in {value}'.format(**names)
+        else:
+            condition = '_not_in({0}, {value}, instance)'.format(
+                self._constant(lookup), **names
+            )
+            self._namespace['_not_in'] = _not_in
+
+        return [
+            'if {0}:'.format(condition),
+            '    ' + self._report(
+                '"%r is not one of %r" % (instance, {value})'.format(**names),
+                names
+            )
+        ]
+
+    def _keyword_minimum(self, value, schema, names):
+        '''Return lines validating 'minimum'.'''
+        if schema.get('exclusiveMinimum', False):
+            operator, comparison = '<=', 'less than or equal to'
+        else:
+            operator, comparison = '<', 'less than'
+
+        return [
+            'if ({0}) and float(instance) {1} {value}:'.format(
+                _TYPE_CHECKS['number'], operator, **names
+            ),
+            '    ' + self._report(
+                '"%r is {0} the minimum of %r" % (instance, {value})'.format(
+                    comparison, **names
+                ),
+                names
+            )
+        ]
+
+    def _keyword_maximum(self, value, schema, names):
+        '''Return lines validating 'maximum'.'''
+        if schema.get('exclusiveMaximum', False):
+            operator, comparison = '>=', 'greater than or equal to'
+        else:
+            operator, comparison = '>', 'greater than'
+
+        return [
+            'if ({0}) and instance {1} {value}:'.format(
+                _TYPE_CHECKS['number'], operator, **names
+            ),
+            '    ' + self._report(
+                '"%r is {0} the maximum of %r" % (instance, {value})'.format(
+                    comparison, **names
+                ),
+                names
+            )
+        ]
+
+    def _length(self, type_name, operator, message, names):
+        '''Return lines validating length of *type_name* instance.'''
+        return [
+            'if ({0}) and len(instance) {1} {value}:'.format(
+                _TYPE_CHECKS[type_name], operator, **names
+            ),
+            '    ' + self._report(
+                '"%r is {0}" % (instance,)'.format(message), names
+            )
+        ]
+
+    def _keyword_minItems(self, value, schema, names):
+        '''Return lines validating 'minItems'.'''
+        return self._length('array', '<', 'too short', names)
+
+    def _keyword_maxItems(self, value, schema, names):
+        '''Return lines validating 'maxItems'.'''
+        return self._length('array', '>', 'too long', names)
+
+    def _keyword_minLength(self, value, schema, names):
+        '''Return lines validating 'minLength'.'''
+        return self._length('string', '<', 'too short', names)
+
+    def _keyword_maxLength(self, value, schema, names):
+        '''Return lines validating 'maxLength'.'''
+        return self._length('string', '>', 'too long', names)
+
+    def _keyword_pattern(self, value, schema, names):
+        '''Return lines validating 'pattern'.'''
+        search = self._constant(re.compile(value).search)
+        return [
+            'if isinstance(instance, basestring) and not {0}(instance):'
+            .format(search),
+            '    ' + self._report(
+                '"%r does not match %r" % (instance, {value})'.format(
+                    **names
+                ),
+                names
+            )
+        ]
+
+    def _keyword_format(self, value, schema, names):
+        '''Return lines validating 'format'.'''
+        return [
+            'if v.format_checker is not None:',
+            '    try:',
+            '        v.format_checker.check(instance, {value})'.format(
+                **names
+            ),
+            '    except _FormatError as error:',
+            '        ' + self._report('error.message', names, 'error.cause')
+        ]
+
+    def _keyword_items(self, value, schema, names):
+        '''Return lines validating 'items'.'''
+        if isinstance(value, dict):
+            node = self._node(value)
+            return [
+                'if isinstance(instance, list):',
+                '    for index, item in enumerate(instance):',
+                '        {0}(v, item, path + (index,), spath + {spath}, '
+                'report)'.format(node, **names)
+            ]
+
+        lines = ['if isinstance(instance, list):']
+        for index, subschema in enumerate(value):
+            node = self._node(subschema)
+            lines.extend([
+                '    if len(instance) > {0}:'.format(index),
+                '        {0}(v, instance[{1}], path + ({1},), '
+                'spath + {2}, report)'.format(
+                    node, index, self._constant(('items', index))
+                )
+            ])
+
+        if len(lines) == 1:
+            return []
+
+        return lines
+
+    def _keyword_additionalItems(self, value, schema, names):
+        '''Return lines validating 'additionalItems'.'''
+        items = schema.get('items', {})
+        if isinstance(items, dict):
+            return []
+
+        length = len(schema.get('items', []))
+        if isinstance(value, dict):
+            node = self._node(value)
+            return [
+                'if isinstance(instance, list):',
+                '    for index in xrange({0}, len(instance)):'.format(length),
+                '        {0}(v, instance[index], path + (index,), '
+                'spath + {spath}, report)'.format(node, **names)
+            ]
+
+        if value:
+            return []
+
+        return [
+            'if isinstance(instance, list) and len(instance) > {0}:'.format(
+                length
+            ),
+            '    ' + self._report(
+                '"Additional items are not allowed (%s %s unexpected)" % '
+                '_utils.extras_msg(instance[{0}:])'.format(length),
+                names
+            )
+        ]
+
+    def _keyword_additionalProperties(self, value, schema, names):
+        '''Return lines validating 'additionalProperties'.'''
+        if isinstance(value, dict):
+            node = self._node(value)
+            return [
+                'if isinstance(instance, dict):',
+                '    extras = set(_utils.find_additional_properties('
+                'instance, {schema}))'.format(**names),
+                '    for extra in extras:',
+                '        {0}(v, instance[extra], path + (extra,), '
+                'spath + {spath}, report)'.format(node, **names)
+            ]
+
+        if value:
+            return []
+
+        return [
+            'if isinstance(instance, dict):',
+            '    extras = set(_utils.find_additional_properties('
+            'instance, {schema}))'.format(**names),
+            '    if extras:',
+            '        ' + self._report(
+                '"Additional properties are not allowed (%s %s unexpected)" '
+                '% _utils.extras_msg(extras)',
+                names
+            )
+        ]
+
+
+def _not_in(lookup, values, instance):
+    '''Return whether *instance* is not in *values*.
+
+    *lookup* should be a set of *values* to check first.
+
+    '''
+    try:
+        return instance not in lookup
+    except TypeError:
+        return instance not in values
+
+
+#: Validator functions whose behaviour is compiled.
+_STANDARD = {
+    'type': _validators.type_draft4,
+    'properties': _validators.properties_draft4,
+    'required': _validator_module._required,
+    'enum': _validators.enum,
+    'minimum': _validators.minimum,
+    'maximum': _validators.maximum,
+    'minItems': _validators.minItems,
+    'maxItems': _validators.maxItems,
+    'minLength': _validators.minLength,
+    'maxLength': _validators.maxLength,
+    'pattern': _validators.pattern,
+    'format': _validators.format,
+    'items': _validators.items,
+    'additionalItems': _validators.additionalItems,
+    'additionalProperties': _validators.additionalProperties
+}
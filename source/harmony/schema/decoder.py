@@ -0,0 +1,170 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+'''Decode JSON using the fastest available backend.
+
+Backends are tried in order of preference and the first that can be imported
+is used. Set the environment variable :envvar:`HARMONY_JSON_DECODER` to the
+name of a backend to use it explicitly.
+
+Every backend returns the same objects as the standard library json module,
+including unicode rather than str strings on Python 2. Where a backend cannot
+decode data, such as integers too large for it or invalid JSON, the json
+module is used instead so that results and error messages are also the same.
+
+'''
+
+import os
+import sys
+import json
+
+
+def _with_fallback(loads):
+    '''Return decode function using *loads* and json.loads on failure.'''
+
+    def decode(data):
+        '''Return object decoded from *data*.'''
+        try:
+            return loads(data)
+        except (ValueError, OverflowError):
+            return json.loads(data)
+
+    return decode
+
+
+def _orjson():
+    '''Return orjson decode function.'''
+    import orjson
+    return _with_fallback(orjson.loads)
+
+
+def _ujson():
+    '''Return ujson decode function.'''
+    import ujson
+
+    def loads(data):
+        '''Return object decoded from *data* retaining float precision.'''
+        return ujson.loads(data, precise_float=True)
+
+    try:
+        loads('0.1')
+    except TypeError:
+        # Older versions do not support precise_float.
+        loads = ujson.loads
+
+    return _with_fallback(loads)
+
+
+def _simplejson():
+    '''Return simplejson decode function.
+
+    Only used when compiled with C speedups as otherwise slower than json.
+
+    '''
+    import simplejson
+    import simplejson._speedups
+
+    if sys.version_info[0] > 2:
+        return _with_fallback(simplejson.loads)
+
+    def loads(data):
+        '''Return object decoded from *data* with unicode strings.
+
+        Given a str, simplejson returns str rather than unicode for ASCII
+        strings so decode *data* first.
+
+        '''
+        if isinstance(data, str):
+            data = data.decode('utf-8')
+
+        return simplejson.loads(data)
+
+    return _with_fallback(loads)
+
+
+def _json():
+    '''Return standard library json decode function.'''
+    return json.loads
+
+
+#: Available backends in order of preference as (name, factory) pairs. Each
+#: factory should return a function accepting a str or bytes object and
+#: returning the decoded object, or raise ImportError if not available.
+BACKENDS = [
+    ('orjson', _orjson),
+    ('simplejson', _simplejson),
+    ('ujson', _ujson),
+    ('json', _json)
+]
+
+_backend = None
+
+
+def available():
+    '''Return list of names of backends that can be used.'''
+    names = []
+    for name, factory in BACKENDS:
+        try:
+            factory()
+        except ImportError:
+            continue
+
+        names.append(name)
+
+    return names
+
+
+def set_backend(name=None):
+    '''Use backend with *name* for decoding.
+
+    If *name* is None then use the backend specified by
+    :envvar:`HARMONY_JSON_DECODER`, or the first available backend if not set.
+
+    Raise ValueError if *name* is not a known backend and ImportError if it
+    cannot be used.
+
+    '''
+    global _backend
+
+    if name is None:
+        name = os.environ.get('HARMONY_JSON_DECODER')
+
+    if name is None:
+        for candidate, factory in BACKENDS:
+            try:
+                _backend = (candidate, factory())
+            except ImportError:
+                continue
+
+            return
+
+        raise ImportError('Could not import any JSON decoder.')
+
+    for candidate, factory in BACKENDS:
+        if candidate == name:
+            _backend = (candidate, factory())
+            return
+
+    raise ValueError('Unknown JSON decoder {0!r}.'.format(name))
+
+
+def get_backend():
+    '''Return name of backend in use.'''
+    if _backend is None:
+        set_backend()
+
+    return _backend[0]
+
+
+def loads(data):
+    '''Return object decoded from JSON *data*.'''
+    if _backend is None:
+        set_backend()
+
+    return _backend[1](data)
+
+
+def load(file_handler):
+    '''Return object decoded from JSON content of *file_handler*.'''
+    return loads(file_handler.read())
@@ -0,0 +1,120 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import urlparse
+
+from ..error import MixinCycleError
+
+
+def mixin_references(fragment):
+    '''Return set of schema ids mixed in by *fragment*.
+
+    Nested fragments are searched in the same way as by the
+    :py:class:`~harmony.schema.processor.MixinProcessor`. Only references using
+    the harmony scheme are included.
+
+    '''
+    references = set()
+
+    properties = fragment.get('properties', {})
+    for value in properties.values():
+        if isinstance(value, dict):
+            references.update(mixin_references(value))
+
+    items = fragment.get('items', [])
+    if isinstance(items, dict):
+        items = [items]
+
+    for item in items:
+        if isinstance(item, dict):
+            references.update(mixin_references(item))
+
+    additional_items = fragment.get('additionalItems')
+    if additional_items and isinstance(additional_items, dict):
+        references.update(mixin_references(additional_items))
+
+    mixins = fragment.get('$mixin')
+    if isinstance(mixins, dict):
+        mixins = [mixins]
+
+    for entry in mixins or []:
+        reference = entry.get('$ref')
+        if reference and urlparse.urlsplit(reference).scheme == 'harmony':
+            references.add(reference)
+
+    return references
+
+
+def dependents(dependencies, schema_ids):
+    '''Return set of *schema_ids* and the ids that transitively depend on them.
+
+    *dependencies* should be a mapping of schema id to the set of schema ids
+    it directly depends on.
+
+    '''
+    reverse = {}
+    for schema_id, references in dependencies.items():
+        for reference in references:
+            reverse.setdefault(reference, set()).add(schema_id)
+
+    result = set()
+    pending = list(schema_ids)
+    while pending:
+        schema_id = pending.pop()
+        if schema_id in result:
+            continue
+
+        result.add(schema_id)
+        pending.extend(reverse.get(schema_id, ()))
+
+    return result
+
+
+def sort(dependencies):
+    '''Return list of schema ids ordered so dependencies come first.
+
+    *dependencies* should be a mapping of schema id to the set of schema ids
+    it directly depends on. Dependencies not present as keys in
+    *dependencies* are ignored.
+
+    Ids are otherwise ordered by id so the result is deterministic.
+
+    Raise MixinCycleError if the dependencies form a cycle.
+
+    '''
+    order = []
+    done = set()
+
+    for root in sorted(dependencies):
+        if root in done:
+            continue
+
+        # Iterative depth first search, tracking the current path so that the
+        # full chain of any cycle can be reported.
+        path = [root]
+        on_path = set(path)
+        stack = [iter(sorted(dependencies[root]))]
+
+        while stack:
+            for reference in stack[-1]:
+                if reference not in dependencies or reference in done:
+                    continue
+
+                if reference in on_path:
+                    chain = path[path.index(reference):] + [reference]
+                    raise MixinCycleError(chain)
+
+                path.append(reference)
+                on_path.add(reference)
+                stack.append(iter(sorted(dependencies[reference])))
+                break
+
+            else:
+                stack.pop()
+                schema_id = path.pop()
+                on_path.discard(schema_id)
+                done.add(schema_id)
+                order.append(schema_id)
+
+    return order
@@ -0,0 +1,180 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+'''Read only representation of schemas.
+
+:py:class:`FrozenDict` and :py:class:`FrozenList` are subclasses of the
+builtin dict and list types so that code reading schemas, including type
+checks made by jsonschema, continues to work unchanged. Any attempt to modify
+them raises TypeError. As they cannot change they are hashable, can be shared
+safely between threads and are returned as is when copied.
+
+'''
+
+
+def _immutable(self, *args, **kw):
+    '''Raise TypeError as object cannot be modified.'''
+    raise TypeError(
+        '{0!r} object does not support modification'
+        .format(self.__class__.__name__)
+    )
+
+
+class FrozenDict(dict):
+    '''Read only dictionary.'''
+
+    __slots__ = ('_hash',)
+
+    def __init__(self, *args, **kw):
+        '''Initialise dictionary as for dict.'''
+        super(FrozenDict, self).__init__(*args, **kw)
+        self._hash = None
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+    def __hash__(self):
+        '''Return hash of dictionary.
+
+        Raise TypeError if any value is not hashable.
+
+        '''
+        if self._hash is None:
+            self._hash = hash(frozenset(self.items()))
+
+        return self._hash
+
+    def __copy__(self):
+        '''Return self as a copy is not required.'''
+        return self
+
+    def __deepcopy__(self, memo):
+        '''Return self as a copy is not required.'''
+        return self
+
+    def __reduce__(self):
+        '''Return pickle representation.'''
+        return (self.__class__, (dict(self),))
+
+    def __repr__(self):
+        '''Return representation.'''
+        return '{0}({1})'.format(
+            self.__class__.__name__, super(FrozenDict, self).__repr__()
+        )
+
+
+class FrozenList(list):
+    '''Read only list.'''
+
+    __slots__ = ('_hash',)
+
+    def __init__(self, *args):
+        '''Initialise list as for list.'''
+        super(FrozenList, self).__init__(*args)
+        self._hash = None
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __setslice__ = _immutable
+    __delslice__ = _immutable
+    __iadd__ = _immutable
+    __imul__ = _immutable
+    append = _immutable
+    extend = _immutable
+    insert = _immutable
+    pop = _immutable
+    remove = _immutable
+    reverse = _immutable
+    sort = _immutable
+
+    def __hash__(self):
+        '''Return hash of list.
+
+        Raise TypeError if any entry is not hashable.
+
+        '''
+        if self._hash is None:
+            self._hash = hash(tuple(self))
+
+        return self._hash
+
+    def __copy__(self):
+        '''Return self as a copy is not required.'''
+        return self
+
+    def __deepcopy__(self, memo):
+        '''Return self as a copy is not required.'''
+        return self
+
+    def __reduce__(self):
+        '''Return pickle representation.'''
+        return (self.__class__, (list(self),))
+
+    def __repr__(self):
+        '''Return representation.'''
+        return '{0}({1})'.format(
+            self.__class__.__name__, super(FrozenList, self).__repr__()
+        )
+
+
+def freeze(value, memo=None):
+    '''Return read only equivalent of JSON *value*.
+
+    Dictionaries and lists are converted recursively. Already frozen values
+    are returned as is.
+
+    *memo* may be a dictionary to share between calls so that a dictionary
+    or list held in several places is converted once, with the result then
+    also held in each of those places.
+
+    '''
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+
+    if not isinstance(value, (dict, list)):
+        return value
+
+    if memo is None:
+        memo = {}
+
+    entry = memo.get(id(value))
+    if entry is not None:
+        return entry[1]
+
+    if isinstance(value, dict):
+        frozen = FrozenDict(
+            (key, freeze(item, memo)) for key, item in value.iteritems()
+        )
+    else:
+        frozen = FrozenList(freeze(item, memo) for item in value)
+
+    # Hold value as well so that its id is not reused whilst memo is in use.
+    memo[id(value)] = (value, frozen)
+    return frozen
+
+
+def thaw(value):
+    '''Return modifiable equivalent of JSON *value*.
+
+    Frozen dictionaries and lists are copied recursively to plain ones. Other
+    values are returned as is.
+
+    '''
+    if isinstance(value, FrozenDict):
+        return dict((key, thaw(item)) for key, item in value.iteritems())
+
+    if isinstance(value, FrozenList):
+        return [thaw(item) for item in value]
+
+    return value
+
+
+def is_frozen(value):
+    '''Return whether *value* is a frozen dictionary or list.'''
+    return isinstance(value, (FrozenDict, FrozenList))
@@ -0,0 +1,421 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import hashlib
+import contextlib
+
+from ..error import SchemaConflictError
+from .collection import Collection, LazyCollection
+from .dependency import dependents
+
+
+#: Marker for a signature that has not been computed since the last refresh.
+_UNKNOWN = object()
+
+
+class Layer(object):
+    '''Collect, process and cache schemas from a single collector.
+
+    A layer tracks the state of its sources so that it can be refreshed
+    incrementally. Layers can be stacked, with each layer resolving references
+    to schemas it does not hold against the layers below it.
+
+    '''
+
+    def __init__(self, collector, processors, cache=None, lazy=False,
+                 instrumentation=None):
+        '''Initialise layer.
+
+        *collector* is used to collect schemas and *processors* is the list of
+        processors to process them with.
+
+        *cache* may be a :py:class:`~harmony.schema.cache.Cache` to store
+        processed schemas in between sessions.
+
+        If *lazy* is True and *collector* supports indexing its schemas then a
+        :py:class:`~harmony.schema.collection.LazyCollection` will be used.
+
+        *instrumentation* may be an
+        :py:class:`~harmony.instrumentation.Instrumentation` to time the
+        stages of each refresh with. It is also set on *collector* and
+        *processors* so that they can record their own timings.
+
+        '''
+        super(Layer, self).__init__()
+        self.collector = collector
+        self.processors = processors
+        self.cache = cache
+        self.lazy = lazy
+        self.schemas = Collection()
+
+        self.instrumentation = instrumentation
+        if self.instrumentation is not None:
+            self.collector.instrumentation = self.instrumentation
+            for processor in self.processors:
+                processor.instrumentation = self.instrumentation
+
+        # State of sources as of the last refresh, used to support incremental
+        # refreshes. Sources maps file path to (modification time, size).
+        self._sources = None
+        self._source_ids = {}
+        self._dependencies = {}
+        self._signature = _UNKNOWN
+
+    def signature(self):
+        '''Return string that changes whenever the sources of layer change.
+
+        Based on the path, modification time and size of each source as of
+        the last refresh. Computed at most once per refresh, and during an
+        incremental refresh from the state it gathers anyway, so is cheap to
+        call repeatedly. Return None if the collector does not report its
+        sources.
+
+        '''
+        if self._signature is _UNKNOWN:
+            sources = self.collector.sources()
+            if sources is None:
+                self._signature = None
+            else:
+                stats = {}
+                for source in sources:
+                    try:
+                        stats[source] = _stat(source)
+                    except OSError:
+                        continue
+
+                self._signature = _signature(sources, stats)
+
+        return self._signature
+
+    def invalidate(self):
+        '''Forget state of sources so that the next refresh is full.'''
+        self._sources = None
+        self._signature = _UNKNOWN
+
+    def refresh(self, incremental=False, fallback=None, changes=None,
+                context=''):
+        '''Discover schemas and replace self.schemas.
+
+        See :py:meth:`harmony.session.Session.refresh` for a description of
+        *incremental*.
+
+        *fallback* may be a collection of schemas from lower layers. It will
+        be used to look up schemas not held by this layer during processing.
+
+        *changes* should be the set of schema ids in *fallback* that changed
+        since the last refresh, or None if not known. Schemas in this layer
+        that depend on them will be processed again in an incremental refresh.
+        If not known then a full refresh is performed.
+
+        *context* is included in the cache key and should describe anything
+        outside of this layer that affects the processed schemas, such as the
+        signature of lower layers.
+
+        Return set of schema ids whose processed form may have changed, or
+        None if not known (such as after a full refresh).
+
+        '''
+        if incremental and self._sources is not None and changes is not None:
+            sources = self.collector.sources()
+            if sources is not None:
+                return self._refresh_incremental(
+                    sources, fallback, changes, context
+                )
+
+        self._refresh_full(fallback, context)
+        return None
+
+    def _refresh_full(self, fallback, context):
+        '''Collect and process all schemas.'''
+        self._sources = None
+        self._signature = _UNKNOWN
+
+        with self._stage('collection'):
+            schemas = self.collector.collection()
+
+        if schemas is not None:
+            self.schemas = schemas
+            return
+
+        if self.lazy:
+            with self._stage('index') as stage:
+                index = self.collector.index()
+                if index is not None:
+                    stage['schemas'] = len(index)
+
+            if index is not None:
+                self.schemas = LazyCollection(
+                    index, self.collector.load, self.processors,
+                    fallback=fallback
+                )
+                return
+
+        if self.cache is not None:
+            with self._stage('cache.load') as stage:
+                entry = self.cache.entry(
+                    self.collector, self.processors, context
+                )
+                if entry is not None:
+                    stage['schemas'] = len(entry['schemas'])
+
+            if entry is not None:
+                self._restore(entry)
+                return
+
+        schemas = Collection(fallback=fallback)
+        sources = {}
+        source_ids = {}
+        dependencies = {}
+
+        with self._stage('collect') as stage:
+            for source, schema in self.collector.items():
+                schemas.add(schema, source)
+                dependencies[schema['id']] = self._dependencies_of(schema)
+
+                if source is None:
+                    # Changes cannot be tracked for this collector.
+                    sources = None
+                elif sources is not None:
+                    source_ids[source] = schema['id']
+                    sources[source] = _stat(source)
+
+            stage['schemas'] = len(dependencies)
+
+        self._process(schemas, len(dependencies))
+
+        schemas.fallback = None
+
+        self.schemas = schemas
+        self._sources = sources
+        self._source_ids = source_ids
+        self._dependencies = dependencies
+
+        self._save(context)
+
+    def _restore(self, entry):
+        '''Set schemas and state of sources from cache *entry*.'''
+        state = entry['state']
+        if state is None:
+            self.schemas = Collection(entry['schemas'])
+            return
+
+        id_sources = dict(
+            (schema_id, source)
+            for source, schema_id in state['source_ids'].items()
+        )
+
+        schemas = Collection()
+        for schema in entry['schemas']:
+            schemas.add(schema, id_sources.get(schema['id']))
+
+        self.schemas = schemas
+        self._sources = entry['sources']
+        self._source_ids = state['source_ids']
+        self._dependencies = state['dependencies']
+
+    def _refresh_incremental(self, sources, fallback, changes, context):
+        '''Refresh schemas from changes to *sources* and *changes* below.'''
+        current = {}
+        for source in sources:
+            try:
+                current[source] = _stat(source)
+            except OSError:
+                # Removed since listed.
+                continue
+
+        self._signature = _signature(sources, current)
+
+        added = []
+        changed = []
+        for source in sources:
+            if source not in current:
+                continue
+
+            if source not in self._sources:
+                added.append(source)
+            elif current[source] != self._sources[source]:
+                changed.append(source)
+
+        removed = [
+            source for source in self._sources if source not in current
+        ]
+
+        source_ids = dict(self._source_ids)
+        dependencies = dict(self._dependencies)
+
+        stale = set()
+        for source in removed + changed:
+            schema_id = source_ids.pop(source)
+            dependencies.pop(schema_id, None)
+            stale.add(schema_id)
+
+        with self._stage('collect') as stage:
+            loaded = self._load_changes(added + changed, source_ids,
+                                        dependencies)
+            stage['schemas'] = len(loaded)
+
+        id_sources = dict(
+            (schema_id, source) for source, schema_id in source_ids.items()
+        )
+
+        affected = dependents(
+            dependencies, stale.union(loaded).union(changes)
+        )
+        affected.intersection_update(stale.union(id_sources))
+        if not affected:
+            return affected
+
+        # Reload unchanged schemas that depend on changed ones as their
+        # processed form is no longer valid.
+        with self._stage('collect.dependents') as stage:
+            count = len(loaded)
+            for schema_id in affected:
+                if schema_id not in loaded and schema_id in id_sources:
+                    loaded[schema_id] = self.collector.load(
+                        id_sources[schema_id]
+                    )
+
+            stage['schemas'] = len(loaded) - count
+
+        schemas = Collection(fallback=fallback)
+        for schema_id, schema in self.schemas.items():
+            if schema_id not in affected:
+                schemas.add(schema, self.schemas.source(schema_id))
+
+        for schema_id, schema in loaded.items():
+            schemas.add(schema, id_sources.get(schema_id))
+
+        previous_ids = set(self._source_ids.values())
+        added_ids = set(loaded).difference(previous_ids)
+        changed_ids = set(loaded).difference(added_ids)
+        removed_ids = previous_ids.difference(id_sources)
+
+        for processor in self.processors:
+            name = processor.__class__.__name__
+            with self._stage(
+                'update.{0}'.format(name), processor=name
+            ) as stage:
+                updated = processor.update(
+                    schemas, added_ids, changed_ids, removed_ids
+                )
+                stage['schemas'] = len(loaded)
+
+            if not updated:
+                # Processor requires all schemas to be processed together.
+                self._refresh_full(fallback, context)
+                return None
+
+        schemas.fallback = None
+
+        self.schemas = schemas
+        self._sources = current
+        self._source_ids = source_ids
+        self._dependencies = dependencies
+
+        self._save(context, sources)
+
+        return affected
+
+    def _load_changes(self, sources, source_ids, dependencies):
+        '''Return mapping of id to schema loaded from changed *sources*.
+
+        *source_ids* and *dependencies* are updated with the loaded schemas.
+
+        Raise SchemaConflictError if more than one source has the same id.
+
+        '''
+        loaded = {}
+        for source in sources:
+            schema = self.collector.load(source)
+            schema_id = schema['id']
+            if schema_id in loaded:
+                raise SchemaConflictError(
+                    'A schema is already registered with id {0}'
+                    .format(schema_id)
+                )
+
+            loaded[schema_id] = schema
+            source_ids[source] = schema_id
+            dependencies[schema_id] = self._dependencies_of(schema)
+
+        return loaded
+
+    def _dependencies_of(self, schema):
+        '''Return set of ids of schemas that processing *schema* depends on.'''
+        dependencies = set()
+        for processor in self.processors:
+            dependencies.update(processor.dependencies(schema))
+
+        return dependencies
+
+    def _process(self, schemas, count):
+        '''Process *schemas* collection holding *count* schemas.'''
+        for processor in self.processors:
+            name = processor.__class__.__name__
+            with self._stage(
+                'process.{0}'.format(name), processor=name
+            ) as stage:
+                processor.process(schemas)
+                stage['schemas'] = count
+
+    def _save(self, context, sources=None):
+        '''Store processed schemas in cache, if set, for *context*.
+
+        The state of sources is stored as well so that a layer loading the
+        schemas from cache can still refresh incrementally.
+
+        *sources* may be the list of sources just reported by the collector.
+
+        '''
+        if self.cache is not None:
+            state = None
+            if self._sources is not None:
+                state = {
+                    'source_ids': self._source_ids,
+                    'dependencies': self._dependencies
+                }
+
+            with self._stage('cache.save'):
+                self.cache.save(
+                    self.collector, self.processors, self.schemas, context,
+                    state, sources
+                )
+
+    def _stage(self, name, **details):
+        '''Return context timing stage with *name* if instrumented.'''
+        if self.instrumentation is None:
+            return _untimed()
+
+        return self.instrumentation.stage(name, **details)
+
+
+def _signature(sources, stats):
+    '''Return signature of *sources* with (modification time, size) *stats*.
+
+    *stats* should map each source that exists to its modification time and
+    size.
+
+    '''
+    signature = hashlib.sha1()
+    for source in sources:
+        modified, size = stats.get(source, (None, None))
+        signature.update(
+            u'{0}\0{1!r}\0{2!r}\0'.format(source, modified, size)
+            .encode('utf-8')
+        )
+
+    return signature.hexdigest()
+
+
+def _stat(path):
+    '''Return (modification time, size) of file at *path*.'''
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+@contextlib.contextmanager
+def _untimed():
+    '''Provide context for a stage that is not timed.'''
+    yield {}
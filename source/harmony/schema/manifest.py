@@ -0,0 +1,198 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+'''Describe the schemas under a root directory in a single manifest file.
+
+A manifest lists the relative path, id, size and content hash of every schema
+file under a root so that collectors can avoid walking the directory tree,
+which is slow on network filesystems.
+
+A manifest also lists every directory under the root. Adding, removing or
+renaming a file or directory updates the modification time of the directory
+containing it, so a manifest is only used whilst none of its directories have
+been modified since it was written. Otherwise it is ignored, and collectors
+walk the directory tree as if there was no manifest, until it is written
+again.
+
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+
+from ..error import ManifestError
+from . import decoder
+
+
+#: Name of manifest file placed in each root directory.
+FILENAME = 'harmony.manifest'
+
+#: Version of manifest format. Increment on incompatible change.
+VERSION = 3
+
+
+def path(root):
+    '''Return path to manifest file for *root*.'''
+    return os.path.join(root, FILENAME)
+
+
+def generate(root):
+    '''Return list of manifest entries for schema files under *root*.
+
+    Each entry is a dictionary with the relative 'path' (using forward
+    slashes), 'id', 'size' and content 'hash' of a schema file. Entries are
+    sorted by path in the same order a collector would walk them.
+
+    Raise ManifestError if a schema file cannot be decoded or has no id.
+
+    '''
+    entries, _ = _scan(root)
+    return entries
+
+
+def _scan(root):
+    '''Return (entries, directories) for *root*.
+
+    entries are as returned by :py:func:`generate` and directories is the
+    list of relative paths (using forward slashes) of every directory walked,
+    starting with '.' for *root* itself.
+
+    '''
+    entries = []
+    directories = []
+    for base, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        directories.append(_relative(base, root))
+
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1] != '.json':
+                continue
+
+            filepath = os.path.join(base, filename)
+            with open(filepath, 'rb') as file_handler:
+                content = file_handler.read()
+
+            try:
+                schema_id = decoder.loads(content)['id']
+            except ValueError as error:
+                raise ManifestError(
+                    'Could not decode schema file {0}: {1}'
+                    .format(filepath, error)
+                )
+            except (KeyError, TypeError):
+                raise ManifestError(
+                    'Schema file {0} has no id.'.format(filepath)
+                )
+
+            entries.append({
+                'path': _relative(filepath, root),
+                'id': schema_id,
+                'size': len(content),
+                'hash': hashlib.sha1(content).hexdigest()
+            })
+
+    return entries, directories
+
+
+def _relative(filepath, root):
+    '''Return path of *filepath* relative to *root* with forward slashes.'''
+    return os.path.relpath(filepath, root).replace(os.sep, '/')
+
+
+def write(root):
+    '''Generate and write manifest for *root*.
+
+    Return path to written manifest.
+
+    Raise ManifestError if a schema file cannot be decoded or has no id.
+
+    '''
+    entries, directories = _scan(root)
+
+    manifest_path = path(root)
+    handle, temporary_path = tempfile.mkstemp(dir=root, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as manifest_file:
+            json.dump(
+                {
+                    'version': VERSION,
+                    'schemas': entries,
+                    'directories': directories
+                },
+                manifest_file, indent=4, sort_keys=True,
+                separators=(',', ': ')
+            )
+
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary_path, 0o666 & ~umask)
+
+        if os.name == 'nt' and os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        os.rename(temporary_path, manifest_path)
+
+    except Exception:
+        os.remove(temporary_path)
+        raise
+
+    # Writing the manifest modified root so ensure the manifest is not
+    # considered older than it.
+    os.utime(manifest_path, None)
+
+    return manifest_path
+
+
+def read(root):
+    '''Return list of manifest entries for *root*.
+
+    Return None if *root* has no manifest, it is of an unsupported version or
+    any of its directories have been modified since it was written.
+
+    '''
+    manifest_path = path(root)
+    try:
+        with open(manifest_path, 'rb') as manifest_file:
+            manifest = decoder.load(manifest_file)
+
+        manifest_modified = os.stat(manifest_path).st_mtime
+    except (IOError, OSError, ValueError):
+        return None
+
+    if manifest.get('version') != VERSION:
+        return None
+
+    for directory in manifest['directories']:
+        try:
+            modified = os.stat(
+                os.path.join(root, *directory.split('/'))
+            ).st_mtime
+        except OSError:
+            return None
+
+        if modified > manifest_modified:
+            return None
+
+    return manifest['schemas']
+
+
+def is_stale(root):
+    '''Return whether manifest for *root* no longer matches its schemas.
+
+    Also return True if there is no manifest or it is out of date (see
+    :py:func:`read`).
+
+    Raise ManifestError if a schema file cannot be decoded or has no id.
+
+    .. note::
+
+        Every schema file is read so this is as expensive as collecting.
+
+    '''
+    entries = read(root)
+    if entries is None:
+        return True
+
+    return entries != generate(root)
@@ -2,13 +2,25 @@
 # :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
 # :license: See LICENSE.txt.
 
+import os
+import sys
 import copy
+import json
+import errno
+import timeit
+import hashlib
+import tempfile
 import urlparse
+import multiprocessing
 from abc import ABCMeta, abstractmethod
 
 import jsonpointer
+from jsonschema.exceptions import SchemaError
 
+from harmony._version import __version__
 from harmony.schema.validator import Validator
+from harmony.schema.dependency import mixin_references, sort
+from harmony.schema.frozen import FrozenDict, FrozenList, freeze, is_frozen
 
 
 class Processor(object):
@@ -16,6 +28,11 @@ class Processor(object):
 
     __metaclass__ = ABCMeta
 
+    #: :py:class:`~harmony.instrumentation.Instrumentation` to record timings
+    #: with, if any. Processors may record the time taken for each schema
+    #: under the name of their class.
+    instrumentation = None
+
     @abstractmethod
     def process(self, schemas):
         '''Process *schemas*
@@ -27,37 +44,297 @@ class Processor(object):
 
         '''
 
+    def update(self, schemas, added, changed, removed):
+        '''Process changes to *schemas* since the last call.
+
+        *schemas* is the full
+        :py:class:`collection <harmony.schema.collection.Collection>`. The
+        schemas with ids in the *added* and *changed* sets have been collected
+        again and are not yet processed, whilst all other schemas are as
+        previously processed. *changed* includes schemas that did not change
+        themselves but depend (see :py:meth:`dependencies`) on schemas that
+        did. *removed* is the set of ids of schemas no longer present.
+
+        Return True if the changes were processed. Return False if not
+        supported, in which case every schema will be collected again and
+        passed to :py:meth:`process` instead.
+
+        The default implementation returns False so that processors need only
+        implement :py:meth:`process`.
+
+        '''
+        return False
+
+    def dependencies(self, schema):
+        '''Return set of ids of schemas that processing *schema* depends on.
+
+        When a schema changes, schemas depending on it are also passed to
+        :py:meth:`update` as changed. Default implementation returns an empty
+        set.
+
+        '''
+        return set()
+
+    def configuration(self):
+        '''Return string describing configuration of processor.
+
+        Used to determine whether previously processed schemas can be reused
+        so should include any options that affect the processed output.
+
+        '''
+        return '{0}.{1}'.format(
+            self.__class__.__module__, self.__class__.__name__
+        )
+
+    def _record(self, schema_id, duration):
+        '''Record *duration* taken to process *schema_id* if instrumented.'''
+        if self.instrumentation is not None:
+            self.instrumentation.record(
+                self.__class__.__name__, schema_id, duration
+            )
+
 
 class ValidateProcessor(Processor):
     '''Check schemas are valid against specification.'''
 
-    def __init__(self, validator_class=None):
+    def __init__(self, validator_class=None, cache=None, workers=None):
         '''Initialise processor.
 
         *validator_class* indicates the validator to use for checking the
         schemas. Defaults to :py:class:`harmony.schema.validator.Validator`.
 
+        Schemas that pass are remembered by a hash of their content so that
+        they are not checked again by this processor. If *cache* is specified
+        it should be the path to a file in which to also store these hashes
+        between sessions.
+
+        *workers* may be set to a number of processes to spread checking
+        across. Only worthwhile when many schemas need checking, such as on a
+        cold start.
+
         '''
         self.validator_class = validator_class
         if self.validator_class is None:
             self.validator_class = Validator
 
+        self.cache = cache
+        self.workers = workers
+        self._passed = None
+        self._stored = 0
+
         super(ValidateProcessor, self).__init__()
 
     def process(self, schemas):
         '''Process *schemas*
         :py:class:`collection <harmony.schema.collection.Collection>`.
 
-        Raise SchemaError if any of the schemas are invalid.
+        Raise SchemaError if any of the schemas are invalid. The error will
+        have the id of the invalid schema set as *schema_id* and its source,
+        if known, as *source*.
 
         '''
-        for schema in schemas:
+        self._check_schemas(schemas, schemas)
+
+    def update(self, schemas, added, changed, removed):
+        '''Process changes to *schemas* since the last call.
+
+        Only the added and changed schemas are checked.
+
+        '''
+        self._check_schemas(
+            schemas,
+            [schemas.get(schema_id) for schema_id in sorted(added | changed)]
+        )
+        return True
+
+    def _check_schemas(self, schemas, candidates):
+        '''Check *candidates* from *schemas* collection that have not passed.
+
+        Raise SchemaError if any of the candidates are invalid.
+
+        '''
+        if self._passed is None:
+            self._passed = self._read_cache()
+
+        pending = []
+        for schema in candidates:
+            key = self._key(schema)
+            if key not in self._passed:
+                pending.append((key, schema))
+
+        if not pending:
+            return
+
+        if self.workers and self.workers > 1 and len(pending) > 1:
+            pool = multiprocessing.Pool(self.workers)
+            try:
+                results = pool.map(
+                    _is_valid_schema,
+                    [(self.validator_class, schema) for _, schema in pending],
+                    chunksize=max(1, len(pending) // (self.workers * 4))
+                )
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            results = [None] * len(pending)
+
+        try:
+            for (key, schema), valid in zip(pending, results):
+                if not valid:
+                    # Check again locally, also when already found invalid by
+                    # a worker, so that the original error is raised.
+                    start = timeit.default_timer()
+                    self._check(schema, schemas)
+                    self._record(schema['id'], timeit.default_timer() - start)
+
+                self._passed.add(key)
+
+        finally:
+            self._write_cache()
+
+    def _check(self, schema, schemas):
+        '''Check *schema* from *schemas* collection.
+
+        Raise SchemaError with schema id and source if *schema* is invalid.
+
+        '''
+        try:
             self.validator_class.check_schema(schema)
+        except SchemaError as error:
+            error.schema_id = schema.get('id')
+            error.source = None
+            if error.schema_id is not None:
+                error.source = schemas.source(error.schema_id)
+
+            raise
+
+    def _key(self, schema):
+        '''Return key identifying content of *schema*.'''
+        content = json.dumps(schema, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def _cache_header(self):
+        '''Return header identifying compatible cache file content.'''
+        return '{0}|{1}'.format(__version__, self.configuration())
+
+    def _read_cache(self):
+        '''Return set of keys for passed schemas stored in cache file.'''
+        if self.cache is None:
+            return set()
+
+        try:
+            with open(self.cache, 'r') as cache_file:
+                lines = cache_file.read().splitlines()
+        except (IOError, OSError):
+            return set()
+
+        if not lines or lines[0] != self._cache_header():
+            return set()
+
+        self._stored = len(lines) - 1
+        return set(lines[1:])
+
+    def _write_cache(self):
+        '''Store keys for passed schemas in cache file if changed.
+
+        Failure to write is not considered an error as the cache is only an
+        optimisation.
+
+        '''
+        if self.cache is None or len(self._passed) == self._stored:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.cache))
+        try:
+            try:
+                os.makedirs(directory)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+            handle, temporary_path = tempfile.mkstemp(
+                dir=directory, suffix='.tmp'
+            )
+            try:
+                with os.fdopen(handle, 'w') as cache_file:
+                    cache_file.write(self._cache_header() + '\n')
+                    for key in sorted(self._passed):
+                        cache_file.write(key + '\n')
+
+                if os.name == 'nt' and os.path.exists(self.cache):
+                    os.remove(self.cache)
+
+                os.rename(temporary_path, self.cache)
+
+            except Exception:
+                os.remove(temporary_path)
+                raise
+
+        except (IOError, OSError):
+            return
+
+        self._stored = len(self._passed)
+
+    def configuration(self):
+        '''Return string describing configuration of processor.'''
+        return '{0}({1}.{2})'.format(
+            super(ValidateProcessor, self).configuration(),
+            self.validator_class.__module__,
+            self.validator_class.__name__
+        )
 
 
 class MixinProcessor(Processor):
     '''Expand mixin references in schemas.'''
 
+    def __init__(self, share=False, resolver=None):
+        '''Initialise processor.
+
+        If *share* is True then values brought in from mixins are shared
+        between the mixin and the schemas mixing it in rather than deep
+        copied. A shared dictionary or array is only copied (shallowly) when a
+        merge needs to change it, so unchanged subtrees are held in memory
+        once.
+
+        .. warning::
+
+            When sharing, processed schemas must be treated as read only as
+            modifying a shared value would affect every schema holding it.
+
+        *resolver* may be a :py:class:`~harmony.schema.resolver.Resolver`
+        used to resolve mixin references that do not use the harmony scheme,
+        such as file:// or http:// references. If not set, such mixins are
+        ignored.
+
+        .. note::
+
+            Mixins resolved by *resolver* are merged as is, without expanding
+            any mixins they contain themselves. Changes to the referenced
+            documents are not detected by a
+            :py:class:`~harmony.schema.cache.Cache`.
+
+        '''
+        self.share = share
+        self.resolver = resolver
+        self._shared = set()
+
+        #: List of (schema id, mixin reference, hint path) for hints that did
+        #: not match anything during the last call to :py:meth:`process`.
+        self.unmatched_hints = []
+
+        super(MixinProcessor, self).__init__()
+
+    def configuration(self):
+        '''Return string describing configuration of processor.'''
+        resolver = None
+        if self.resolver is not None:
+            resolver = self.resolver.configuration()
+
+        return '{0}(share={1}, resolver={2})'.format(
+            super(MixinProcessor, self).configuration(), self.share, resolver
+        )
+
     def process(self, schemas):
         '''Process *schemas*
         :py:class:`collection <harmony.schema.collection.Collection>`.
@@ -69,19 +346,70 @@ class MixinProcessor(Processor):
 
             *schemas* will be modified in place.
 
+        Schemas are processed once each in dependency order so that every
+        mixin is fully expanded before being merged into another schema.
+
+        Hints that did not match anything in their mixin are recorded in
+        :py:attr:`unmatched_hints`.
+
+        Raise MixinCycleError if schemas mix each other in cyclically.
+
         '''
-        # Process schemas
+        dependencies = {}
         for schema in schemas:
-            self._process(schema, schemas)
+            dependencies[schema['id']] = mixin_references(schema)
+
+        self._process_schemas(schemas, dependencies)
+
+    def update(self, schemas, added, changed, removed):
+        '''Process changes to *schemas* since the last call.
+
+        Only the added and changed schemas are expanded, with all other
+        schemas already expanded.
+
+        '''
+        dependencies = {}
+        for schema_id in added | changed:
+            dependencies[schema_id] = mixin_references(
+                schemas.get(schema_id)
+            )
+
+        self._process_schemas(schemas, dependencies)
+        return True
+
+    def dependencies(self, schema):
+        '''Return set of ids of schemas mixed in by *schema*.'''
+        return mixin_references(schema)
+
+    def _process_schemas(self, schemas, dependencies):
+        '''Process schemas in *dependencies* from *schemas* collection.
+
+        *dependencies* should map the id of each schema to process to the
+        set of ids of schemas it mixes in.
+
+        '''
+        self.unmatched_hints = []
 
-    def _process(self, fragment, schemas):
-        '''Process a schema *fragment* against *schemas* collection.'''
+        try:
+            for schema_id in sort(dependencies):
+                start = timeit.default_timer()
+                self._process(schemas.get(schema_id), schemas, schema_id)
+                self._record(schema_id, timeit.default_timer() - start)
+        finally:
+            self._shared.clear()
+
+    def _process(self, fragment, schemas, schema_id):
+        '''Process a schema *fragment* against *schemas* collection.
+
+        *schema_id* is the id of the schema holding *fragment*.
+
+        '''
         # Recurse into relevant fragments.
         # TODO: Can this reuse jsonschema code at all?
         properties = fragment.get('properties', {})
         for value in properties.values():
             if isinstance(value, dict):
-                self._process(value, schemas)
+                self._process(value, schemas, schema_id)
 
         items = fragment.get('items', [])
         if isinstance(items, dict):
@@ -89,11 +417,11 @@ class MixinProcessor(Processor):
 
         for item in items:
             if isinstance(item, dict):
-                self._process(item, schemas)
+                self._process(item, schemas, schema_id)
 
         additional_items = fragment.get('additionalItems')
         if additional_items and isinstance(additional_items, dict):
-            self._process(additional_items, schemas)
+            self._process(additional_items, schemas, schema_id)
 
         # Process mixin directives
         mixins = fragment.pop('$mixin', None)
@@ -109,19 +437,23 @@ class MixinProcessor(Processor):
                 raise KeyError('No $ref defined for mixin.')
 
             parts = urlparse.urlsplit(reference)
-            if parts.scheme != 'harmony':
-                # TODO: Support resolving other schemes. Perhaps reuse
-                # jsonschema RefResolver.
-                continue
+            if parts.scheme == 'harmony':
+                # Lookup referenced schema for mixin. Processing in dependency
+                # order ensures it has already been processed.
+                mixin = schemas.get(reference)
 
-            # Lookup referenced schema for mixin.
-            mixin = schemas.get(reference)
+            elif self.resolver is not None:
+                mixin = self.resolver.resolve(reference)
 
-            # Ensure mixin has also been processed.
-            self._process(mixin, schemas)
+            else:
+                continue
 
             # Merge mixin into the referring fragment.
-            self._merge(fragment, mixin, entry.get('hints', {}))
+            hints = _compile_hints(entry.get('hints', {}))
+            self._merge(fragment, mixin, hints)
+
+            for path in hints.unmatched():
+                self.unmatched_hints.append((schema_id, reference, path))
 
     def _merge(self, target, reference, hints):
         '''Merge *reference* dictionary into *target* dictionary using *hints*.
@@ -146,34 +478,446 @@ class MixinProcessor(Processor):
 
             {"/properties/department/enum": "preserve"}
 
+        *hints* may also be a trie compiled from such a dictionary, in which
+        case the hints that are applied are marked as matched in it.
+
+        Return merged dictionary. This will be *target* unless *target* is
+        shared and had to be copied in order to change it.
+
         '''
+        if not isinstance(hints, _HintNode):
+            hints = _compile_hints(hints)
+
+        merged = target
+
         for key, value in reference.items():
-            relevant_hint = hints.get('/{0}'.format(key))
+            node = hints.children.get(key)
+            relevant_hint = None
+            if node is not None and node.operation is not None:
+                relevant_hint = node.operation
+                node.matched = True
 
             if relevant_hint == 'preserve':
                 continue
 
-            if not key in target or relevant_hint == 'overwrite':
+            if not key in merged or relevant_hint == 'overwrite':
                 # Copy value to target
-                target[key] = copy.deepcopy(value)
+                merged = self._writable(merged)
+                merged[key] = self._copy(value)
 
             else:
+                current = merged[key]
+
                 # Recursive merge if both target and reference value are
                 # dictionaries.
-                if isinstance(value, dict) and isinstance(target[key], dict):
+                if isinstance(value, dict) and isinstance(current, dict):
 
                     # Scope hints to nested only.
-                    child_hints = {}
-                    for path in hints:
-                        if path.startswith('/{0}/'.format(key)):
-                            child_hints[path[len(key) + 1:]] = hints[path]
+                    child_hints = node
+                    if child_hints is None:
+                        child_hints = _EMPTY_HINTS
 
-                    self._merge(target[key], value, child_hints)
+                    child = self._merge(current, value, child_hints)
+                    if child is not current:
+                        merged = self._writable(merged)
+                        merged[key] = child
 
                 # Combine arrays.
-                if isinstance(value, list) and isinstance(target[key], list):
+                if isinstance(value, list) and isinstance(current, list):
+
+                    additions = _additions(current, value)
+                    if additions:
+                        child = self._writable(current)
+                        child.extend(additions)
+                        if child is not current:
+                            merged = self._writable(merged)
+                            merged[key] = child
+
+        return merged
+
+    def _copy(self, value):
+        '''Return copy of *value* to place in a merge target.
+
+        When sharing, *value* itself is returned and recorded as shared.
+
+        '''
+        if not self.share:
+            return copy.deepcopy(value)
+
+        if isinstance(value, (dict, list)):
+            self._shared.add(id(value))
+
+        return value
+
+    def _writable(self, container):
+        '''Return version of *container* that can be modified.
+
+        Shared and frozen containers are copied, with the values they hold
+        then recorded as shared in turn. Other containers are returned as is.
+
+        '''
+        if id(container) not in self._shared and not is_frozen(container):
+            return container
+
+        if isinstance(container, dict):
+            container = dict(container)
+            values = container.values()
+        else:
+            container = list(container)
+            values = container
+
+        for value in values:
+            if isinstance(value, (dict, list)):
+                self._shared.add(id(value))
+
+        return container
+
+
+class FreezeProcessor(Processor):
+    '''Convert schemas to read only form.
+
+    Should be the last processor as schemas cannot be modified afterwards.
+    See :py:mod:`harmony.schema.frozen`.
+
+    '''
+
+    def process(self, schemas):
+        '''Process *schemas*
+        :py:class:`collection <harmony.schema.collection.Collection>`.
+
+        Each schema is replaced in *schemas* by a frozen equivalent.
+
+        '''
+        self._freeze(schemas, [schema['id'] for schema in schemas])
+
+    def update(self, schemas, added, changed, removed):
+        '''Process changes to *schemas* since the last call.
+
+        Only the added and changed schemas are frozen.
+
+        '''
+        self._freeze(schemas, added | changed)
+        return True
+
+    def _freeze(self, schemas, schema_ids):
+        '''Replace schemas with *schema_ids* in *schemas* by frozen ones.'''
+        memo = {}
+        for schema_id in list(schema_ids):
+            schema = schemas.get(schema_id)
+            source = schemas.source(schema_id)
+            schemas.remove(schema_id)
+            schemas.add(freeze(schema, memo), source)
+
+
+class InternProcessor(Processor):
+    '''Share equal strings and subtrees between schemas.
+
+    Equal strings, including dictionary keys, are replaced by a single
+    instance. Structurally identical frozen dictionaries and lists (see
+    :py:class:`FreezeProcessor`) are also replaced by a single instance, so
+    place after a :py:class:`FreezeProcessor` to share subtrees as well as
+    strings. Values are only considered equal when of the same type, so for
+    example 1 and True are not shared.
+
+    .. note::
+
+        Values are only shared between schemas processed in the same call, so
+        after an incremental refresh reprocessed schemas will not share with
+        other schemas.
+
+    '''
+
+    def __init__(self, measure=False):
+        '''Initialise processor.
+
+        If *measure* is True then the memory used by each schema is measured
+        before and after interning and recorded in :py:attr:`report`.
+        Measuring is comparatively slow.
+
+        '''
+        self.measure = measure
+
+        #: Mapping of schema id to dictionary of bytes used 'before' and
+        #: 'after' interning and bytes 'saved', as of the last call to
+        #: :py:meth:`process` when measuring. Bytes are counted once across
+        #: all schemas, with each schema counting only those not already
+        #: counted for a previous schema.
+        self.report = {}
+
+        super(InternProcessor, self).__init__()
+
+    def process(self, schemas):
+        '''Process *schemas*
+        :py:class:`collection <harmony.schema.collection.Collection>`.
+
+        Each frozen schema is replaced in *schemas* by its interned
+        equivalent. Other schemas are modified in place.
+
+        '''
+        self._intern_schemas(schemas, [schema['id'] for schema in schemas])
+
+    def update(self, schemas, added, changed, removed):
+        '''Process changes to *schemas* since the last call.
+
+        Only the added and changed schemas are interned, sharing values
+        amongst themselves.
+
+        '''
+        self._intern_schemas(schemas, added | changed)
+        return True
+
+    def _intern_schemas(self, schemas, schema_ids):
+        '''Intern schemas with *schema_ids* in *schemas*.'''
+        items = sorted(
+            (schema_id, schemas.get(schema_id)) for schema_id in schema_ids
+        )
+
+        before = {}
+        if self.measure:
+            seen = set()
+            for schema_id, schema in items:
+                before[schema_id] = _size(schema, seen)
+
+        strings = {}
+        subtrees = {}
+        for schema_id, schema in items:
+            interned, _ = self._intern(schema, strings, subtrees)
+            if interned is not schema:
+                source = schemas.source(schema_id)
+                schemas.remove(schema_id)
+                schemas.add(interned, source)
+
+        self.report = {}
+        if self.measure:
+            seen = set()
+            for schema_id, _ in items:
+                after = _size(schemas.get(schema_id), seen)
+                self.report[schema_id] = {
+                    'before': before[schema_id],
+                    'after': after,
+                    'saved': before[schema_id] - after
+                }
+
+    def _intern(self, value, strings, subtrees):
+        '''Return (interned value, key) for *value*.
+
+        *key* is hashable and equal for values that are equal and of the same
+        types. *strings* and *subtrees* map keys to the interned values.
+
+        '''
+        if isinstance(value, basestring):
+            key = (type(value), value)
+            return strings.setdefault(key, value), key
+
+        if isinstance(value, dict):
+            entries = []
+            keys = []
+            for name, item in value.iteritems():
+                name, name_key = self._intern(name, strings, subtrees)
+                item, item_key = self._intern(item, strings, subtrees)
+                entries.append((name, item))
+                keys.append((name_key, item_key))
+
+            key = (dict, frozenset(keys))
+
+            if isinstance(value, FrozenDict):
+                interned = subtrees.get(key)
+                if interned is None:
+                    interned = FrozenDict(entries)
+                    subtrees[key] = interned
+
+                return interned, key
+
+            value.clear()
+            value.update(entries)
+            return value, key
+
+        if isinstance(value, list):
+            entries = []
+            keys = []
+            for item in value:
+                item, item_key = self._intern(item, strings, subtrees)
+                entries.append(item)
+                keys.append(item_key)
+
+            key = (list, tuple(keys))
+
+            if isinstance(value, FrozenList):
+                interned = subtrees.get(key)
+                if interned is None:
+                    interned = FrozenList(entries)
+                    subtrees[key] = interned
+
+                return interned, key
+
+            value[:] = entries
+            return value, key
+
+        return value, (type(value), value)
+
+
+def _size(value, seen):
+    '''Return bytes used by *value* and the values it holds.
+
+    Objects whose id is in *seen* are not counted and the ids of counted
+    objects are added to *seen*.
+
+    '''
+    if id(value) in seen:
+        return 0
+
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            size += _size(key, seen) + _size(item, seen)
+
+    elif isinstance(value, list):
+        for item in value:
+            size += _size(item, seen)
+
+    return size
+
+
+class _HintNode(object):
+    '''Node in a trie of mixin hints keyed by JSON pointer reference token.'''
+
+    __slots__ = ('operation', 'path', 'matched', 'children')
+
+    def __init__(self, operation=None, path=''):
+        '''Initialise node with *operation* for hint at *path*.'''
+        self.operation = operation
+        self.path = path
+        self.matched = False
+        self.children = {}
+
+    def unmatched(self):
+        '''Return sorted list of hint paths under node that did not match.'''
+        paths = []
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.operation is not None and not node.matched:
+                paths.append(node.path)
+
+            nodes.extend(node.children.values())
+
+        return sorted(paths)
+
+
+#: Trie without any hints, used when merging fragments no hint applies to.
+_EMPTY_HINTS = _HintNode()
+
+
+def _compile_hints(hints):
+    '''Return root of trie compiled from *hints*.
+
+    *hints* should be a dictionary of {JSON pointer: operation}. Each node
+    in the trie is a :py:class:`_HintNode`.
+
+    '''
+    root = _HintNode()
+    for path, operation in hints.items():
+        node = root
+        for token in path.split('/')[1:]:
+            token = token.replace('~1', '/').replace('~0', '~')
+            child = node.children.get(token)
+            if child is None:
+                child = _HintNode()
+                node.children[token] = child
+
+            node = child
+
+        if node is not root:
+            node.operation = operation
+            node.path = path
+
+    return root
+
+
+def _is_valid_schema(arguments):
+    '''Return whether schema is valid for (validator class, schema) pair.
+
+    Used to check schemas in worker processes.
+
+    '''
+    validator_class, schema = arguments
+    try:
+        validator_class.check_schema(schema)
+    except SchemaError:
+        return False
+
+    return True
+
+
+#: Size (as product of array lengths) above which arrays are combined using a
+#: hash index rather than by scanning.
+_INDEX_THRESHOLD = 64
+
+
+def _additions(target, reference):
+    '''Return entries of *reference* array to add to *target* array.
+
+    Entries already in *target* and repeated entries are excluded, with the
+    order of *reference* otherwise preserved. Entries are compared by equality
+    as for the ``in`` operator.
+
+    Large arrays are compared through a hash index of canonical forms of the
+    entries, falling back to scanning for any entry that cannot be hashed.
+
+    '''
+    additions = []
+
+    if len(target) * len(reference) <= _INDEX_THRESHOLD:
+        for entry in reference:
+            if not entry in target and not entry in additions:
+                additions.append(entry)
+
+        return additions
+
+    try:
+        index = set(_canonical(entry) for entry in target)
+    except TypeError:
+        index = None
+
+    for entry in reference:
+        if index is not None:
+            try:
+                key = _canonical(entry)
+            except TypeError:
+                pass
+            else:
+                if key not in index:
+                    index.add(key)
+                    additions.append(entry)
+
+                continue
+
+        if not entry in target and not entry in additions:
+            additions.append(entry)
+
+    return additions
+
+
+def _canonical(value):
+    '''Return hashable canonical form of JSON *value*.
+
+    Canonical forms of two values are equal when the values are equal.
+
+    Raise TypeError if *value* holds something that cannot be hashed.
+
+    '''
+    if isinstance(value, dict):
+        return (
+            dict,
+            frozenset(
+                (key, _canonical(item)) for key, item in value.items()
+            )
+        )
 
-                    for entry in value:
-                        if not entry in target[key]:
-                            target[key].append(entry)
+    if isinstance(value, list):
+        return (list, tuple(_canonical(item) for item in value))
 
+    hash(value)
+    return value
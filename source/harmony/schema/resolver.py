@@ -0,0 +1,417 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+'''Resolve references to documents outside of the harmony scheme.
+
+A :py:class:`Resolver` fetches documents referenced by URI, such as
+``file:///path/to/shared.json#/definitions/name`` or
+``https://registry/schema/shared.json``, and resolves any fragment in them as
+a JSON pointer. Each document is fetched and decoded at most once per
+resolver and kept in a bounded cache so that many references to the same
+document are cheap.
+
+'''
+
+import os
+import time
+import errno
+import socket
+import hashlib
+import httplib
+import tempfile
+import threading
+import urllib
+import urlparse
+import collections
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import jsonpointer
+
+from ..error import ResolutionError
+from . import decoder
+
+
+class Resolver(object):
+    '''Resolve references to external documents.'''
+
+    #: Version of the stored entry format. Increment on incompatible change.
+    VERSION = 1
+
+    #: Maximum number of redirects to follow for a single request.
+    MAX_REDIRECTS = 5
+
+    def __init__(self, size=128, cache_path=None, max_age=None, timeout=30):
+        '''Initialise resolver.
+
+        *size* is the number of decoded documents to keep in memory, with the
+        least recently used discarded first.
+
+        If *cache_path* is specified then documents fetched over http(s) are
+        also stored in that directory between sessions. A stored document is
+        used without contacting the server whilst younger than *max_age*
+        seconds (if set). Otherwise it is revalidated with a conditional
+        request so that an unchanged document is not transferred again.
+
+        *timeout* is the number of seconds to wait on network operations.
+
+        Connections to each host are kept open and reused between requests.
+
+        A resolver can be shared between threads. Documents are fetched
+        concurrently, except that threads requesting a document already being
+        fetched wait for that fetch rather than fetching it again.
+
+        Additional schemes can be supported by adding to self.handlers, which
+        maps scheme to a function accepting a URI (without fragment) and
+        returning the document content.
+
+        '''
+        self.size = size
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.timeout = timeout
+
+        self.handlers = {
+            'file': self._fetch_file,
+            'http': self._fetch_http,
+            'https': self._fetch_http
+        }
+
+        self._documents = collections.OrderedDict()
+        self._loading = {}
+        self._connections = {}
+        self._lock = threading.RLock()
+
+        super(Resolver, self).__init__()
+
+    def resolve(self, reference):
+        '''Return fragment of document referred to by *reference* URI.
+
+        Raise ResolutionError if the reference cannot be resolved.
+
+        .. note::
+
+            The returned value is shared with the cache and should not be
+            modified.
+
+        '''
+        uri, fragment = urlparse.urldefrag(reference)
+        document = self.document(uri)
+
+        if not fragment:
+            return document
+
+        try:
+            return jsonpointer.resolve_pointer(
+                document, urllib.unquote(fragment)
+            )
+        except jsonpointer.JsonPointerException as error:
+            raise ResolutionError(
+                'Could not resolve fragment of {0}: {1}'
+                .format(reference, error)
+            )
+
+    def document(self, uri):
+        '''Return document at *uri*, fetching it if not cached.
+
+        Raise ResolutionError if the document cannot be fetched or decoded.
+
+        '''
+        with self._lock:
+            try:
+                document = self._documents.pop(uri)
+            except KeyError:
+                pass
+            else:
+                self._documents[uri] = document
+                return document
+
+            loading = self._loading.get(uri)
+            if loading is not None:
+                waiting = True
+            else:
+                waiting = False
+                loading = _Loading()
+                self._loading[uri] = loading
+
+        if waiting:
+            return loading.wait()
+
+        try:
+            document = self._load(uri)
+        except BaseException as error:
+            with self._lock:
+                del self._loading[uri]
+
+            loading.finish(error=error)
+            raise
+
+        with self._lock:
+            del self._loading[uri]
+            self._documents[uri] = document
+            while len(self._documents) > self.size:
+                self._documents.popitem(last=False)
+
+        loading.finish(document)
+        return document
+
+    def ref_handlers(self):
+        '''Return mapping of scheme to function returning decoded document.
+
+        Suitable as the handlers of a :py:class:`jsonschema.RefResolver` so
+        that references resolved during validation share this resolver.
+
+        '''
+        return dict((scheme, self.document) for scheme in self.handlers)
+
+    def clear(self):
+        '''Discard cached documents held in memory.'''
+        with self._lock:
+            self._documents.clear()
+
+    def close(self):
+        '''Close any open connections not currently in use.'''
+        with self._lock:
+            for connections in self._connections.values():
+                for connection in connections:
+                    connection.close()
+
+            self._connections.clear()
+
+    def configuration(self):
+        '''Return string describing configuration of resolver.'''
+        return '{0}.{1}'.format(
+            self.__class__.__module__, self.__class__.__name__
+        )
+
+    def _load(self, uri):
+        '''Fetch and return decoded document at *uri*.'''
+        scheme = urlparse.urlsplit(uri).scheme
+        handler = self.handlers.get(scheme)
+        if handler is None:
+            raise ResolutionError(
+                'No handler for scheme {0!r} of {1}.'.format(scheme, uri)
+            )
+
+        try:
+            content = handler(uri)
+        except ResolutionError:
+            raise
+        except (IOError, OSError, httplib.HTTPException,
+                socket.error) as error:
+            raise ResolutionError(
+                'Could not fetch {0}: {1}'.format(uri, error)
+            )
+
+        try:
+            return decoder.loads(content)
+        except ValueError as error:
+            raise ResolutionError(
+                'Could not decode {0}: {1}'.format(uri, error)
+            )
+
+    def _fetch_file(self, uri):
+        '''Return content of file at file *uri*.'''
+        parts = urlparse.urlsplit(uri)
+        path = urllib.url2pathname(parts.path)
+        if parts.netloc and parts.netloc != 'localhost':
+            # UNC path.
+            path = '//{0}{1}'.format(parts.netloc, path)
+
+        with open(path, 'rb') as file_handler:
+            return file_handler.read()
+
+    def _fetch_http(self, uri):
+        '''Return content at http(s) *uri*, consulting on-disk cache.'''
+        entry = self._read_entry(uri)
+        if (
+            entry is not None
+            and self.max_age is not None
+            and time.time() - entry['stored'] < self.max_age
+        ):
+            return entry['content']
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        target = uri
+        for _ in range(self.MAX_REDIRECTS + 1):
+            status, response_headers, content = self._request(target, headers)
+
+            if status in (301, 302, 303, 307, 308):
+                target = urlparse.urljoin(target, response_headers['location'])
+                continue
+
+            if status == 304 and entry is not None:
+                entry['stored'] = time.time()
+                self._write_entry(uri, entry)
+                return entry['content']
+
+            if status != 200:
+                raise ResolutionError(
+                    'Could not fetch {0}: HTTP status {1}'.format(uri, status)
+                )
+
+            self._write_entry(uri, {
+                'version': self.VERSION,
+                'stored': time.time(),
+                'etag': response_headers.get('etag'),
+                'last_modified': response_headers.get('last-modified'),
+                'content': content
+            })
+            return content
+
+        raise ResolutionError('Too many redirects fetching {0}.'.format(uri))
+
+    def _request(self, uri, headers):
+        '''Make GET request for *uri* with *headers* on pooled connection.
+
+        Return (status, headers, content). Headers are keyed by lower case
+        name.
+
+        A connection is taken from the pool of idle connections to the host
+        for the duration of the request, so requests to the same host can be
+        made concurrently on separate connections.
+
+        '''
+        parts = urlparse.urlsplit(uri)
+        key = (parts.scheme, parts.netloc)
+        path = urlparse.urlunsplit(
+            ('', '', parts.path or '/', parts.query, '')
+        )
+
+        for attempt in range(2):
+            connection = None
+            with self._lock:
+                idle = self._connections.get(key)
+                if idle:
+                    connection = idle.pop()
+
+            if connection is None:
+                if parts.scheme == 'https':
+                    connection = httplib.HTTPSConnection(
+                        parts.netloc, timeout=self.timeout
+                    )
+                else:
+                    connection = httplib.HTTPConnection(
+                        parts.netloc, timeout=self.timeout
+                    )
+
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error):
+                # Server may have closed a kept alive connection so retry
+                # once on a new connection.
+                connection.close()
+                if attempt:
+                    raise
+
+                continue
+
+            if response.will_close:
+                connection.close()
+            else:
+                with self._lock:
+                    self._connections.setdefault(key, []).append(connection)
+
+            response_headers = dict(
+                (name.lower(), value)
+                for name, value in response.getheaders()
+            )
+            return response.status, response_headers, content
+
+    def _entry_path(self, uri):
+        '''Return path to on-disk cache entry for *uri*.'''
+        key = hashlib.sha1(uri.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_path, '{0}.document'.format(key))
+
+    def _read_entry(self, uri):
+        '''Return on-disk cache entry for *uri* or None if not available.'''
+        if self.cache_path is None:
+            return None
+
+        try:
+            with open(self._entry_path(uri), 'rb') as entry_file:
+                entry = pickle.load(entry_file)
+        except Exception:
+            # Missing or unreadable entries are treated as a miss.
+            return None
+
+        if entry.get('version') != self.VERSION:
+            return None
+
+        return entry
+
+    def _write_entry(self, uri, entry):
+        '''Store on-disk cache *entry* for *uri*.
+
+        Failure to write the entry is not considered an error as the cache is
+        only an optimisation.
+
+        '''
+        if self.cache_path is None:
+            return
+
+        target = self._entry_path(uri)
+        try:
+            try:
+                os.makedirs(self.cache_path)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+            handle, temporary_path = tempfile.mkstemp(
+                dir=self.cache_path, suffix='.tmp'
+            )
+            try:
+                with os.fdopen(handle, 'wb') as entry_file:
+                    pickle.dump(entry, entry_file, pickle.HIGHEST_PROTOCOL)
+
+                if os.name == 'nt' and os.path.exists(target):
+                    os.remove(target)
+
+                os.rename(temporary_path, target)
+
+            except Exception:
+                os.remove(temporary_path)
+                raise
+
+        except (IOError, OSError):
+            pass
+
+
+class _Loading(object):
+    '''Fetch of a document in progress that other threads can wait on.'''
+
+    def __init__(self):
+        '''Initialise unfinished fetch.'''
+        self._finished = threading.Event()
+        self._document = None
+        self._error = None
+
+    def finish(self, document=None, error=None):
+        '''Finish with fetched *document* or the *error* raised fetching it.'''
+        self._document = document
+        self._error = error
+        self._finished.set()
+
+    def wait(self):
+        '''Return fetched document once finished.
+
+        Raise the error raised fetching the document, if any.
+
+        '''
+        self._finished.wait()
+        if self._error is not None:
+            raise self._error
+
+        return self._document
@@ -4,17 +4,12 @@
 
 import os
 import pkgutil
-try:
-    import json
-except ImportError:
-    try:
-        import simplejson as json
-    except ImportError:
-        raise ImportError('Could not import json or simplejson')
 
 import jsonschema.validators
 from jsonschema import draft4_format_checker as format_checker
 
+from . import decoder
+
 
 # Custom validators
 def _required(validator, required, instance, schema):
@@ -40,7 +35,7 @@ _Validator = jsonschema.validators.extend(
 )
 
 # Ensure appropriate meta schema set.
-meta_schema = json.loads(
+meta_schema = decoder.loads(
     pkgutil.get_data('harmony.schema', 'meta.json')
 )
 
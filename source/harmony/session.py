@@ -3,11 +3,30 @@
 # :license: See LICENSE.txt.
 
 import os
+import itertools
+import threading
+import collections
+import multiprocessing
 
-from harmony.schema.collection import Collection
+import jsonschema
+from jsonschema._utils import Unset
+
+from harmony.schema.cache import Cache
+from harmony.schema.collection import Collection, LayeredCollection
 from harmony.schema.collector import FilesystemCollector
-from harmony.schema.processor import MixinProcessor, ValidateProcessor
+from harmony.schema.frozen import thaw
+from harmony.schema.layer import Layer
+from harmony.schema.processor import (
+    MixinProcessor, ValidateProcessor, FreezeProcessor
+)
 from harmony.schema.validator import Validator
+from harmony.watcher import Watcher
+
+
+#: Marker to include in the instances passed to
+#: :py:meth:`Session.validate_many` to have every instance before it validated
+#: and its result yielded before any further instances are read.
+FLUSH = object()
 
 
 class Session(object):
@@ -18,7 +37,9 @@ class Session(object):
         os.path.dirname(__file__), '..', '..', 'resource', 'schema'
     )
 
-    def __init__(self, collector=None, processors=None, validator_class=None):
+    def __init__(self, collector=None, processors=None, validator_class=None,
+                 cache=None, lazy=False, layered=False, instrumentation=None,
+                 resolver=None, freeze=False, validator_cache_size=128):
         '''Initialise session.
 
         *collector* is used to collect schemas for use in the session and
@@ -27,6 +48,23 @@ class Session(object):
         :py:class:`~harmony.schema.collector.FileSystemCollector` using the
         environment variable :envvar:`HARMONY_SCHEMA_PATH` to discover schemas.
 
+        *collector* may also be a list of collectors in which case each forms
+        a separate :py:class:`~harmony.schema.layer.Layer`. Later layers
+        shadow schemas with the same id in earlier layers and can mix in
+        schemas from earlier layers. Each layer is processed and cached on its
+        own so changes to a later layer never cause an earlier layer to be
+        collected or processed again.
+
+        .. note::
+
+            Schemas in a layer are processed against that layer and those
+            before it only. Shadowing a schema therefore does not affect how
+            earlier layers were processed.
+
+        If *layered* is True and *collector* is not specified then each entry
+        in :envvar:`HARMONY_SCHEMA_PATH` will form a separate layer, in order
+        of increasing precedence.
+
         *processors* specifies a list of
         :py:class:`~harmony.schema.processor.Processor` instances that will
         post-process any discovered schemas. If not specified will default to
@@ -37,42 +75,218 @@ class Session(object):
         and instances. Defaults to
         :py:class:`harmony.schema.validator.Validator`.
 
+        *cache* may be a :py:class:`~harmony.schema.cache.Cache` used to store
+        processed schemas between sessions so that, whilst the source files
+        are unchanged, they can be loaded directly rather than collected and
+        processed again. Defaults to a cache at the location specified by the
+        environment variable :envvar:`HARMONY_SCHEMA_CACHE` if set, otherwise
+        no caching is performed. When processors are not specified, the
+        default :py:class:`~harmony.schema.processor.ValidateProcessor` also
+        records which schemas passed validation in the cache directory so
+        that unchanged schemas are not checked again.
+
+        If *lazy* is True and the collector supports indexing its schemas then
+        a :py:class:`~harmony.schema.collection.LazyCollection` will be used
+        so that schemas are only loaded and processed when first accessed.
+
+        *instrumentation* may be an
+        :py:class:`~harmony.instrumentation.Instrumentation` used to time each
+        refresh. The report of the last refresh is then available as
+        self.report.
+
+        *resolver* may be a :py:class:`~harmony.schema.resolver.Resolver`
+        used to resolve references to documents outside of the harmony scheme,
+        both for mixins in the default processors and for $ref during
+        validation.
+
+        If *freeze* is True then a
+        :py:class:`~harmony.schema.processor.FreezeProcessor` is added after
+        *processors* so that processed schemas are read only and hashable.
+        They can then be shared between threads and used as keys without
+        copying. See :py:mod:`harmony.schema.frozen`.
+
+        *validator_cache_size* is the number of prepared validators to keep
+        for reuse between calls to :py:meth:`validate`, with the least
+        recently used discarded first. Set to 0 to disable.
+
+        .. note::
+
+            Validators are not safe to share between threads so each thread
+            keeps its own cache.
+
         '''
         self.schemas = Collection()
+        self.validator_cache_size = validator_cache_size
+        self._validators = threading.local()
+        self._generation = 0
+        self.resolver = resolver
+        self.instrumentation = instrumentation
+        self.report = None
+        self._refresh_lock = threading.RLock()
 
         self.collector = collector
         if self.collector is None:
             paths = os.environ.get(
                 'HARMONY_SCHEMA_PATH', self.DEFAULT_SCHEMA_PATH
             ).split(os.pathsep)
-            self.collector = FilesystemCollector(paths)
+
+            if layered:
+                self.collector = [
+                    FilesystemCollector([path]) for path in paths
+                ]
+            else:
+                self.collector = FilesystemCollector(paths)
 
         self.validator_class = validator_class
         if self.validator_class is None:
             self.validator_class = Validator
 
+        self.cache = cache
+        if self.cache is None:
+            cache_path = os.environ.get('HARMONY_SCHEMA_CACHE')
+            if cache_path:
+                self.cache = Cache(cache_path)
+
         self.processors = processors
         if self.processors is None:
+            validate_cache = None
+            if self.cache is not None:
+                validate_cache = os.path.join(
+                    self.cache.path, 'validated.cache'
+                )
+
             self.processors = [
-                ValidateProcessor(self.validator_class), MixinProcessor()
+                ValidateProcessor(self.validator_class, cache=validate_cache),
+                MixinProcessor(resolver=self.resolver)
             ]
 
+        if freeze:
+            self.processors = list(self.processors) + [FreezeProcessor()]
+
+        self.lazy = lazy
+
+        collectors = self.collector
+        if not isinstance(collectors, (list, tuple)):
+            collectors = [collectors]
+
+        self.layers = [
+            Layer(
+                layer_collector, self.processors, self.cache, self.lazy,
+                self.instrumentation
+            )
+            for layer_collector in collectors
+        ]
+
         self.refresh()
 
-    def refresh(self):
-        '''Discover schemas and add to local collection.
+    def refresh(self, incremental=False):
+        '''Discover schemas and replace local collection.
 
         .. note::
 
             Collection will be processed with self.processors.
 
+        If the collector provides a prepared collection of processed schemas
+        (see :py:meth:`~harmony.schema.collector.Collector.collection`) then
+        that is used as is. Otherwise, if a cache is configured and holds a
+        valid entry then the processed schemas will be loaded from it instead.
+
+        If *incremental* is True then only source files that have been added,
+        changed or removed since the last refresh are reloaded. Those schemas,
+        and any schemas that transitively depend on them (such as by mixing
+        them in), are processed again whilst all other processed schemas are
+        kept as is. Processors are passed the changes through
+        :py:meth:`~harmony.schema.processor.Processor.update`. A full refresh
+        is performed instead when the collector does not report its sources,
+        the state of sources is unknown (such as when the collector provides
+        a prepared collection) or a processor does not support updates.
+
+        With multiple layers, each layer is refreshed in turn and only
+        schemas in later layers that depend on changes in earlier layers are
+        processed again.
+
+        The new collection is built separately and only assigned to
+        self.schemas once complete. Refreshes are serialised so that it is
+        safe to call from a background thread (such as a
+        :py:class:`~harmony.watcher.Watcher`).
+
+        If instrumented, the report for the refresh is stored as self.report
+        and passed to the instrumentation callback, including when the
+        refresh fails.
+
         '''
-        self.schemas.clear()
-        for schema in self.collector.collect():
-            self.schemas.add(schema)
+        with self._refresh_lock:
+            # Discard cached validators on next use.
+            self._generation += 1
+
+            if self.instrumentation is None:
+                self._refresh(incremental)
+                return
+
+            self.instrumentation.reset()
+            try:
+                with self.instrumentation.stage(
+                    'refresh', incremental=incremental
+                ):
+                    self._refresh(incremental)
+            finally:
+                self.report = self.instrumentation.report()
+                self.instrumentation.notify('refresh', self.report)
+
+    def _refresh(self, incremental):
+        '''Refresh each layer in turn and replace local collection.'''
+        changes = set()
+        for index, layer in enumerate(self.layers):
+            lower_layers = self.layers[:index]
+
+            fallback = None
+            context = ''
+            if lower_layers:
+                fallback = LayeredCollection(
+                    [lower_layer.schemas for lower_layer in lower_layers]
+                )
+                if self.cache is not None:
+                    context = '|'.join(
+                        str(lower_layer.signature())
+                        for lower_layer in lower_layers
+                    )
+
+            try:
+                layer_changes = layer.refresh(
+                    incremental, fallback, changes, context
+                )
+            except Exception:
+                # Ensure layers that may depend on changes already applied
+                # to lower layers are fully refreshed next time.
+                for upper_layer in self.layers[index:]:
+                    upper_layer.invalidate()
+
+                raise
+
+            if layer_changes is None or changes is None:
+                changes = None
+            else:
+                changes.update(layer_changes)
+
+        if len(self.layers) == 1:
+            self.schemas = self.layers[0].schemas
+        else:
+            self.schemas = LayeredCollection(
+                [layer.schemas for layer in self.layers]
+            )
 
-        for processor in self.processors:
-            processor.process(self.schemas)
+    def watch(self, interval=1.0, delay=0.5, callback=None):
+        '''Watch schema paths and refresh automatically on change.
+
+        Return started :py:class:`~harmony.watcher.Watcher`. See that class for
+        a description of *interval*, *delay* and *callback*.
+
+        '''
+        watcher = Watcher(
+            self, interval=interval, delay=delay, callback=callback
+        )
+        watcher.start()
+        return watcher
 
     def instantiate(self, schema, data=None):
         '''Instantiate *schema* with initial *data*.
@@ -119,11 +333,11 @@ class Session(object):
                 # Set default values.
                 default = value.get('default')
                 if default:
-                    data.setdefault(key, default)
+                    data.setdefault(key, thaw(default))
 
         return data
 
-    def validate(self, instance, additional_schemas=None):
+    def validate(self, instance, additional_schemas=None, max_errors=None):
         '''Validate *instance*.
 
         If *additional_schemas* is supplied, will also validate against those.
@@ -132,44 +346,377 @@ class Session(object):
         Return any errors as a list of objects containing full diagnostic
         information.
 
+        If *max_errors* is set then validation stops once that many errors
+        have been found, without collecting any further errors. Raise
+        ValueError if *max_errors* is less than 1.
+
         '''
+        _check_max_errors(max_errors)
+
         # Validate against base system requirements.
-        errors = self._validate(instance, ['harmony:/base'])
+        errors = self._validate(instance, ['harmony:/base'], max_errors)
         if errors:
             return errors
 
         # Validate against specified harmony schema.
-        errors = self._validate(instance, [instance['harmony_type']])
+        errors = self._validate(
+            instance, [instance['harmony_type']], max_errors
+        )
         if errors:
             return errors
 
         # Validate against additional schemas if required.
         if additional_schemas is not None:
-            errors = self._validate(instance, additional_schemas)
+            errors = self._validate(instance, additional_schemas, max_errors)
             return errors
 
         return []
 
-    def _validate(self, instance, schemas):
+    def is_valid(self, instance, additional_schemas=None):
+        '''Return whether *instance* is valid.
+
+        Validation is as for :py:meth:`validate` but stops at the first error.
+
+        '''
+        return not self.validate(instance, additional_schemas, max_errors=1)
+
+    def validate_many(self, instances, additional_schemas=None, workers=None,
+                      chunksize=100, max_errors=None):
+        '''Validate each of *instances*, yielding results as available.
+
+        Yield (index, errors) for each instance in the order of *instances*,
+        where errors is as returned by :py:meth:`validate` for the instance
+        with *additional_schemas* and *max_errors*. *instances* may be any
+        iterable, including a generator, and is consumed progressively so
+        that memory use is bounded regardless of the number of instances.
+
+        *instances* may also include :py:data:`FLUSH` markers, which are not
+        validated and have no index. On reaching one, results for all earlier
+        instances are yielded before *instances* is read further. This lets
+        a generator that does its own buffering bound it.
+
+        If *workers* is greater than 1 then instances are validated in a pool
+        of that many processes, in chunks of *chunksize* instances. Workers
+        are forked from this process and so share its processed schemas
+        rather than collecting them again. Errors are transferred back as
+        plain data and reconstructed, with their schema being the registered
+        schema object where applicable.
+
+        .. note::
+
+            Worker processes are only used on platforms supporting fork.
+            Elsewhere, instances are validated in this process.
+
+        Raise ValueError if *max_errors* is less than 1.
+
+        '''
+        _check_max_errors(max_errors)
+
+        if not workers or workers <= 1 or not hasattr(os, 'fork'):
+            index = 0
+            for instance in instances:
+                if instance is FLUSH:
+                    continue
+
+                yield index, self.validate(
+                    instance, additional_schemas, max_errors
+                )
+                index += 1
+
+            return
+
+        pool = multiprocessing.Pool(
+            workers, initializer=_initialise_worker,
+            initargs=(self, additional_schemas, max_errors)
+        )
+        try:
+            # Limit chunks in flight so that instances are not read ahead
+            # of results being consumed.
+            pending = collections.deque()
+            index = 0
+            for chunk, flush in _chunks(instances, chunksize):
+                if chunk:
+                    pending.append(
+                        (index, pool.apply_async(_validate_chunk, (chunk,)))
+                    )
+                    index += len(chunk)
+
+                limit = workers * 2
+                if flush:
+                    limit = 0
+
+                while len(pending) > limit:
+                    start, result = pending.popleft()
+                    for entry in self._load_results(
+                        start, result, additional_schemas
+                    ):
+                        yield entry
+
+            while pending:
+                start, result = pending.popleft()
+                for entry in self._load_results(
+                    start, result, additional_schemas
+                ):
+                    yield entry
+
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _load_results(self, start, result, additional_schemas):
+        '''Return list of (index, errors) from asynchronous chunk *result*.
+
+        *start* is the index of the first instance in the chunk.
+
+        '''
+        results = []
+        for offset, errors in enumerate(result.get()):
+            results.append((
+                start + offset,
+                [
+                    _load_error(data, self.schemas, additional_schemas)
+                    for data in errors
+                ]
+            ))
+
+        return results
+
+    def _validator(self, key, schema):
+        '''Return validator for *schema*, reusing a cached one if possible.
+
+        *key* should be the id that *schema* was looked up with or the
+        identity of *schema* if passed directly. A cached validator is only
+        reused if it was prepared for the same *schema* object.
+
+        '''
+        if not self.validator_cache_size:
+            return self._create_validator(schema)
+
+        cache = getattr(self._validators, 'cache', None)
+        if (
+            cache is None
+            or self._validators.generation != self._generation
+        ):
+            cache = collections.OrderedDict()
+            self._validators.cache = cache
+            self._validators.generation = self._generation
+
+        entry = cache.pop(key, None)
+        if entry is None or entry[0] is not schema:
+            # Holding schema ensures its identity is not reused whilst cached.
+            entry = (schema, self._create_validator(schema))
+
+        cache[key] = entry
+        while len(cache) > self.validator_cache_size:
+            cache.popitem(last=False)
+
+        return entry[1]
+
+    def _create_validator(self, schema):
+        '''Return new validator for *schema*.'''
+        if self.resolver is not None:
+            return self.validator_class(
+                schema, resolver=jsonschema.RefResolver.from_schema(
+                    schema, handlers=self.resolver.ref_handlers()
+                )
+            )
+
+        return self.validator_class(schema)
+
+    def _validate(self, instance, schemas, max_errors=None):
         '''Validate *instance* against *schemas*.
 
         Each schema may be either a registered schema id or a schema object.
 
         Return any errors as a list of objects containing full diagnostic
-        information.
+        information. If *max_errors* is set then stop once that many errors
+        are found.
 
         '''
         errors = []
         for schema in schemas:
             if isinstance(schema, basestring):
+                key = schema
                 schema = self.schemas.get(schema)
+            else:
+                key = id(schema)
 
-            validator = self.validator_class(schema)
-            validator_errors = list(validator.iter_errors(instance))
+            limit = None
+            if max_errors is not None:
+                limit = max_errors - len(errors)
+
+            validator = self._validator(key, schema)
+            validator_errors = _errors(validator, instance, limit)
             for error in validator_errors:
                 error.schema = schema
 
             errors.extend(validator_errors)
+            if max_errors is not None and len(errors) >= max_errors:
+                break
 
         return errors
 
+
+#: State of worker process used by :py:meth:`Session.validate_many`.
+_worker = {}
+
+
+def _initialise_worker(session, additional_schemas, max_errors):
+    '''Set *session* and validation arguments to use in worker.'''
+    _worker['session'] = session
+    _worker['additional_schemas'] = additional_schemas
+    _worker['max_errors'] = max_errors
+
+
+def _validate_chunk(instances):
+    '''Return list of errors as plain data for each of *instances*.
+
+    Used to validate instances in worker processes.
+
+    '''
+    session = _worker['session']
+    additional_schemas = _worker['additional_schemas']
+    max_errors = _worker['max_errors']
+
+    results = []
+    for instance in instances:
+        errors = session.validate(instance, additional_schemas, max_errors)
+        results.append([
+            _dump_error(error, session.schemas, additional_schemas)
+            for error in errors
+        ])
+
+    return results
+
+
+def _check_max_errors(max_errors):
+    '''Raise ValueError if *max_errors* is set and not a positive number.'''
+    if max_errors is not None and max_errors < 1:
+        raise ValueError(
+            'max_errors must be at least 1 (or None for no limit), not {0!r}.'
+            .format(max_errors)
+        )
+
+
+def _errors(validator, instance, limit=None):
+    '''Return list of errors from *validator* for *instance*.
+
+    If *limit* is set then return at most that many errors, stopping
+    validation once reached. Validators providing an errors method, such as
+    :py:class:`~harmony.schema.compiler.CompiledValidator`, are stopped
+    through that method. Otherwise iteration over errors is stopped early.
+
+    '''
+    if limit is None:
+        return list(validator.iter_errors(instance))
+
+    errors_method = getattr(validator, 'errors', None)
+    if errors_method is not None:
+        return errors_method(instance, limit=limit)
+
+    return list(itertools.islice(validator.iter_errors(instance), limit))
+
+
+def _chunks(iterable, size):
+    '''Yield (chunk, flush) for consecutive entries from *iterable*.
+
+    chunk is a list of up to *size* entries and flush is True if the chunk
+    was ended early by a :py:data:`FLUSH` marker, in which case it may be
+    empty.
+
+    '''
+    chunk = []
+    for entry in iterable:
+        if entry is FLUSH:
+            yield chunk, True
+            chunk = []
+            continue
+
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk, False
+            chunk = []
+
+    if chunk:
+        yield chunk, False
+
+
+#: Attributes of validation errors transferred from worker processes.
+_ERROR_ATTRIBUTES = (
+    'message', 'validator', 'cause', 'validator_value', 'instance'
+)
+
+
+def _dump_error(error, schemas, additional_schemas):
+    '''Return validation *error* as plain data that can be pickled.
+
+    The schema of the error is referred to by id if registered in *schemas*
+    or by position if one of *additional_schemas*.
+
+    '''
+    data = {
+        'class': error.__class__,
+        'path': list(error.path),
+        'schema_path': list(error.schema_path),
+        'context': [
+            _dump_error(child, schemas, additional_schemas)
+            for child in error.context
+        ]
+    }
+
+    for attribute in _ERROR_ATTRIBUTES:
+        value = getattr(error, attribute)
+        if not isinstance(value, Unset):
+            data[attribute] = value
+
+    schema = error.schema
+    if isinstance(schema, Unset):
+        return data
+
+    for position, additional_schema in enumerate(additional_schemas or []):
+        if additional_schema is schema:
+            data['schema'] = ('additional', position)
+            return data
+
+    schema_id = None
+    if isinstance(schema, dict):
+        schema_id = schema.get('id')
+
+    if isinstance(schema_id, basestring):
+        try:
+            registered = schemas.get(schema_id)
+        except KeyError:
+            registered = None
+
+        if registered is schema:
+            data['schema'] = ('id', schema_id)
+            return data
+
+    data['schema'] = ('value', schema)
+    return data
+
+
+def _load_error(data, schemas, additional_schemas):
+    '''Return validation error from *data* returned by _dump_error.'''
+    arguments = dict(
+        (attribute, data[attribute])
+        for attribute in _ERROR_ATTRIBUTES if attribute in data
+    )
+
+    if 'schema' in data:
+        kind, value = data['schema']
+        if kind == 'additional':
+            value = additional_schemas[value]
+        elif kind == 'id':
+            value = schemas.get(value)
+
+        arguments['schema'] = value
+
+    return data['class'](
+        path=data['path'], schema_path=data['schema_path'],
+        context=[
+            _load_error(child, schemas, additional_schemas)
+            for child in data['context']
+        ],
+        **arguments
+    )
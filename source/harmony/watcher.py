@@ -0,0 +1,214 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import time
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class Watcher(object):
+    '''Watch schema paths of a session and refresh it on change.
+
+    Uses inotify (through pyinotify) to detect changes where available,
+    otherwise falls back to periodically polling the paths for changes in
+    modification time and size of schema files.
+
+    Refreshes are incremental and performed in a background thread. As a
+    session only replaces its collection once a refresh is complete, other
+    threads can continue to use the session whilst a refresh is in progress.
+
+    '''
+
+    def __init__(self, session, paths=None, interval=1.0, delay=0.5,
+                 callback=None):
+        '''Initialise watcher for *session*.
+
+        *paths* should be a list of directories to watch. Defaults to the
+        paths of the collectors of each session layer.
+
+        *interval* is the time in seconds between checks for changes when
+        polling. It also determines how promptly the watcher responds to being
+        stopped.
+
+        *delay* is the time in seconds to wait after the last detected change
+        before refreshing. This debounces bursts of changes, such as when
+        several files are saved together, into a single refresh.
+
+        *callback* will be called with the session and error (None on success)
+        after each refresh. If a refresh fails, such as due to an invalid
+        schema file, the session keeps its previous collection and the error
+        is also stored as self.error.
+
+        '''
+        super(Watcher, self).__init__()
+        self.session = session
+
+        self.paths = paths
+        if self.paths is None:
+            self.paths = []
+            for layer in session.layers:
+                self.paths.extend(getattr(layer.collector, 'paths', []))
+
+        self.interval = interval
+        self.delay = delay
+        self.callback = callback
+        self.error = None
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        '''Return whether watcher is running.'''
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        '''Start watching in a background thread.'''
+        if self.running:
+            return
+
+        # Begin monitoring before returning so that no change made after
+        # starting can be missed.
+        if pyinotify is not None:
+            wait, close = self._inotify()
+        else:
+            wait, close = self._poll()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(wait, close))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop watching and wait for background thread to finish.'''
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, wait, close):
+        '''Watch for changes until stopped using *wait* and *close*.'''
+        try:
+            last_change = None
+            while not self._stopped.is_set():
+                # Wait no longer than the remaining delay once a change is
+                # pending so that the refresh is not held up.
+                timeout = self.interval
+                if last_change is not None:
+                    timeout = max(
+                        0, min(timeout, last_change + self.delay - time.time())
+                    )
+
+                if wait(timeout):
+                    last_change = time.time()
+
+                if (
+                    last_change is not None
+                    and time.time() - last_change >= self.delay
+                ):
+                    last_change = None
+                    self._refresh()
+
+        finally:
+            close()
+
+    def _refresh(self):
+        '''Incrementally refresh session.'''
+        try:
+            self.session.refresh(incremental=True)
+        except Exception as error:
+            self.error = error
+        else:
+            self.error = None
+
+        if self.callback is not None:
+            self.callback(self.session, self.error)
+
+    def _inotify(self):
+        '''Return (wait, close) functions for inotify events.
+
+        *wait* accepts a timeout in seconds and returns True if any events
+        occurred within it. *close* releases the underlying resources.
+
+        '''
+        manager = pyinotify.WatchManager()
+        mask = (
+            pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MODIFY
+            | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_FROM
+            | pyinotify.IN_MOVED_TO
+        )
+
+        for path in self.paths:
+            manager.add_watch(path, mask, rec=True, auto_add=True)
+
+        changed = []
+
+        def on_event(event):
+            '''Record *event* as a change.'''
+            changed.append(event.pathname)
+
+        notifier = pyinotify.Notifier(manager, default_proc_fun=on_event)
+
+        def wait(timeout):
+            '''Wait up to *timeout* and return whether any events occurred.'''
+            if notifier.check_events(timeout=int(timeout * 1000)):
+                notifier.read_events()
+                notifier.process_events()
+
+            if changed:
+                del changed[:]
+                return True
+
+            return False
+
+        return wait, notifier.stop
+
+    def _poll(self):
+        '''Return (wait, close) functions for polling for changes.
+
+        *wait* accepts a timeout in seconds to sleep for and then returns True
+        if any schema file was added, removed or changed since the previous
+        call. *close* does nothing.
+
+        '''
+        state = {'snapshot': self._snapshot()}
+
+        def wait(timeout):
+            '''Sleep for *timeout* and return whether a change occurred.'''
+            self._stopped.wait(timeout)
+            snapshot = self._snapshot()
+            if snapshot != state['snapshot']:
+                state['snapshot'] = snapshot
+                return True
+
+            return False
+
+        def close():
+            '''Release resources.'''
+
+        return wait, close
+
+    def _snapshot(self):
+        '''Return mapping of schema file path to (modification time, size).'''
+        snapshot = {}
+        for path in self.paths:
+            for base, _, filenames in os.walk(path):
+                for filename in filenames:
+                    if not filename.endswith('.json'):
+                        continue
+
+                    filepath = os.path.join(base, filename)
+                    try:
+                        stat = os.stat(filepath)
+                    except OSError:
+                        continue
+
+                    snapshot[filepath] = (stat.st_mtime, stat.st_size)
+
+        return snapshot
@@ -0,0 +1,101 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import timeit
+
+import harmony.schema.decoder
+from harmony.schema.collector import FilesystemCollector
+
+
+#: Path to bundled schemas.
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'resource', 'schema'
+)
+
+
+def generate(path, count):
+    '''Generate synthetic tree of *count* schemas under *path*.
+
+    Schemas are copies of the bundled schemas with unique ids and enlarged
+    enumerations to resemble a large site catalog.
+
+    '''
+    templates = list(FilesystemCollector([SCHEMA_PATH]).collect())
+
+    for index in range(count):
+        schema = json.loads(json.dumps(templates[index % len(templates)]))
+        schema['id'] = '{0}/synthetic_{1}'.format(schema['id'], index)
+        schema.pop('$mixin', None)
+
+        properties = schema.setdefault('properties', {})
+        properties['label'] = {
+            'title': 'Label',
+            'type': 'string',
+            'enum': ['Label {0}'.format(entry) for entry in range(100)]
+        }
+
+        directory = os.path.join(path, 'group_{0}'.format(index // 100))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        filepath = os.path.join(directory, 'schema_{0}.json'.format(index))
+        with open(filepath, 'w') as file_handler:
+            json.dump(schema, file_handler, indent=4)
+
+
+def benchmark(path, repeat):
+    '''Print time taken by each decoder backend to collect schemas at *path*.
+
+    Each backend is timed over *repeat* runs and the best result reported.
+
+    '''
+    collector = FilesystemCollector([path])
+    count = len(collector.sources())
+
+    print('{0} ({1} schemas)'.format(path, count))
+    for name in harmony.schema.decoder.available():
+        harmony.schema.decoder.set_backend(name)
+        duration = min(
+            timeit.repeat(lambda: list(collector.collect()), number=1,
+                          repeat=repeat)
+        )
+        print('    {0:<12} {1:8.2f} ms'.format(name, duration * 1000))
+
+    harmony.schema.decoder.set_backend()
+
+
+def main(arguments=None):
+    '''Benchmark available JSON decoder backends.'''
+    if arguments is None:
+        arguments = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--count', type=int, default=5000,
+        help='Number of schemas to generate for the synthetic tree.'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of runs to take the best time from.'
+    )
+    namespace = parser.parse_args(arguments)
+
+    benchmark(SCHEMA_PATH, namespace.repeat)
+
+    synthetic_path = tempfile.mkdtemp()
+    try:
+        generate(synthetic_path, namespace.count)
+        benchmark(synthetic_path, namespace.repeat)
+    finally:
+        shutil.rmtree(synthetic_path)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
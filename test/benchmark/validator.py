@@ -0,0 +1,136 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import sys
+import copy
+import random
+import argparse
+import timeit
+
+from harmony.session import Session
+from harmony.schema.validator import Validator
+from harmony.schema.compiler import CompiledValidator
+
+
+#: Values to populate missing required properties with by type.
+VALUES = {
+    'string': 'value',
+    'integer': 1,
+    'number': 1.0,
+    'boolean': True,
+    'array': [],
+    'null': None
+}
+
+
+def populate(schema, data):
+    '''Fill required properties missing from *data* according to *schema*.'''
+    for name, subschema in schema.get('properties', {}).items():
+        value = data.get(name)
+        if value is not None and not isinstance(value, (dict, list)):
+            # Discard defaults that are not themselves valid.
+            if not Validator(subschema).is_valid(value):
+                value = None
+
+        if value is None and name in schema.get('required', []):
+            if 'enum' in subschema:
+                value = subschema['enum'][0]
+            elif subschema.get('format') == 'date-time':
+                value = '2013-01-01T00:00:00Z'
+            elif subschema.get('type') == 'object':
+                value = {}
+            else:
+                value = VALUES.get(subschema.get('type'))
+
+        if isinstance(value, dict):
+            populate(subschema, value)
+
+        elif isinstance(value, list):
+            items = subschema.get('items', {})
+            for index, item in enumerate(value):
+                if isinstance(items, dict):
+                    item_schema = items
+                elif index < len(items):
+                    item_schema = items[index]
+                else:
+                    item_schema = subschema.get('additionalItems', {})
+
+                if isinstance(item, dict) and isinstance(item_schema, dict):
+                    populate(item_schema, item)
+
+        if value is not None:
+            data[name] = value
+
+
+def generate(session, count):
+    '''Return list of *count* synthetic records for *session*.
+
+    Records are instances of the bundled types with a proportion made invalid
+    to resemble records read from an asset database.
+
+    '''
+    random.seed(0)
+    templates = []
+    for schema_id, schema in session.schemas.items():
+        if schema_id.startswith('harmony:/scope') or schema_id.startswith(
+            'harmony:/item'
+        ):
+            template = session.instantiate(schema)
+            populate(schema, template)
+            templates.append(template)
+
+    records = []
+    for index in range(count):
+        record = copy.deepcopy(templates[index % len(templates)])
+        if index % 10 == 0:
+            # Invalidate some records.
+            record[random.choice(record.keys())] = index
+
+        records.append(record)
+
+    return records
+
+
+def benchmark(records, repeat):
+    '''Print time taken by each validator class to validate *records*.
+
+    Each class is timed over *repeat* runs and the best result reported.
+
+    '''
+    print('{0} records'.format(len(records)))
+    for validator_class in (Validator, CompiledValidator):
+        session = Session(validator_class=validator_class)
+        duration = min(
+            timeit.repeat(
+                lambda: [session.validate(record) for record in records],
+                number=1, repeat=repeat
+            )
+        )
+        print('    {0:<18} {1:8.2f} ms {2:10.0f} records/s'.format(
+            validator_class.__name__, duration * 1000,
+            len(records) / duration
+        ))
+
+
+def main(arguments=None):
+    '''Benchmark validator classes.'''
+    if arguments is None:
+        arguments = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--count', type=int, default=10000,
+        help='Number of records to validate.'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of runs to take the best time from.'
+    )
+    namespace = parser.parse_args(arguments)
+
+    benchmark(generate(Session(), namespace.count), namespace.repeat)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import json
+
+import pytest
+
+from harmony import command
+from harmony.session import Session
+from harmony.error import BundleError
+from harmony.schema import bundle
+from harmony.schema.collector import FilesystemCollector, BundleCollector
+from harmony.schema.processor import (
+    MixinProcessor, ValidateProcessor, FreezeProcessor
+)
+
+
+@pytest.fixture(scope='module')
+def reference():
+    '''Return session collecting resource schemas directly.'''
+    return Session(
+        collector=FilesystemCollector([Session.DEFAULT_SCHEMA_PATH])
+    )
+
+
+@pytest.fixture()
+def bundle_path(tmpdir):
+    '''Return path to bundle of resource schemas.'''
+    path = str(tmpdir.join('schemas.bundle'))
+    bundle.build(
+        path, FilesystemCollector([Session.DEFAULT_SCHEMA_PATH]),
+        [ValidateProcessor(), MixinProcessor()]
+    )
+    return path
+
+
+def test_mapped_collection(bundle_path, reference):
+    '''Mapped collection holds the same schemas as collecting directly.'''
+    with bundle.MappedCollection(bundle_path) as schemas:
+        assert dict(schemas.items()) == dict(reference.schemas.items())
+
+
+def test_closed_mapped_collection(bundle_path):
+    '''Closed collection keeps decoded schemas only.'''
+    schemas = bundle.MappedCollection(bundle_path)
+    schemas.get('harmony:/user')
+    schemas.close()
+    schemas.close()
+
+    assert schemas.get('harmony:/user')['id'] == 'harmony:/user'
+    with pytest.raises(BundleError):
+        schemas.get('harmony:/base')
+
+
+def test_refresh_keeps_previous_collection_usable(bundle_path, reference):
+    '''Refreshing a session leaves collections held by readers usable.'''
+    session = Session(
+        collector=BundleCollector(bundle_path, mapped=True), processors=[]
+    )
+    previous = session.schemas
+    session.refresh()
+
+    assert session.schemas is not previous
+    assert dict(previous.items()) == dict(reference.schemas.items())
+
+
+def test_frozen_session_bundle(tmpdir, reference):
+    '''Bundle of frozen schemas reads back as the plain schemas.'''
+    frozen = Session(
+        collector=FilesystemCollector([Session.DEFAULT_SCHEMA_PATH]),
+        freeze=True
+    )
+    path = str(tmpdir.join('frozen.bundle'))
+    bundle.write(path, frozen.schemas)
+
+    session = Session(collector=BundleCollector(path), processors=[])
+    assert dict(session.schemas.items()) == dict(reference.schemas.items())
+
+
+def test_build_with_freeze_processor(tmpdir, reference):
+    '''Bundle can be built with schemas frozen by a processor.'''
+    path = str(tmpdir.join('frozen.bundle'))
+    bundle.build(
+        path, FilesystemCollector([Session.DEFAULT_SCHEMA_PATH]),
+        [ValidateProcessor(), MixinProcessor(), FreezeProcessor()]
+    )
+
+    with bundle.MappedCollection(path) as schemas:
+        assert dict(schemas.items()) == dict(reference.schemas.items())
+
+
+@pytest.fixture()
+def root(tmpdir):
+    '''Return directory of schemas.'''
+    root = tmpdir.mkdir('schemas')
+    root.join('a.json').write(json.dumps({'id': 'harmony:/a'}))
+    root.join('b.json').write(json.dumps(
+        {'id': 'harmony:/b', '$mixin': {'$ref': 'harmony:/a'}}
+    ))
+    return root
+
+
+def test_bundle_collector(bundle_path, reference):
+    '''Session using bundle holds the same schemas as collecting directly.'''
+    session = Session(collector=BundleCollector(bundle_path), processors=[])
+    assert dict(session.schemas.items()) == dict(reference.schemas.items())
+
+
+def test_invalid_bundle(tmpdir):
+    '''Reading a file that is not a bundle raises BundleError.'''
+    path = tmpdir.join('invalid.bundle')
+    path.write('not a bundle')
+
+    with pytest.raises(BundleError):
+        list(BundleCollector(str(path)).collect())
+
+    with pytest.raises(BundleError):
+        bundle.MappedCollection(str(path))
+
+
+def test_is_stale(tmpdir, root):
+    '''Bundle is stale once a source is changed, added or removed.'''
+    path = str(tmpdir.join('schemas.bundle'))
+    collector = FilesystemCollector([str(root)])
+    bundle.build(path, collector, [MixinProcessor()])
+    assert not BundleCollector(path).is_stale(collector)
+
+    root.join('a.json').write(json.dumps({'id': 'harmony:/a', 'x': 1}))
+    assert BundleCollector(path).is_stale(collector)
+
+    bundle.build(path, collector, [MixinProcessor()])
+    root.join('c.json').write(json.dumps({'id': 'harmony:/c'}))
+    assert BundleCollector(path).is_stale(collector)
+
+    bundle.build(path, collector, [MixinProcessor()])
+    root.join('c.json').remove()
+    assert BundleCollector(path).is_stale(collector)
+
+
+def test_bundle_command(tmpdir, root):
+    '''Bundle command builds bundles and checks whether they are stale.'''
+    path = str(tmpdir.join('schemas.bundle'))
+    arguments = ['bundle', path, '--path', str(root)]
+
+    assert command.main(arguments + ['--check']) == 1
+    assert command.main(arguments) == 0
+    assert command.main(arguments + ['--check']) == 0
+
+    root.join('a.json').write(json.dumps({'id': 'harmony:/a', 'x': 1}))
+    assert command.main(arguments + ['--check']) == 1
@@ -0,0 +1,143 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import json
+
+import pytest
+
+from harmony.session import Session
+from harmony.schema.cache import Cache
+from harmony.schema.collector import FilesystemCollector
+from harmony.schema.processor import MixinProcessor
+from harmony.instrumentation import Instrumentation
+
+
+@pytest.fixture()
+def root(tmpdir):
+    '''Return directory of schemas.'''
+    root = tmpdir.mkdir('schemas')
+    for name in ('a', 'b'):
+        root.join('{0}.json'.format(name)).write(
+            json.dumps({'id': 'harmony:/{0}'.format(name), 'title': name})
+        )
+
+    return root
+
+
+@pytest.fixture()
+def cache(tmpdir):
+    '''Return empty cache.'''
+    return Cache(str(tmpdir.join('cache')))
+
+
+def save(cache, root, context=''):
+    '''Save schemas collected from *root* to *cache*.'''
+    collector = FilesystemCollector([str(root)])
+    schemas = [schema for _, schema in collector.items()]
+    cache.save(collector, [MixinProcessor()], schemas, context)
+    return schemas
+
+
+def load(cache, root, context='', processors=None):
+    '''Return schemas loaded from *cache* for *root*.'''
+    if processors is None:
+        processors = [MixinProcessor()]
+
+    return cache.load(
+        FilesystemCollector([str(root)]), processors, context
+    )
+
+
+def set_modified(path, offset):
+    '''Change modification time of file at *path* by *offset* seconds.'''
+    modified = os.stat(str(path)).st_mtime + offset
+    os.utime(str(path), (modified, modified))
+
+
+def test_hit(cache, root):
+    '''Unchanged sources load the saved schemas.'''
+    schemas = save(cache, root)
+    assert load(cache, root) == schemas
+
+
+def test_miss_without_entry(cache, root):
+    '''Nothing saved loads as None.'''
+    assert load(cache, root) is None
+
+
+def test_miss_on_content_change(cache, root):
+    '''Changed content invalidates the entry.'''
+    save(cache, root)
+    root.join('a.json').write(json.dumps({'id': 'harmony:/a'}))
+    set_modified(root.join('a.json'), 10)
+
+    assert load(cache, root) is None
+
+
+def test_miss_on_same_size_content_change(cache, root):
+    '''Changed content of the same size is detected by its checksum.'''
+    save(cache, root)
+    root.join('a.json').write(
+        json.dumps({'id': 'harmony:/a', 'title': 'z'})
+    )
+    set_modified(root.join('a.json'), 10)
+
+    assert load(cache, root) is None
+
+
+def test_hit_after_touch(cache, root):
+    '''Changed modification time with unchanged content still hits.'''
+    schemas = save(cache, root)
+    set_modified(root.join('a.json'), 10)
+
+    assert load(cache, root) == schemas
+    assert load(cache, root) == schemas
+
+
+def test_miss_on_added_source(cache, root):
+    '''Adding a source invalidates the entry.'''
+    save(cache, root)
+    root.join('c.json').write(json.dumps({'id': 'harmony:/c'}))
+
+    assert load(cache, root) is None
+
+
+def test_miss_on_removed_source(cache, root):
+    '''Removing a source invalidates the entry.'''
+    root.join('c.json').write(json.dumps({'id': 'harmony:/c'}))
+    save(cache, root)
+    root.join('c.json').remove()
+
+    assert load(cache, root) is None
+
+
+def test_miss_on_configuration_change(cache, root):
+    '''Different context or processors do not share entries.'''
+    save(cache, root)
+
+    assert load(cache, root, context='other') is None
+    assert load(cache, root, processors=[]) is None
+
+
+def test_clear(cache, root):
+    '''Cleared cache holds no entries.'''
+    save(cache, root)
+    cache.clear()
+
+    assert load(cache, root) is None
+
+
+def test_session_loads_from_cache(cache, root):
+    '''Second session loads processed schemas from cache.'''
+    first = Session(collector=FilesystemCollector([str(root)]), cache=cache)
+    second = Session(
+        collector=FilesystemCollector([str(root)]), cache=cache,
+        instrumentation=Instrumentation()
+    )
+
+    names = [stage['name'] for stage in second.report['stages']]
+    assert 'cache.load' in names
+    assert 'collect' not in names
+    assert dict(second.schemas.items()) == dict(first.schemas.items())
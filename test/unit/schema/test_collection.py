@@ -0,0 +1,79 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import copy
+import time
+import threading
+
+from harmony.schema.collection import LazyCollection
+from harmony.schema.processor import MixinProcessor
+
+
+#: Unprocessed schemas by source.
+SOURCES = {
+    'a.json': {
+        'id': 'harmony:/a',
+        '$mixin': {'$ref': 'harmony:/b'},
+        'properties': {'a': {'type': 'string'}}
+    },
+    'b.json': {
+        'id': 'harmony:/b',
+        'properties': {'b': {'type': 'string'}}
+    }
+}
+
+
+def lazy_collection(loaded):
+    '''Return lazy collection of SOURCES recording sources *loaded*.'''
+    def loader(source):
+        '''Return copy of schema at *source*, slowly.'''
+        loaded.append(source)
+        time.sleep(0.05)
+        return copy.deepcopy(SOURCES[source])
+
+    return LazyCollection(
+        dict((schema['id'], source) for source, schema in SOURCES.items()),
+        loader, processors=[MixinProcessor()]
+    )
+
+
+def test_load_on_access():
+    '''Schemas and their dependencies are loaded on first access.'''
+    loaded = []
+    collection = lazy_collection(loaded)
+    assert loaded == []
+
+    schema = collection.get('harmony:/a')
+    assert sorted(schema['properties']) == ['a', 'b']
+    assert sorted(loaded) == ['a.json', 'b.json']
+
+    collection.get('harmony:/b')
+    assert sorted(loaded) == ['a.json', 'b.json']
+
+
+def test_concurrent_load():
+    '''Schemas retrieved concurrently are loaded once.'''
+    loaded = []
+    collection = lazy_collection(loaded)
+    results = []
+
+    def get(schema_id):
+        '''Retrieve schema with *schema_id*.'''
+        results.append(collection.get(schema_id))
+
+    threads = [
+        threading.Thread(target=get, args=(schema_id,))
+        for schema_id in ['harmony:/a', 'harmony:/b'] * 4
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(loaded) == ['a.json', 'b.json']
+    assert len(results) == len(threads)
+    assert len(set(id(schema) for schema in results)) == 2
+    assert sorted(
+        collection.get('harmony:/a')['properties']
+    ) == ['a', 'b']
@@ -0,0 +1,161 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import copy
+
+import pytest
+
+from harmony.session import Session
+from harmony.schema.validator import Validator
+from harmony.schema.compiler import CompiledValidator
+from harmony.schema.frozen import freeze
+
+
+#: Schemas exercising keywords not used by the resource schemas.
+KEYWORD_SCHEMAS = [
+    {
+        'type': 'object',
+        'properties': {
+            'a': {
+                'type': ['integer', 'null'], 'minimum': 3,
+                'exclusiveMinimum': True, 'maximum': 9
+            },
+            'b': {
+                'type': 'array',
+                'items': [
+                    {'type': 'string', 'pattern': '^x'},
+                    {'enum': [1, 'a', {'k': 1}]}
+                ],
+                'additionalItems': False, 'minItems': 1, 'maxItems': 3
+            },
+            'c': {
+                'type': 'array',
+                'items': {
+                    'type': 'string', 'format': 'date-time',
+                    'minLength': 2, 'maxLength': 4
+                }
+            },
+            'd': {'anyOf': [{'type': 'string'}, {'type': 'integer'}]},
+            'e': {
+                'type': 'array', 'items': [{'type': 'integer'}],
+                'additionalItems': {'type': 'string'}
+            },
+            'f': {'$ref': '#/definitions/x'},
+            'g': {
+                'type': 'number', 'maximum': 2, 'exclusiveMaximum': True,
+                'minimum': 0
+            }
+        },
+        'required': ['a', 'z'],
+        'additionalProperties': {'type': 'boolean'},
+        'definitions': {'x': {'type': 'string'}}
+    },
+    {
+        'type': 'object', 'additionalProperties': False,
+        'properties': {'q': {}}
+    },
+    {
+        'id': 'harmony:/test/outer',
+        'properties': {
+            'a': {
+                'id': 'harmony:/test/inner', 'type': 'object',
+                'required': ['b'],
+                'properties': {
+                    'b': {'anyOf': [{'type': 'string'}]},
+                    'c': {'type': 'integer'}
+                }
+            }
+        }
+    }
+]
+
+#: Values substituted for properties to produce invalid instances.
+VALUES = [
+    None, True, 0, 1, 2.5, 4, 10, -1, 'x', 'xa', 'abcdef',
+    '2013-01-01T00:00:00Z', 'bad', [], [1], ['x', 1], ['xa', 'a', 3],
+    ['y', {'k': 1}, 'z'], {}, {'a': 1}, {'b': {}}, {'k': 1}
+]
+
+
+@pytest.fixture(scope='module')
+def schemas():
+    '''Return resource and keyword schemas, plain and frozen.'''
+    session = Session()
+    schemas = [schema for _, schema in session.schemas.items()]
+    schemas.extend(KEYWORD_SCHEMAS)
+    return schemas + [freeze(schema) for schema in schemas]
+
+
+def instances(schema):
+    '''Yield instances to validate against *schema*.
+
+    Each property of *schema*, along with some it does not define, is set to
+    each of :py:data:`VALUES` in turn.
+
+    '''
+    yield None
+    yield []
+    yield {}
+
+    base = {}
+    if isinstance(schema.get('id'), basestring):
+        base['harmony_type'] = schema['id']
+    yield base
+
+    names = set(schema.get('properties', {}))
+    names.update(['harmony_type', 'name', 'unknown'])
+    for name in sorted(names):
+        for value in VALUES:
+            instance = copy.deepcopy(base)
+            instance[name] = copy.deepcopy(value)
+            yield instance
+
+
+def describe(error):
+    '''Return comparable description of validation *error*.'''
+    return (
+        list(error.path), list(error.schema_path), error.validator,
+        repr(error.validator_value), error.message, repr(error.instance),
+        id(error.schema), repr(error.cause), len(error.context)
+    )
+
+
+def test_errors_match_validator(schemas):
+    '''Compiled validator reports the same errors as the validator.'''
+    checked = 0
+    invalid = 0
+    for schema in schemas:
+        validator = Validator(schema)
+        compiled = CompiledValidator(schema)
+
+        for instance in instances(schema):
+            expected = [describe(error)
+                        for error in validator.iter_errors(instance)]
+            received = [describe(error)
+                        for error in compiled.iter_errors(instance)]
+
+            assert received == expected, (schema.get('id'), instance)
+            assert compiled.is_valid(instance) == (not expected)
+
+            checked += 1
+            if expected:
+                invalid += 1
+
+    # Guard against instances that never exercise any validation.
+    assert invalid > checked / 2
+
+
+def test_errors_respect_limit(schemas):
+    '''Compiled validator stops after limit with the first errors found.'''
+    for schema in schemas:
+        validator = Validator(schema)
+        compiled = CompiledValidator(schema)
+
+        for instance in instances(schema):
+            expected = [describe(error)
+                        for error in validator.iter_errors(instance)]
+            received = [describe(error)
+                        for error in compiled.errors(instance, limit=1)]
+
+            assert received == expected[:1], (schema.get('id'), instance)
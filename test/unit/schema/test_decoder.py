@@ -0,0 +1,73 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import json
+
+import pytest
+
+from harmony.session import Session
+from harmony.schema import decoder
+
+
+#: Documents exercising values not found in the resource schemas.
+DOCUMENTS = [
+    '{"a": "\\u00e9t\\u00e9", "b": [1, 2.5, -0.0, 1e-7, true, null]}',
+    '"caf\xc3\xa9"',
+    '12345678901234567890123',
+    '1.7976931348623157e308',
+    '0.30000000000000004',
+    '{"a": {"a": {}}, "b": []}'
+]
+
+
+def resource_documents():
+    '''Return content of each resource schema file.'''
+    documents = []
+    for base, _, filenames in os.walk(Session.DEFAULT_SCHEMA_PATH):
+        for filename in sorted(filenames):
+            if filename.endswith('.json'):
+                with open(os.path.join(base, filename), 'rb') as handler:
+                    documents.append(handler.read())
+
+    return documents
+
+
+def typed(value):
+    '''Return *value* with the type of every item made explicit.'''
+    if isinstance(value, dict):
+        return dict(
+            (typed(key), typed(item)) for key, item in value.items()
+        )
+
+    if isinstance(value, list):
+        return [typed(item) for item in value]
+
+    return (type(value), repr(value))
+
+
+@pytest.fixture(params=decoder.available())
+def backend(request):
+    '''Use each available backend in turn.'''
+    previous = decoder.get_backend()
+    decoder.set_backend(request.param)
+    request.addfinalizer(lambda: decoder.set_backend(previous))
+    return request.param
+
+
+def test_backend_matches_json(backend):
+    '''Backend decodes the same values and types as the json module.'''
+    for document in resource_documents() + DOCUMENTS:
+        assert typed(decoder.loads(document)) == typed(json.loads(document))
+
+
+def test_backend_error_matches_json(backend):
+    '''Backend raises the same error as the json module.'''
+    with pytest.raises(ValueError) as expected:
+        json.loads('{x')
+
+    with pytest.raises(ValueError) as received:
+        decoder.loads('{x')
+
+    assert str(received.value) == str(expected.value)
@@ -0,0 +1,208 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import json
+
+import pytest
+
+from harmony.session import Session
+from harmony.schema.cache import Cache
+from harmony.schema.collector import FilesystemCollector
+from harmony.instrumentation import Instrumentation
+
+
+def write(directory, name, schema):
+    '''Write *schema* to file *name* in *directory*, marking it modified.'''
+    path = os.path.join(str(directory), name)
+    modified = None
+    if os.path.exists(path):
+        modified = os.stat(path).st_mtime
+
+    with open(path, 'w') as file_handler:
+        json.dump(schema, file_handler)
+
+    if modified is not None:
+        # Guard against filesystems with coarse modification times.
+        os.utime(path, (modified + 10, modified + 10))
+
+
+@pytest.fixture()
+def paths(tmpdir):
+    '''Return (lower, upper) directories of schemas.'''
+    lower = tmpdir.mkdir('lower')
+    write(lower, 'base.json', {
+        'id': 'harmony:/test/base', 'type': 'object',
+        'properties': {'name': {'type': 'string'}}
+    })
+    write(lower, 'unused.json', {
+        'id': 'harmony:/test/unused', 'type': 'object'
+    })
+
+    upper = tmpdir.mkdir('upper')
+    write(upper, 'shot.json', {
+        'id': 'harmony:/test/shot',
+        '$mixin': {'$ref': 'harmony:/test/base'},
+        'properties': {'code': {'type': 'string'}}
+    })
+    write(upper, 'asset.json', {
+        'id': 'harmony:/test/asset',
+        'properties': {'kind': {'type': 'string'}}
+    })
+
+    return str(lower), str(upper)
+
+
+class CountingCollector(FilesystemCollector):
+    '''Collector recording the sources it lists and checksums.'''
+
+    def __init__(self, *args, **kwargs):
+        '''Initialise collector.'''
+        super(CountingCollector, self).__init__(*args, **kwargs)
+        self.checksummed = []
+        self.listed = 0
+
+    def sources(self):
+        '''Return list of sources, counting calls.'''
+        self.listed += 1
+        return super(CountingCollector, self).sources()
+
+    def checksum(self, source):
+        '''Return checksum of *source*, recording it.'''
+        self.checksummed.append(source)
+        return super(CountingCollector, self).checksum(source)
+
+
+def session(paths, collector_class=FilesystemCollector, **kwargs):
+    '''Return session with a layer for each of *paths*.'''
+    return Session(
+        collector=[collector_class([path]) for path in paths], **kwargs
+    )
+
+
+def state(session):
+    '''Return comparable state of schemas and sources in *session*.'''
+    return json.dumps(
+        dict(
+            (schema_id, [schema, session.schemas.source(schema_id)])
+            for schema_id, schema in session.schemas.items()
+        ),
+        sort_keys=True
+    )
+
+
+def edit(paths):
+    '''Change, add and remove schemas in both layers of *paths*.'''
+    lower, upper = paths
+    write(lower, 'base.json', {
+        'id': 'harmony:/test/base', 'type': 'object',
+        'properties': {'name': {'type': 'string', 'title': 'Name'}}
+    })
+    write(upper, 'sequence.json', {
+        'id': 'harmony:/test/sequence',
+        '$mixin': {'$ref': 'harmony:/test/base'}
+    })
+    os.remove(os.path.join(upper, 'asset.json'))
+
+
+def test_incremental_refresh_matches_fresh_session(paths):
+    '''Incremental refresh produces the same schemas as a fresh session.'''
+    current = session(paths)
+    edit(paths)
+    current.refresh(incremental=True)
+
+    assert state(current) == state(session(paths))
+    assert (
+        current.schemas.get('harmony:/test/shot')['properties']['name']
+        == {'type': 'string', 'title': 'Name'}
+    )
+
+
+def test_incremental_refresh_after_cached_start(paths, tmpdir):
+    '''Incremental refresh after loading from cache only loads changes.'''
+    cache = Cache(str(tmpdir.join('cache')))
+    session(paths, cache=cache)
+
+    instrumentation = Instrumentation()
+    current = session(paths, cache=cache, instrumentation=instrumentation)
+    assert 'collect' not in [
+        stage['name'] for stage in current.report['stages']
+    ]
+
+    _, upper = paths
+    write(upper, 'shot.json', {
+        'id': 'harmony:/test/shot',
+        '$mixin': {'$ref': 'harmony:/test/base'},
+        'title': 'Edited'
+    })
+    current.refresh(incremental=True)
+
+    collected = [
+        stage['schemas'] for stage in current.report['stages']
+        if stage['name'] == 'collect'
+    ]
+    assert collected == [0, 1]
+    assert state(current) == state(session(paths))
+
+
+def test_unchanged_incremental_refresh(paths):
+    '''Incremental refresh without changes keeps schemas.'''
+    current = session(paths)
+    expected = state(current)
+    current.refresh(incremental=True)
+
+    assert state(current) == expected
+
+
+def test_cached_incremental_refresh_only_hashes_changes(paths, tmpdir):
+    '''Saving to cache after incremental refresh only hashes changes.'''
+    cache = Cache(str(tmpdir.join('cache')))
+    current = session(paths, CountingCollector, cache=cache)
+    collectors = [layer.collector for layer in current.layers]
+    for collector in collectors:
+        del collector.checksummed[:]
+
+    _, upper = paths
+    write(upper, 'shot.json', {
+        'id': 'harmony:/test/shot',
+        '$mixin': {'$ref': 'harmony:/test/base'},
+        'title': 'Edited'
+    })
+    current.refresh(incremental=True)
+
+    assert [collector.checksummed for collector in collectors] == [
+        [], [os.path.join(upper, 'shot.json')]
+    ]
+    assert state(current) == state(session(paths))
+
+
+def test_incremental_refresh_lists_each_layer_once(paths, tmpdir):
+    '''Incremental refresh lists the sources of each layer once.'''
+    lower, upper = paths
+    middle = str(tmpdir.mkdir('middle'))
+    write(middle, 'scene.json', {
+        'id': 'harmony:/test/scene',
+        '$mixin': {'$ref': 'harmony:/test/base'}
+    })
+
+    cache = Cache(str(tmpdir.join('cache')))
+    current = session(
+        [lower, middle, upper], CountingCollector, cache=cache
+    )
+    collectors = [layer.collector for layer in current.layers]
+
+    for edit_path in (None, os.path.join(lower, 'base.json')):
+        if edit_path is not None:
+            write(lower, 'base.json', {
+                'id': 'harmony:/test/base', 'type': 'object',
+                'title': 'Edited'
+            })
+
+        for collector in collectors:
+            collector.listed = 0
+
+        current.refresh(incremental=True)
+        assert [collector.listed for collector in collectors] == [1, 1, 1]
+
+    assert state(current) == state(session([lower, middle, upper]))
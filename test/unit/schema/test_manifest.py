@@ -0,0 +1,178 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import os
+import json
+import shutil
+import hashlib
+
+import pytest
+
+from harmony import command
+from harmony.error import ManifestError
+from harmony.schema import manifest, collector as collector_module
+from harmony.schema.collector import FilesystemCollector
+
+
+@pytest.fixture()
+def root(tmpdir):
+    '''Return directory of schemas with a manifest.'''
+    root = tmpdir.mkdir('schemas')
+    root.join('a.json').write(json.dumps({'id': 'harmony:/a'}))
+    root.mkdir('sub').join('b.json').write(json.dumps({'id': 'harmony:/b'}))
+    manifest.write(str(root))
+    return root
+
+
+def age(path, seconds=10):
+    '''Make modification time of *path* *seconds* earlier.'''
+    modified = os.stat(str(path)).st_mtime - seconds
+    os.utime(str(path), (modified, modified))
+
+
+def add_file(root, directory=''):
+    '''Add schema file to *directory* of *root* after manifest was written.'''
+    age(manifest.path(str(root)))
+    root.join(directory, 'c.json').write(json.dumps({'id': 'harmony:/c'}))
+
+
+def test_generate(root):
+    '''Entries record path, id, size and hash of each schema file.'''
+    content = root.join('a.json').read('rb')
+    assert manifest.generate(str(root)) == [
+        {
+            'path': 'a.json', 'id': 'harmony:/a', 'size': len(content),
+            'hash': hashlib.sha1(content).hexdigest()
+        },
+        {
+            'path': 'sub/b.json', 'id': 'harmony:/b',
+            'size': len(root.join('sub', 'b.json').read('rb')),
+            'hash': hashlib.sha1(root.join('sub', 'b.json').read('rb'))
+            .hexdigest()
+        }
+    ]
+
+
+def test_read(root):
+    '''Written manifest reads back and is up to date.'''
+    assert manifest.read(str(root)) == manifest.generate(str(root))
+    assert not manifest.is_stale(str(root))
+
+
+def test_missing(tmpdir):
+    '''Directory without a manifest reads as None and is stale.'''
+    assert manifest.read(str(tmpdir)) is None
+    assert manifest.is_stale(str(tmpdir))
+
+
+@pytest.mark.parametrize('directory', ['', 'sub'], ids=['root', 'nested'])
+def test_ignored_once_directory_modified(root, directory):
+    '''Manifest is ignored once a directory is newer than it.'''
+    add_file(root, directory)
+
+    assert manifest.read(str(root)) is None
+    assert manifest.is_stale(str(root))
+
+    schema_collector = FilesystemCollector([str(root)])
+    assert sorted(schema_collector.index()) == [
+        'harmony:/a', 'harmony:/b', 'harmony:/c'
+    ]
+
+
+def test_ignored_once_directory_removed(root):
+    '''Manifest is ignored once a listed directory is removed.'''
+    age(manifest.path(str(root)))
+    shutil.rmtree(str(root.join('sub')))
+    os.utime(manifest.path(str(root)), None)
+
+    assert manifest.read(str(root)) is None
+
+
+@pytest.mark.parametrize(('content', 'message'), [
+    ('{"title": "a"}', 'has no id'),
+    ('[]', 'has no id'),
+    ('{invalid', 'Could not decode')
+], ids=['missing id', 'not object', 'invalid'])
+def test_invalid_schema_file(root, content, message):
+    '''Schema files that cannot be listed raise ManifestError.'''
+    root.join('bad.json').write(content)
+
+    with pytest.raises(ManifestError) as error:
+        manifest.generate(str(root))
+
+    assert message in str(error.value)
+    assert str(root.join('bad.json')) in str(error.value)
+
+
+def test_manifest_command(root):
+    '''Manifest command writes manifests and checks whether stale.'''
+    arguments = ['manifest', '--path', str(root)]
+    assert command.main(arguments + ['--check']) == 0
+
+    add_file(root)
+    assert command.main(arguments + ['--check']) == 1
+    assert command.main(arguments) == 0
+    assert command.main(arguments + ['--check']) == 0
+
+    root.join('bad.json').write('{}')
+    assert command.main(arguments) == 1
+
+
+@pytest.fixture()
+def hashed(monkeypatch):
+    '''Record paths of files read to compute a checksum.'''
+    paths = []
+    checksum = collector_module._checksum
+
+    def record(source):
+        '''Record *source* and return its checksum.'''
+        paths.append(source)
+        return checksum(source)
+
+    monkeypatch.setattr(collector_module, '_checksum', record)
+    return paths
+
+
+def test_checksum_uses_manifest(root, hashed):
+    '''Recorded checksums are used for unchanged files.'''
+    schema_collector = FilesystemCollector([str(root)])
+    path = str(root.join('a.json'))
+    schema_collector.sources()
+
+    assert schema_collector.checksum(path) == manifest.read(
+        str(root)
+    )[0]['hash']
+    assert hashed == []
+
+
+def test_checksum_checks_size(root, hashed):
+    '''Files with a different size are hashed even if not modified.'''
+    schema_collector = FilesystemCollector([str(root)])
+    path = root.join('a.json')
+    schema_collector.sources()
+
+    path.write(json.dumps({'id': 'harmony:/a', 'title': 'Changed'}))
+    age(path, 100)
+
+    assert schema_collector.checksum(str(path)) == hashlib.sha1(
+        path.read('rb')
+    ).hexdigest()
+    assert hashed == [str(path)]
+
+
+def test_checksums_discarded_with_manifest(root, hashed):
+    '''Recorded checksums are not used once the manifest is ignored.'''
+    schema_collector = FilesystemCollector([str(root)])
+    path = root.join('a.json')
+    schema_collector.sources()
+
+    path.write(json.dumps({'id': 'harmony:/z'}))
+    age(path, 100)
+    add_file(root)
+    schema_collector.sources()
+
+    assert schema_collector.checksum(str(path)) == hashlib.sha1(
+        path.read('rb')
+    ).hexdigest()
+    assert hashed == [str(path)]
@@ -0,0 +1,302 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import pytest
+
+from harmony.error import MixinCycleError
+from harmony.schema.collection import Collection
+from harmony.schema.dependency import sort
+from harmony.schema.processor import (
+    MixinProcessor, _additions, _INDEX_THRESHOLD
+)
+
+
+def mixin(schema_id, **hints):
+    '''Return mixin entry referencing *schema_id* with *hints*.'''
+    entry = {'$ref': schema_id}
+    if hints:
+        entry['hints'] = hints
+
+    return entry
+
+
+def process(schemas, processor=None):
+    '''Return collection of *schemas* processed by *processor*.'''
+    if processor is None:
+        processor = MixinProcessor()
+
+    collection = Collection(schemas)
+    processor.process(collection)
+    return collection
+
+
+def test_mixins_expanded_in_dependency_order():
+    '''Mixins of mixins are expanded before being merged.'''
+    schemas = process([
+        {
+            'id': 'harmony:/a',
+            '$mixin': mixin('harmony:/b'),
+            'properties': {'a': {'type': 'string'}}
+        },
+        {
+            'id': 'harmony:/b',
+            '$mixin': mixin('harmony:/c'),
+            'properties': {'b': {'type': 'string'}}
+        },
+        {
+            'id': 'harmony:/c',
+            'properties': {'c': {'type': 'string'}}
+        }
+    ])
+
+    assert sorted(schemas.get('harmony:/a')['properties']) == ['a', 'b', 'c']
+    assert sorted(schemas.get('harmony:/b')['properties']) == ['b', 'c']
+    assert '$mixin' not in schemas.get('harmony:/a')
+
+
+def test_sort_orders_dependencies_first():
+    '''Dependencies come first, otherwise ordered by id.'''
+    assert sort({
+        'a': set(['c']),
+        'b': set(),
+        'c': set(['b', 'external']),
+        'd': set()
+    }) == ['b', 'c', 'a', 'd']
+
+
+@pytest.mark.parametrize(('dependencies', 'chain'), [
+    ({'a': set(['a'])}, ['a', 'a']),
+    ({'a': set(['b']), 'b': set(['a'])}, ['a', 'b', 'a']),
+    (
+        {'a': set(['b']), 'b': set(['c']), 'c': set(['b']), 'd': set()},
+        ['b', 'c', 'b']
+    )
+], ids=['self', 'pair', 'nested'])
+def test_sort_reports_cycle(dependencies, chain):
+    '''Cycles raise MixinCycleError with the full chain.'''
+    with pytest.raises(MixinCycleError) as error:
+        sort(dependencies)
+
+    assert error.value.chain == chain
+
+
+def test_mixin_cycle_raises():
+    '''Schemas mixing each other in raise MixinCycleError.'''
+    with pytest.raises(MixinCycleError):
+        process([
+            {'id': 'harmony:/a', '$mixin': mixin('harmony:/b')},
+            {'id': 'harmony:/b', '$mixin': mixin('harmony:/a')}
+        ])
+
+
+def sharing_schemas():
+    '''Return schemas mixing in a common schema in different ways.'''
+    return [
+        {
+            'id': 'harmony:/base',
+            'properties': {
+                'name': {'type': 'string', 'enum': ['a', 'b']},
+                'meta': {'type': 'object', 'properties': {'x': {}}}
+            }
+        },
+        {
+            'id': 'harmony:/extends',
+            '$mixin': mixin('harmony:/base'),
+            'properties': {
+                'name': {'enum': ['c'], 'title': 'Name'}
+            }
+        },
+        {
+            'id': 'harmony:/nested',
+            '$mixin': mixin('harmony:/extends'),
+            'properties': {
+                'meta': {'properties': {'y': {}}}
+            }
+        },
+        {
+            'id': 'harmony:/plain',
+            '$mixin': mixin('harmony:/base')
+        }
+    ]
+
+
+def test_share_matches_copying():
+    '''Sharing produces the same schemas as copying.'''
+    copied = process(sharing_schemas())
+    shared = process(sharing_schemas(), MixinProcessor(share=True))
+
+    assert dict(shared.items()) == dict(copied.items())
+
+
+def test_share_does_not_modify_mixins():
+    '''Sharing never modifies the schemas mixed in.'''
+    shared = process(sharing_schemas(), MixinProcessor(share=True))
+
+    assert shared.get('harmony:/base') == sharing_schemas()[0]
+    assert shared.get('harmony:/extends')['properties']['meta'] == {
+        'type': 'object', 'properties': {'x': {}}
+    }
+    assert shared.get('harmony:/extends')['properties']['name'] == {
+        'type': 'string', 'enum': ['c', 'a', 'b'], 'title': 'Name'
+    }
+
+
+def test_share_reuses_unchanged_values():
+    '''Values not changed by a merge are shared rather than copied.'''
+    shared = process(sharing_schemas(), MixinProcessor(share=True))
+    base = shared.get('harmony:/base')
+
+    assert shared.get('harmony:/plain')['properties'] is base['properties']
+    assert (
+        shared.get('harmony:/extends')['properties']['meta']
+        is base['properties']['meta']
+    )
+    assert (
+        shared.get('harmony:/nested')['properties']['meta']
+        is not base['properties']['meta']
+    )
+
+
+def test_copying_does_not_share_values():
+    '''Without sharing, merged values are independent copies.'''
+    copied = process(sharing_schemas())
+    base = copied.get('harmony:/base')
+
+    assert copied.get('harmony:/plain')['properties'] is not (
+        base['properties']
+    )
+
+
+def expected_additions(target, reference):
+    '''Return entries of *reference* to add to *target* by scanning.'''
+    additions = []
+    for entry in reference:
+        if entry not in target and entry not in additions:
+            additions.append(entry)
+
+    return additions
+
+
+#: Array entries including values equal across types and nested values.
+ENTRIES = [
+    1, 1.0, True, 2, 'a', u'a', None, False, 0, [], [1], [1, 2], [2, 1], {},
+    {'a': 1}, {'a': 1.0}, {'a': [1, {'b': 2}]}, {'b': 1}
+]
+
+
+@pytest.mark.parametrize('size', [2, 40], ids=['small', 'large'])
+def test_additions_match_scanning(size):
+    '''Array additions are the same whether indexed or scanned.'''
+    for offset in range(len(ENTRIES)):
+        target = [ENTRIES[(offset + index) % len(ENTRIES)]
+                  for index in range(size)]
+        reference = [ENTRIES[(offset * 7 + index * 3) % len(ENTRIES)]
+                     for index in range(size)]
+        reference.extend(reference[:3])
+
+        assert _additions(target, reference) == (
+            expected_additions(target, reference)
+        )
+
+
+def test_additions_with_unhashable_entries():
+    '''Entries that cannot be hashed are compared by scanning.'''
+    target = range(_INDEX_THRESHOLD) + [bytearray('x')]
+    reference = [bytearray('x'), bytearray('y'), 3, 'new', bytearray('y')]
+
+    assert _additions(target, reference) == [bytearray('y'), 'new']
+    assert _additions(reference, target) == (
+        expected_additions(reference, target)
+    )
+
+
+@pytest.mark.parametrize('size', [3, 100], ids=['small', 'large'])
+def test_merge_combines_arrays(size):
+    '''Arrays are combined without duplicates keeping order.'''
+    schemas = process([
+        {
+            'id': 'harmony:/base',
+            'enum': range(size) + [{'a': 1}]
+        },
+        {
+            'id': 'harmony:/extends',
+            '$mixin': mixin('harmony:/base'),
+            'enum': [size + 1, {'a': 1}, 1]
+        }
+    ])
+
+    assert schemas.get('harmony:/extends')['enum'] == (
+        [size + 1, {'a': 1}, 1, 0] + range(2, size)
+    )
+
+
+def test_hints():
+    '''Hints preserve or overwrite values at their path only.'''
+    processor = MixinProcessor()
+    schemas = process([
+        {
+            'id': 'harmony:/base',
+            'enum': ['a'],
+            'properties': {
+                'kept': {'enum': ['x', 'y'], 'title': 'Base'},
+                'replaced': {'enum': ['x', 'y'], 'title': 'Base'},
+                'a/b': {'enum': [2]},
+                'c~d': {'enum': [3]},
+                'combined': {'enum': [4]}
+            }
+        },
+        {
+            'id': 'harmony:/extends',
+            '$mixin': mixin(
+                'harmony:/base', **{
+                    '/properties/kept/enum': 'preserve',
+                    '/properties/replaced': 'overwrite',
+                    '/properties/a~1b/enum': 'preserve',
+                    '/properties/c~0d/enum': 'preserve',
+                    '/properties/missing': 'preserve'
+                }
+            ),
+            'enum': ['b'],
+            'properties': {
+                'kept': {'enum': ['z']},
+                'replaced': {'enum': ['z'], 'type': 'string'},
+                'a/b': {'enum': [1]},
+                'c~d': {'enum': [1]},
+                'combined': {'enum': [1]}
+            }
+        }
+    ], processor)
+
+    extends = schemas.get('harmony:/extends')
+    assert extends['enum'] == ['b', 'a']
+    assert extends['properties'] == {
+        'kept': {'enum': ['z'], 'title': 'Base'},
+        'replaced': {'enum': ['x', 'y'], 'title': 'Base'},
+        'a/b': {'enum': [1]},
+        'c~d': {'enum': [1]},
+        'combined': {'enum': [1, 4]}
+    }
+    assert processor.unmatched_hints == [
+        ('harmony:/extends', 'harmony:/base', '/properties/missing')
+    ]
+
+
+def test_hints_apply_per_mixin():
+    '''Hints only apply to the mixin they are given for.'''
+    processor = MixinProcessor()
+    schemas = process([
+        {'id': 'harmony:/first', 'enum': [1]},
+        {'id': 'harmony:/second', 'enum': [2]},
+        {
+            'id': 'harmony:/extends',
+            '$mixin': [
+                mixin('harmony:/first', **{'/enum': 'preserve'}),
+                mixin('harmony:/second')
+            ],
+            'enum': [0]
+        }
+    ], processor)
+
+    assert schemas.get('harmony:/extends')['enum'] == [0, 2]
+    assert processor.unmatched_hints == []
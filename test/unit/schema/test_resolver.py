@@ -0,0 +1,250 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import json
+import threading
+import urllib
+import BaseHTTPServer
+
+import pytest
+
+from harmony.error import ResolutionError
+from harmony.schema.resolver import Resolver
+
+
+#: Document used in tests.
+DOCUMENT = {'definitions': {'name': {'type': 'string'}, 'a/b': {}}}
+
+
+@pytest.fixture()
+def document_uri(tmpdir):
+    '''Return file uri of document.'''
+    path = tmpdir.join('document.json')
+    path.write(json.dumps(DOCUMENT))
+    return 'file://' + urllib.pathname2url(str(path))
+
+
+class CountingHandler(object):
+    '''Scheme handler recording the uris fetched.'''
+
+    def __init__(self, release=None):
+        '''Initialise handler, blocking each fetch until *release* is set.'''
+        self.fetched = []
+        self.started = threading.Event()
+        self.release = release
+
+    def __call__(self, uri):
+        '''Return document content for *uri*.'''
+        self.fetched.append(uri)
+        self.started.set()
+        if self.release is not None:
+            self.release.wait()
+
+        return json.dumps({'uri': uri})
+
+
+def test_resolve(document_uri):
+    '''Resolve whole documents and fragments of them.'''
+    resolver = Resolver()
+
+    assert resolver.resolve(document_uri) == DOCUMENT
+    assert resolver.resolve(document_uri + '#/definitions/name') == {
+        'type': 'string'
+    }
+    assert resolver.resolve(document_uri + '#/definitions/a~1b') == {}
+
+
+@pytest.mark.parametrize('reference', [
+    'missing:///document.json',
+    'file:///missing/document.json',
+    '{document_uri}#/definitions/missing'
+], ids=['scheme', 'file', 'fragment'])
+def test_resolve_failure(document_uri, reference):
+    '''References that cannot be resolved raise ResolutionError.'''
+    with pytest.raises(ResolutionError):
+        Resolver().resolve(reference.format(document_uri=document_uri))
+
+
+def test_documents_cached():
+    '''Documents are fetched once and least recently used discarded.'''
+    resolver = Resolver(size=2)
+    handler = CountingHandler()
+    resolver.handlers['test'] = handler
+
+    for name in ('a', 'b', 'a', 'c', 'a', 'b'):
+        assert resolver.document('test://' + name) == {
+            'uri': 'test://' + name
+        }
+
+    assert handler.fetched == [
+        'test://a', 'test://b', 'test://c', 'test://b'
+    ]
+
+
+def test_fetch_does_not_block_other_documents(document_uri):
+    '''A slow fetch does not block resolving other documents.'''
+    release = threading.Event()
+    handler = CountingHandler(release)
+    resolver = Resolver()
+    resolver.handlers['slow'] = handler
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(resolver.document('slow://a'))
+        )
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+
+    other = []
+    other_thread = threading.Thread(
+        target=lambda: other.append(resolver.resolve(document_uri))
+    )
+
+    try:
+        assert handler.started.wait(5)
+        other_thread.start()
+        other_thread.join(5)
+        assert other == [DOCUMENT]
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+    other_thread.join(5)
+    assert results == [{'uri': 'slow://a'}] * 3
+    assert handler.fetched == ['slow://a']
+
+
+def test_failed_fetch_raised_to_waiting_threads():
+    '''Threads waiting on a failing fetch raise its error.'''
+    release = threading.Event()
+    resolver = Resolver()
+
+    def fail(uri):
+        '''Raise ResolutionError once released.'''
+        release.wait()
+        raise ResolutionError('Failed to fetch {0}'.format(uri))
+
+    resolver.handlers['fail'] = fail
+
+    errors = []
+
+    def fetch():
+        '''Fetch failing document, recording error.'''
+        try:
+            resolver.document('fail://a')
+        except ResolutionError as error:
+            errors.append(str(error))
+
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == ['Failed to fetch fail://a'] * 3
+
+    # Failures are not cached.
+    resolver.handlers['fail'] = CountingHandler()
+    assert resolver.document('fail://a') == {'uri': 'fail://a'}
+
+
+class DocumentRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serve DOCUMENT with an etag, recording requests on the server.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        '''Respond to GET request.'''
+        self.server.requests.append(
+            (self.path, self.headers.get('If-None-Match'))
+        )
+
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/document.json')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == '"1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        content = json.dumps(DOCUMENT)
+        self.send_response(200)
+        self.send_header('ETag', '"1"')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        '''Do not log requests.'''
+
+
+@pytest.fixture()
+def server(request):
+    '''Return base url of local server for DOCUMENT.'''
+    server = BaseHTTPServer.HTTPServer(
+        ('127.0.0.1', 0), DocumentRequestHandler
+    )
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def stop():
+        '''Stop server.'''
+        server.shutdown()
+        server.server_close()
+
+    request.addfinalizer(stop)
+    return server
+
+
+def base_url(server):
+    '''Return base url of *server*.'''
+    return 'http://127.0.0.1:{0}'.format(server.server_address[1])
+
+
+def test_http(server):
+    '''Documents are fetched over http following redirects.'''
+    resolver = Resolver()
+    try:
+        assert resolver.resolve(
+            base_url(server) + '/redirect#/definitions/name'
+        ) == {'type': 'string'}
+    finally:
+        resolver.close()
+
+    assert server.requests == [
+        ('/redirect', None), ('/document.json', None)
+    ]
+
+
+def test_http_cache(server, tmpdir):
+    '''Stored documents are revalidated or used whilst young enough.'''
+    cache_path = str(tmpdir.join('cache'))
+    uri = base_url(server) + '/document.json'
+
+    for resolver in (
+        Resolver(cache_path=cache_path),
+        Resolver(cache_path=cache_path),
+        Resolver(cache_path=cache_path, max_age=60)
+    ):
+        try:
+            assert resolver.document(uri) == DOCUMENT
+        finally:
+            resolver.close()
+
+    assert server.requests == [
+        ('/document.json', None), ('/document.json', '"1"')
+    ]
@@ -0,0 +1,98 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import json
+
+import pytest
+
+from harmony import command
+from harmony.session import Session
+
+
+#: Valid user record.
+USER = {
+    'harmony_type': 'harmony:/user',
+    'username': 'martin', 'firstname': 'Martin', 'lastname': 'Pengelly'
+}
+
+
+def validate(tmpdir, lines, *arguments):
+    '''Return (status, results) of validate command for input *lines*.'''
+    input_path = tmpdir.join('input.jsonl')
+    input_path.write('\n'.join(lines) + '\n')
+    output_path = tmpdir.join('output.jsonl')
+
+    status = command.main(
+        ['validate', '--path', Session.DEFAULT_SCHEMA_PATH,
+         '--output', str(output_path), str(input_path)]
+        + list(arguments)
+    )
+
+    results = [json.loads(line) for line in output_path.readlines()]
+    return status, results
+
+
+def mixed_lines():
+    '''Return lines mixing valid, invalid and unvalidatable records.'''
+    invalid = dict(USER, username=1)
+    lines = []
+    for index in range(250):
+        lines.append(json.dumps(USER))
+        lines.append('{not json')
+        lines.append(json.dumps(invalid))
+        lines.append(json.dumps({'harmony_type': 'harmony:/unknown'}))
+        if index % 10 == 0:
+            lines.extend(['[]'] * 5)
+
+    return lines
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_validate_mixed_records(tmpdir, workers):
+    '''Results for mixed records are written in input order.'''
+    lines = mixed_lines()
+    status, results = validate(tmpdir, lines, '--workers', workers)
+
+    assert status == 1
+    assert len(results) == len(lines)
+    assert [result['line'] for result in results] == range(1, len(lines) + 1)
+
+    for line, result in zip(lines, results):
+        assert result['valid'] == (line == json.dumps(USER))
+        if line == '{not json':
+            assert result['errors'][0]['message'].startswith('Invalid JSON')
+        elif line == '[]':
+            assert result['errors'][0]['message'] == (
+                'Record is not a JSON object'
+            )
+        elif 'unknown' in line:
+            assert result['errors'][0]['message'] == (
+                "Unknown harmony_type u'harmony:/unknown'"
+            )
+        elif not result['valid']:
+            assert result['errors'][0]['path'] == ['username']
+
+
+def test_validate_holds_limited_problems(tmpdir, monkeypatch):
+    '''Unvalidatable records held behind validation are bounded.'''
+    monkeypatch.setattr(command, 'PENDING_LIMIT', 3)
+
+    lines = [json.dumps(USER)] + ['{not json'] * 20 + [json.dumps(USER)]
+    status, results = validate(tmpdir, lines, '--workers', '2')
+
+    assert status == 1
+    assert [result['line'] for result in results] == range(1, len(lines) + 1)
+    assert [result['valid'] for result in results] == (
+        [True] + [False] * 20 + [True]
+    )
+
+
+def test_validate_valid_records(tmpdir):
+    '''Exit status is 0 when all records are valid.'''
+    status, results = validate(
+        tmpdir, [json.dumps(USER)] * 3, '--workers', '2'
+    )
+
+    assert status == 0
+    assert [result['valid'] for result in results] == [True] * 3
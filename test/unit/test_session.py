@@ -0,0 +1,261 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2013 Martin Pengelly-Phillips
+# :license: See LICENSE.txt.
+
+import copy
+import threading
+
+import pytest
+
+from harmony import command
+from harmony.session import Session, FLUSH
+from harmony.schema.validator import Validator
+
+
+class CountingValidator(Validator):
+    '''Validator recording the schemas of each instance created.'''
+
+    created = []
+
+    def __init__(self, schema, *args, **kwargs):
+        '''Initialise validator for *schema*.'''
+        CountingValidator.created.append(schema.get('id'))
+        super(CountingValidator, self).__init__(schema, *args, **kwargs)
+
+
+#: Valid user record.
+USER = {
+    'harmony_type': 'harmony:/user',
+    'username': 'martin', 'firstname': 'Martin', 'lastname': 'Pengelly'
+}
+
+#: User record with several errors.
+INVALID_USER = {
+    'harmony_type': 'harmony:/user',
+    'username': 1, 'firstname': 2, 'lastname': 3, 'email': 4
+}
+
+
+@pytest.fixture(scope='module')
+def session():
+    '''Return session using resource schemas.'''
+    return Session()
+
+
+def instances():
+    '''Return mix of valid and invalid instances.'''
+    result = []
+    for index in range(250):
+        result.append(dict(USER, username='user{0}'.format(index)))
+        result.append(dict(INVALID_USER, username=index))
+        result.append(dict(USER, harmony_type='invalid'))
+        result.append({'firstname': 'Missing'})
+
+    return result
+
+
+def describe(error):
+    '''Return comparable description of validation *error*.'''
+    return (
+        error.message, list(error.path), list(error.schema_path),
+        error.validator, error.validator_value, error.instance,
+        error.schema.get('id')
+    )
+
+
+@pytest.fixture()
+def counting_session():
+    '''Return session counting validators created.'''
+    session = Session(validator_class=CountingValidator)
+    del CountingValidator.created[:]
+    return session
+
+
+def test_validators_reused(counting_session):
+    '''Validators are prepared once and reused.'''
+    for _ in range(3):
+        assert counting_session.validate(USER) == []
+        assert counting_session.validate(INVALID_USER)
+
+    assert CountingValidator.created == ['harmony:/base', 'harmony:/user']
+
+
+def test_validators_reset_on_refresh(counting_session):
+    '''Refreshing discards prepared validators.'''
+    counting_session.validate(USER)
+    counting_session.refresh()
+    del CountingValidator.created[:]
+
+    counting_session.validate(USER)
+    assert CountingValidator.created == ['harmony:/base', 'harmony:/user']
+
+
+def test_validator_cache_size(counting_session):
+    '''Least recently used validators are discarded beyond cache size.'''
+    counting_session.validator_cache_size = 1
+    counting_session.validate(USER)
+    counting_session.validate(USER)
+
+    assert CountingValidator.created == [
+        'harmony:/base', 'harmony:/user'
+    ] * 2
+
+    del CountingValidator.created[:]
+    counting_session.validator_cache_size = 0
+    counting_session.validate(USER)
+    counting_session.validate(USER)
+
+    assert CountingValidator.created == [
+        'harmony:/base', 'harmony:/user'
+    ] * 2
+
+
+def test_validators_per_thread(counting_session):
+    '''Each thread prepares its own validators.'''
+    counting_session.validate(USER)
+    thread = threading.Thread(
+        target=lambda: counting_session.validate(USER)
+    )
+    thread.start()
+    thread.join()
+
+    assert CountingValidator.created == [
+        'harmony:/base', 'harmony:/user'
+    ] * 2
+
+
+def test_additional_schema_object_validator(counting_session):
+    '''Validators for schema objects are reused only for the same object.'''
+    schema = {'type': 'object', 'required': ['email']}
+    counting_session.validate(USER, [schema])
+    counting_session.validate(USER, [schema])
+    assert CountingValidator.created.count(None) == 1
+
+    assert len(counting_session.validate(USER, [copy.deepcopy(schema)])) == 1
+    assert CountingValidator.created.count(None) == 2
+
+
+@pytest.mark.parametrize('workers', [None, 2], ids=['serial', 'workers'])
+def test_validate_many(session, workers):
+    '''Results match validating each instance, in input order.'''
+    values = instances()
+    results = list(session.validate_many(
+        iter(values), workers=workers, chunksize=7
+    ))
+
+    assert [index for index, _ in results] == range(len(values))
+    for instance, (_, errors) in zip(values, results):
+        assert [describe(error) for error in errors] == [
+            describe(error) for error in session.validate(instance)
+        ]
+
+
+@pytest.mark.parametrize('workers', [None, 2], ids=['serial', 'workers'])
+def test_validate_many_additional_schemas(session, workers):
+    '''Errors from additional schemas refer to those schemas.'''
+    schema = {'type': 'object', 'required': ['email']}
+    results = list(session.validate_many(
+        [USER, INVALID_USER], [schema, 'harmony:/user'], workers=workers
+    ))
+
+    errors = results[0][1]
+    assert [error.validator for error in errors] == ['required']
+    assert errors[0].schema == schema
+
+    errors = results[1][1]
+    assert errors
+    assert all(
+        error.schema is session.schemas.get('harmony:/user')
+        for error in errors
+    )
+
+
+def test_validate_many_reads_progressively(session):
+    '''Instances are not read far ahead of results being consumed.'''
+    read = []
+
+    def generate():
+        '''Yield instances, recording how many were read.'''
+        for index in range(10000):
+            read.append(index)
+            yield USER
+
+    results = session.validate_many(generate(), workers=2, chunksize=10)
+    next(results)
+    assert len(read) <= 100
+    results.close()
+
+
+@pytest.mark.parametrize('workers', [None, 2], ids=['serial', 'workers'])
+def test_validate_many_flush(session, workers):
+    '''Results before a flush marker are yielded before reading further.'''
+    read = []
+
+    def generate():
+        '''Yield instances then flush, recording what was read.'''
+        for index in range(3):
+            read.append(index)
+            yield USER
+
+        yield FLUSH
+        read.append(3)
+        yield INVALID_USER
+
+    seen = []
+    for index, errors in session.validate_many(
+        generate(), workers=workers, chunksize=10
+    ):
+        seen.append((index, bool(errors), len(read) > 3))
+
+    assert seen == [
+        (0, False, False), (1, False, False), (2, False, False),
+        (3, True, True)
+    ]
+
+
+@pytest.mark.parametrize('max_errors', [0, -1])
+def test_max_errors_must_be_positive(session, max_errors):
+    '''Max errors below 1 raise ValueError.'''
+    with pytest.raises(ValueError):
+        session.validate(INVALID_USER, max_errors=max_errors)
+
+    with pytest.raises(ValueError):
+        list(session.validate_many([USER], max_errors=max_errors))
+
+
+@pytest.mark.parametrize('max_errors', [1, 2, 100])
+@pytest.mark.parametrize('workers', [None, 2], ids=['serial', 'workers'])
+def test_max_errors(session, max_errors, workers):
+    '''Validation stops with the first errors found.'''
+    schema = {'properties': {'email': {'type': 'string'}}}
+    expected = [
+        describe(error)
+        for error in session.validate(INVALID_USER, [schema])
+    ]
+    assert len(expected) > 2
+
+    assert [
+        describe(error) for error in
+        session.validate(INVALID_USER, [schema], max_errors=max_errors)
+    ] == expected[:max_errors]
+
+    [(_, errors)] = session.validate_many(
+        [INVALID_USER], [schema], workers=workers, max_errors=max_errors
+    )
+    assert [describe(error) for error in errors] == expected[:max_errors]
+
+
+def test_is_valid(session):
+    '''Instances are valid when they have no errors.'''
+    assert session.is_valid(USER)
+    assert not session.is_valid(INVALID_USER)
+    assert not session.is_valid(USER, [{'required': ['email']}])
+
+
+@pytest.mark.parametrize('value', ['0', '-1', 'x'])
+def test_max_errors_argument(value):
+    '''Command rejects max errors that are not positive integers.'''
+    with pytest.raises(SystemExit) as error:
+        command.main(['validate', '--max-errors', value])
+
+    assert error.value.code == 2